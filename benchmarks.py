@@ -0,0 +1,423 @@
+"""性能基准测试
+
+用合成持仓（N 个期权 × M 个交易日，可配置N/A比例）和本地日行情表替身服务（dce_stub_server.py）
+重复测量计算、保存/加载、各查询模式、刷新、预取和取消延迟，不访问大商所网站。
+界面启动在新的子进程中测量，分别报告导入耗时、窗口显示耗时和数据加载完成耗时（无显示器时使用 offscreen 平台）。
+结果可写入JSON，并与基线结果比较，中位数耗时超出基线 tolerance 比例时以非零状态退出。
+
+    python benchmarks.py --options 200 --dates 120 --json baseline.json
+    python benchmarks.py --baseline baseline.json --tolerance 0.2
+    python benchmarks.py --only query_all refresh
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from day_table import ParsePool
+from dce_stub_server import DceStubServer
+from position_engine import FetchCanceled, PositionEngine, copy_option
+from price_matrix import PriceMatrix, build_price_matrix
+from quote_cache import QuoteCache
+from service_loadtest import make_synthetic_book
+from task_scheduler import BACKGROUND, CancelToken, TaskScheduler
+
+
+class BenchContext:
+    """各基准共用的合成持仓、替身服务和临时目录"""
+
+    def __init__(self, args):
+        self.args = args
+        self.book = make_synthetic_book(args.options, args.dates, args.na_rate, args.seed)
+        self.query_date = (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.stub = DceStubServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                                  pages_dir=args.pages, seed=args.seed).start()
+        # 取消延迟基准使用响应很慢的替身服务，保证取消时请求仍在进行
+        self.slow_stub = DceStubServer(latency=5.0, seed=args.seed).start()
+        self.parse_pool = ParsePool(args.parse_workers)  # 各基准共用，避免重复启动进程
+
+    def engine(self, quotes_url=None, positions=True):
+        """新建引擎，持仓为合成持仓的副本；positions=False 时清空已计算的头寸"""
+        engine = PositionEngine(os.path.join(self.tmp_dir.name, "options_data.json"), QuoteCache(),
+                                quotes_url or self.stub.url, parse_pool=self.parse_pool)
+        engine.options = {name: copy_option(option) for name, option in self.book.items()}
+        if positions:
+            engine.recalculate_all()
+        return engine
+
+    def close(self):
+        self.stub.shutdown()
+        self.slow_stub.shutdown()
+        self.parse_pool.shutdown()
+        self.tmp_dir.cleanup()
+
+
+def measure(setup, run, repeat):
+    """重复 repeat 次：setup() 不计时，run(setup的返回值) 计时，返回 (各次耗时, 操作数)"""
+    times = []
+    ops = 0
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        ops = run(state)
+        times.append(time.perf_counter() - started)
+    return times, ops
+
+
+def bench_calculate_option_data(ctx):
+    def run(engine):
+        for option in list(engine.options.values()):
+            engine.calculate_option_data(option, ctx.query_date)
+        return len(engine.options)
+    return measure(lambda: ctx.engine(positions=False), run, ctx.args.repeat)
+
+
+def bench_recalculate_option_from_date(ctx):
+    def setup():
+        engine = ctx.engine()
+        return engine, [copy_option(option) for option in engine.options.values()]
+
+    def run(state):
+        engine, options = state
+        for option in options:
+            engine.recalculate_option_from_date(option, option["trade_dates"][0])
+        return len(options)
+    return measure(setup, run, ctx.args.repeat)
+
+
+def bench_save_data(ctx):
+    def run(engine):
+        engine.save_data()
+        return len(engine.options)
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_load_data(ctx):
+    ctx.engine().save_data()
+
+    def run(engine):
+        engine.load_data()
+        return len(engine.options)
+    return measure(lambda: PositionEngine(os.path.join(ctx.tmp_dir.name, "options_data.json")), run, ctx.args.repeat)
+
+
+def bench_save_snapshot(ctx):
+    file_name = os.path.join(ctx.tmp_dir.name, "options_data.dcesnap")
+
+    def run(engine):
+        engine.save_data(file_name)
+        return len(engine.options)
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_load_snapshot(ctx):
+    file_name = os.path.join(ctx.tmp_dir.name, "options_data.dcesnap")
+    ctx.engine().save_data(file_name)
+
+    def run(engine):
+        engine.load_data()
+        return len(engine.options)
+    return measure(lambda: PositionEngine(file_name), run, ctx.args.repeat)
+
+
+# 在新进程中启动界面：导入 main、显示窗口、等待后台加载完成，输出各阶段距进程内起点的秒数
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+imported = time.perf_counter()
+app = main.QApplication(sys.argv[:1])
+window = main.OptionPositionCalculator()
+window.engine.quotes_url = sys.argv[2]  # 加载后的预取访问替身服务
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+while not window.data_ready:
+    app.processEvents()
+    time.sleep(0.001)
+loaded = time.perf_counter()
+print(json.dumps({"import": imported - started, "window": shown - started, "data": loaded - started,
+                  "options": len(window.options)}))
+window.close()
+"""
+
+
+def startup_runs(ctx):
+    """在临时目录中启动 repeat 次界面，结果缓存在 ctx 上供三个启动基准共用"""
+    if getattr(ctx, "startup", None) is None:
+        work_dir = os.path.join(ctx.tmp_dir.name, "startup")
+        os.makedirs(work_dir, exist_ok=True)
+        engine = ctx.engine()
+        engine.save_data(os.path.join(work_dir, "options_data.json"))
+        env = dict(os.environ)
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        ctx.startup = []
+        for _ in range(ctx.args.repeat):
+            output = subprocess.run([sys.executable, "-c", STARTUP_PROBE, repo_dir, ctx.stub.url], cwd=work_dir,
+                                    env=env, capture_output=True, text=True, check=True, timeout=120).stdout
+            ctx.startup.append(json.loads(output.strip().splitlines()[-1]))
+    return ctx.startup
+
+
+def bench_startup_import(ctx):
+    runs = startup_runs(ctx)
+    return [run["import"] for run in runs], runs[-1]["options"]
+
+
+def bench_startup_window(ctx):
+    runs = startup_runs(ctx)
+    return [run["window"] for run in runs], runs[-1]["options"]
+
+
+def bench_startup_data(ctx):
+    runs = startup_runs(ctx)
+    return [run["data"] for run in runs], runs[-1]["options"]
+
+
+def bench_query_single(ctx):
+    name = sorted(ctx.book)[0]
+
+    def run(engine):
+        results, _ = engine.run_query(ctx.query_date, name)
+        return len(results["single_option"])
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_query_all(ctx):
+    def run(engine):
+        results, _ = engine.run_query(ctx.query_date)
+        return results["active_count"] + results["expired_count"]
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_query_keyword(ctx):
+    def run(engine):
+        results, _ = engine.run_query(ctx.query_date, keyword="合成期权000", is_keyword_query=True)
+        return results["active_count"] + results["expired_count"]
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def refresh_all(engine, query_date, scheduler, token):
+    """与界面的刷新相同：一个后台任务按 (期权, 日期) 重新获取（各日期并发获取），返回 (任务, 刷新项数)"""
+    pairs = [(option, trade_date) for option in engine.options.values()
+             for trade_date in option["trade_dates"] if trade_date <= query_date]
+
+    def refresh(token):
+        try:
+            return sum(1 for _ in engine.iter_refresh_prices(pairs, token))
+        except FetchCanceled:
+            return None
+
+    return scheduler.submit(refresh, BACKGROUND, token=token), len(pairs)
+
+
+def bench_refresh(ctx):
+    def run(engine):
+        scheduler = TaskScheduler(workers=4)
+        try:
+            task, count = refresh_all(engine, ctx.query_date, scheduler, CancelToken())
+            task.wait()
+        finally:
+            scheduler.shutdown()
+        return count
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_prefetch(ctx):
+    def setup():
+        engine = ctx.engine()
+        # 清空收盘价，模拟从未获取过行情的持仓
+        for option in engine.options.values():
+            option["close_prices"] = {}
+        return engine
+
+    def run(engine):
+        return len(engine.prefetch_missing(ctx.query_date))
+    return measure(setup, run, ctx.args.repeat)
+
+
+def bench_price_matrix(ctx):
+    """由预取填满的行情缓存构建价格矩阵后，内存映射打开并批量查找每个 (期权, 交易日) 的价格"""
+    engine = ctx.engine()
+    for option in engine.options.values():
+        option["close_prices"] = {}
+    engine.prefetch_missing(ctx.query_date)
+    directory = os.path.join(ctx.tmp_dir.name, "price_matrix")
+    build_price_matrix(engine.quote_cache, directory)
+    options = list(engine.options.values())
+
+    def run(matrix):
+        for option in options:
+            matrix.lookup_many([option["code"]], option["trade_dates"])
+        return sum(len(option["trade_dates"]) for option in options)
+    return measure(lambda: PriceMatrix(directory), run, ctx.args.repeat)
+
+
+def bench_valuation(ctx):
+    """整个持仓全部 (期权, 交易日) 的 Black-76 理论价格和希腊值"""
+    from option_valuation import ValuationParams, value_book
+    params = ValuationParams(0.2, 0.02, {"m": {"30": 0.25, "180": 0.18}})
+
+    def run(engine):
+        book = value_book(engine.options, params)
+        return len(book.columns["delta"])
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_exposure(ctx):
+    """按期货合约汇总全部 (期权, 交易日) 的净头寸（首次汇总，整体分组求和）"""
+    def run(engine):
+        return len(engine.exposure_rows("code"))
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_exposure_incremental(ctx):
+    """修改一个期权的平仓量后再次汇总，只重新计算该期权的贡献"""
+    def setup():
+        engine = ctx.engine()
+        engine.exposure_rows("code")
+        option = next(iter(engine.options.values()))
+        engine.set_daily_values({option["name"]: {"close_amounts": {option["trade_dates"][0]: -1}}})
+        return engine
+
+    def run(engine):
+        return len(engine.exposure_rows("code"))
+    return measure(setup, run, ctx.args.repeat)
+
+
+def bench_pnl(ctx):
+    """全部期权的逐日损益归因和组合逐日合计（首次计算）"""
+    def run(engine):
+        return len(engine.pnl_rows())
+    return measure(ctx.engine, run, ctx.args.repeat)
+
+
+def bench_cancel_latency(ctx):
+    """刷新进行中请求取消，到所有任务结束（排队任务清空、进行中的请求中止）的耗时"""
+    def setup():
+        return ctx.engine(quotes_url=ctx.slow_stub.url), TaskScheduler(workers=4)
+
+    times = []
+    ops = 0
+    for _ in range(ctx.args.repeat):
+        engine, scheduler = setup()
+        token = CancelToken()
+        task, ops = refresh_all(engine, ctx.query_date, scheduler, token)
+        time.sleep(0.2)
+        started = time.perf_counter()
+        token.cancel()
+        scheduler.drain(token)
+        task.wait()
+        times.append(time.perf_counter() - started)
+        scheduler.shutdown()
+    return times, ops
+
+
+BENCHMARKS = {
+    "calculate_option_data": bench_calculate_option_data,
+    "recalculate_option_from_date": bench_recalculate_option_from_date,
+    "save_data": bench_save_data,
+    "load_data": bench_load_data,
+    "save_snapshot": bench_save_snapshot,
+    "load_snapshot": bench_load_snapshot,
+    "query_single": bench_query_single,
+    "query_all": bench_query_all,
+    "query_keyword": bench_query_keyword,
+    "refresh": bench_refresh,
+    "prefetch": bench_prefetch,
+    "price_matrix": bench_price_matrix,
+    "valuation": bench_valuation,
+    "exposure": bench_exposure,
+    "exposure_incremental": bench_exposure_incremental,
+    "pnl": bench_pnl,
+    "cancel_latency": bench_cancel_latency,
+    "startup_import": bench_startup_import,
+    "startup_window": bench_startup_window,
+    "startup_data": bench_startup_data,
+}
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较中位数耗时，返回超出 tolerance 的基准名称列表"""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base["median_s"]:
+            continue
+        ratio = stats["median_s"] / base["median_s"]
+        stats["baseline_median_s"] = base["median_s"]
+        stats["ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    parser.add_argument("--options", type=int, default=200, help="合成持仓的期权数量")
+    parser.add_argument("--dates", type=int, default=120, help="每个期权的交易日数量")
+    parser.add_argument("--na-rate", type=float, default=0.05, help="合成收盘价中N/A的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="每个基准的重复次数")
+    parser.add_argument("--latency", type=float, default=0.02, help="替身服务每个请求的延迟秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="替身服务额外随机延迟的上限秒数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="替身服务请求失败的比例")
+    parser.add_argument("--pages", help="替身服务回放的录制页面目录")
+    parser.add_argument("--parse-workers", type=int, help="解析进程数，0表示在下载线程中解析，默认按CPU核数")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="只运行指定的基准")
+    parser.add_argument("--json", help="将结果写入JSON文件")
+    parser.add_argument("--baseline", help="用于比较的基线结果JSON文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许比基线慢的比例")
+    args = parser.parse_args(argv)
+
+    ctx = BenchContext(args)
+    results = {}
+    try:
+        for name, bench in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            times, ops = bench(ctx)
+            median = statistics.median(times)
+            results[name] = {"runs": times, "median_s": median, "min_s": min(times), "ops": ops,
+                             "per_op_us": median / ops * 1e6 if ops else None}
+            print(f"{name:<30} median={median * 1000:9.1f}ms min={min(times) * 1000:9.1f}ms ops={ops}")
+        stub_stats = {"requests": ctx.stub.requests, "failures": ctx.stub.failures}
+    finally:
+        ctx.close()
+
+    report = {
+        "meta": {"options": args.options, "dates": args.dates, "na_rate": args.na_rate, "seed": args.seed,
+                 "repeat": args.repeat, "latency": args.latency, "jitter": args.jitter,
+                 "failure_rate": args.failure_rate, "parse_workers": ctx.parse_pool.workers, "python": platform.python_version(),
+                 "platform": platform.platform(), "stub": stub_stats},
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, stats in results.items():
+            if "ratio" in stats:
+                flag = "超出基线" if name in regressions else "OK"
+                print(f"{name:<30} {stats['ratio']:.2f}x 基线 {flag}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""日行情表页面解析
+
+解析整张页面是CPU密集的，在线程中会占用GIL，使其他线程无法同时下载。
+ParsePool 把解析放到独立的进程池中，下载线程只负责网络，两个阶段的规模分别设置。
+本模块只依赖 pandas，子进程不会导入界面和网络相关的模块。
+解析结果 DayTable 保留页面中全部数值列（开盘价、结算价、成交量、持仓量等），以后需要其他字段时不必重新获取。
+"""
+import math
+import os
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+
+
+PAGE_MARKER = "大连商品交易所  日行情表"
+
+CLOSE = "收盘价"
+SETTLEMENT = "结算价"
+PRICE_FIELDS = (CLOSE, SETTLEMENT)  # 可用于计算头寸的价格字段
+TEXT_COLUMNS = ("商品名称", "合约名称")
+
+
+class DayTable:
+    """一日行情表的全部数值列
+
+    合约按行、字段按列，数值按行连续存放在一个 array('d') 中，缺失值为 NaN，
+    比逐合约的字典省内存，也可以直接在进程间传递。
+    """
+
+    __slots__ = ("fields", "contracts", "values", "_field_index")
+
+    def __init__(self, fields, contracts, values):
+        self.fields = tuple(fields)
+        self.contracts = contracts  # {合约名称(小写): 行号}
+        self.values = values if isinstance(values, array) else array('d', values)
+        self._field_index = {field: index for index, field in enumerate(self.fields)}
+
+    def __len__(self):
+        return len(self.contracts)
+
+    def __contains__(self, contract):
+        return contract in self.contracts
+
+    def __getstate__(self):
+        return self.fields, self.contracts, self.values
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @classmethod
+    def from_rows(cls, fields, rows):
+        """由 {合约名称(小写): [各字段数值或None]} 构建"""
+        contracts = {}
+        values = array('d')
+        for contract, row in rows.items():
+            contracts[contract] = len(contracts)
+            values.extend(math.nan if value is None else value for value in row)
+        return cls(fields, contracts, values)
+
+    def has_field(self, field):
+        return field in self._field_index
+
+    def get(self, contract, field=CLOSE):
+        """合约某字段的值，合约或字段不存在、值缺失时返回None"""
+        row = self.contracts.get(contract)
+        column = self._field_index.get(field)
+        if row is None or column is None:
+            return None
+        value = self.values[row * len(self.fields) + column]
+        return None if math.isnan(value) else value
+
+    def column(self, field=CLOSE):
+        """某字段所有合约的值 {合约名称(小写): 值或None}，字段不存在时返回None"""
+        column = self._field_index.get(field)
+        if column is None:
+            return None
+        width = len(self.fields)
+        return {contract: (None if math.isnan(value) else value)
+                for contract, value in zip(self.contracts, self.values[column::width])}
+
+    def row(self, contract):
+        """合约所有字段的值 {字段: 值或None}，合约不存在时返回None"""
+        row = self.contracts.get(contract)
+        if row is None:
+            return None
+        width = len(self.fields)
+        return {field: (None if math.isnan(value) else value)
+                for field, value in zip(self.fields, self.values[row * width:(row + 1) * width])}
+
+    def to_json(self):
+        return {"fields": list(self.fields), "contracts": list(self.contracts),
+                "values": [None if math.isnan(value) else value for value in self.values]}
+
+    @classmethod
+    def from_json(cls, entry):
+        if "closes" in entry:
+            # 旧版缓存只保存了收盘价
+            return cls.from_rows((CLOSE,), {contract: [close] for contract, close in entry["closes"].items()})
+        contracts = {contract: index for index, contract in enumerate(entry["contracts"])}
+        return cls(entry["fields"], contracts,
+                   array('d', (math.nan if value is None else value for value in entry["values"])))
+
+
+def parse_day_table(text):
+    """解析日行情表页面，保留全部数值列，返回 DayTable；表格格式不符时抛出 ValueError"""
+    import pandas as pd  # 导入较慢，第一次解析时才导入，不拖慢界面启动
+    df = pd.read_html(StringIO(text), header=0)[0]
+    df.columns = [str(col).strip() for col in df.columns]
+
+    if '合约名称' not in df.columns or CLOSE not in df.columns:
+        raise ValueError("日行情表缺少合约名称或收盘价列")
+
+    df = df[df['合约名称'].notna()]  # 总计行没有合约名称
+    names = df['合约名称'].astype(str).str.strip().str.lower()
+    keep = ~names.duplicated()
+    df, contracts = df[keep], names[keep]
+    # "-" 等非数字的值（如无成交合约的价格）记为缺失
+    numeric = {column: pd.to_numeric(df[column], errors='coerce')
+               for column in df.columns if column not in TEXT_COLUMNS}
+    fields = [column for column, values in numeric.items() if column == CLOSE or values.notna().any()]
+    matrix = pd.DataFrame({field: numeric[field] for field in fields}).to_numpy(dtype='float64')
+    return DayTable(fields, {contract: index for index, contract in enumerate(contracts)},
+                    array('d', matrix.ravel().tobytes()))
+
+
+def default_parse_workers():
+    """默认解析进程数：保留一个核心给界面和下载线程，最多4个；单核时在下载线程中解析"""
+    return max(0, min(4, (os.cpu_count() or 1) - 1))
+
+
+class ParsePool:
+    """解析进程池，首次使用时才启动；workers=0 时在调用线程中解析"""
+
+    def __init__(self, workers=None):
+        self.workers = default_parse_workers() if workers is None else workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def parse(self, text, token=None, canceled=None):
+        """解析页面；token 取消时不再等待结果，抛出 canceled()"""
+        if not self.workers:
+            return parse_day_table(text)
+
+        try:
+            future = self._get_executor().submit(parse_day_table, text)
+        except (BrokenProcessPool, RuntimeError):
+            # 进程池不可用（子进程异常退出等）时退回在当前线程解析
+            self.shutdown()
+            return parse_day_table(text)
+
+        if token is not None:
+            done = threading.Event()
+            future.add_done_callback(lambda _: done.set())
+            token.add_callback(done.set)
+            try:
+                done.wait()
+            finally:
+                token.remove_callback(done.set)
+            if not future.done():
+                future.cancel()
+                raise canceled()
+
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self.shutdown()
+            return parse_day_table(text)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
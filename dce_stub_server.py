@@ -0,0 +1,214 @@
+"""本地大商所日行情表替身服务
+
+按与大商所网站相同的查询参数返回日行情表页面，用于基准测试和离线调试，不访问真实网站。
+优先回放 --pages 目录中录制的页面（文件名 YYYYMMDD.html），没有录制的日期按合约和日期生成确定的行情。
+可配置响应延迟和失败率，失败时随机返回HTTP 500或不含行情表的页面。
+
+    python dce_stub_server.py --port 8800 --latency 0.05 --failure-rate 0.02 --pages recorded/
+    DCE_QUOTES_URL=http://127.0.0.1:8800/ python main.py
+
+录制真实页面：
+
+    python dce_stub_server.py record --date 2024-06-28 --pages recorded/
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+PAGE_MARKER = "大连商品交易所  日行情表"
+VARIETIES = [("豆一", "a"), ("豆二", "b"), ("豆粕", "m"), ("豆油", "y"), ("棕榈油", "p"),
+             ("玉米", "c"), ("铁矿石", "i"), ("焦炭", "j"), ("焦煤", "jm")]
+MONTHS = [f"{year}{month:02d}" for year in (24, 25) for month in range(1, 13)]
+COLUMNS = ["商品名称", "合约名称", "开盘价", "最高价", "最低价", "收盘价", "前结算价", "结算价",
+           "涨跌", "涨跌1", "成交量", "持仓量", "持仓量变化", "成交额"]
+
+
+def synthetic_row(variety_name, code, date):
+    """按合约和日期生成确定的一行行情"""
+    rng = random.Random(zlib.crc32(f"{code}{date}".encode("utf-8")))
+    base = 2000 + zlib.crc32(code.encode("utf-8")) % 4000
+    prev_settle = round(base * rng.uniform(0.95, 1.05))
+    open_price = round(prev_settle * rng.uniform(0.98, 1.02))
+    close_price = round(prev_settle * rng.uniform(0.97, 1.03))
+    high = max(open_price, close_price) + rng.randint(0, 30)
+    low = min(open_price, close_price) - rng.randint(0, 30)
+    settle = round((open_price + close_price + high + low) / 4)
+    volume = rng.randint(0, 200000)
+    return [variety_name, code, open_price, high, low, close_price, prev_settle, settle,
+            close_price - prev_settle, settle - prev_settle, volume, rng.randint(0, 500000),
+            rng.randint(-20000, 20000), round(volume * settle * 10 / 10000, 2)]
+
+
+def synthetic_page(date):
+    """生成某日的日行情表页面，date 格式 YYYYMMDD"""
+    rows = []
+    for variety_name, variety in VARIETIES:
+        variety_rows = [synthetic_row(variety_name, f"{variety}{month}", date) for month in MONTHS]
+        rows.extend(variety_rows)
+        rows.append([f"{variety_name}小计", "", "", "", "", "", "", "", "", "",
+                     sum(row[10] for row in variety_rows), sum(row[11] for row in variety_rows), "", ""])
+    header = "".join(f"<th>{column}</th>" for column in COLUMNS)
+    body = "".join("<tr>" + "".join(f"<td>{value}</td>" for value in row) + "</tr>" for row in rows)
+    return (f"<html><head><meta charset='utf-8'></head><body><div>{PAGE_MARKER}</div>"
+            f"<div>日期：{date}</div><table><tr>{header}</tr>{body}</table></body></html>")
+
+
+def request_date(query):
+    """从大商所查询参数（月份从0开始）取出日期 YYYYMMDD，参数不全时返回None"""
+    try:
+        year = int(query["year"][0])
+        month = int(query["month"][0]) + 1
+        day = int(query["day"][0])
+    except (KeyError, ValueError):
+        return None
+    return f"{year:04d}{month:02d}{day:02d}"
+
+
+class DceStubServer:
+    """日行情表替身服务，可在进程内启动"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 pages_dir=None, seed=0):
+        self.latency = latency  # 每个请求的固定延迟（秒）
+        self.jitter = jitter  # 在固定延迟上增加 0~jitter 秒的随机延迟
+        self.failure_rate = failure_rate
+        self.pages_dir = pages_dir
+        self.requests = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages = {}
+        self.server = ThreadingHTTPServer((host, port), DceStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/publicweb/quotesdata/dayQuotesCh.html"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="dce-stub", daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def page(self, date):
+        page = self._pages.get(date)
+        if page is None:
+            path = os.path.join(self.pages_dir, f"{date}.html") if self.pages_dir else None
+            if path and os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    page = f.read()
+            else:
+                page = synthetic_page(date)
+            self._pages[date] = page
+        return page
+
+    def next_response(self, date):
+        """返回 (延迟秒数, 失败类型或None)"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            failure = None
+            if date is None:
+                failure = "empty"
+            elif self._rng.random() < self.failure_rate:
+                failure = self._rng.choice(["error", "empty"])
+            if failure:
+                self.failures += 1
+        return delay, failure
+
+
+class DceStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        date = request_date(parse_qs(urlparse(self.path).query))
+        delay, failure = stub.next_response(date)
+        if delay:
+            time.sleep(delay)
+
+        if failure == "error":
+            status, text = 500, "<html><body>Internal Server Error</body></html>"
+        elif failure == "empty":
+            status, text = 200, "<html><body>暂无数据</body></html>"
+        else:
+            status, text = 200, stub.page(date)
+
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def record_page(date, pages_dir):
+    """从大商所网站录制某日的日行情表页面"""
+    from position_engine import DCE_DAY_QUOTES_URL, fetch_text
+
+    date_yyyymmdd = date.replace("-", "")
+    text = fetch_text(DCE_DAY_QUOTES_URL, {
+        "dayQuotes.variety": "all",
+        "dayQuotes.trade_type": "0",
+        "year": date_yyyymmdd[:4],
+        "month": str(int(date_yyyymmdd[4:6]) - 1),
+        "day": date_yyyymmdd[6:8],
+    })
+    if PAGE_MARKER not in text:
+        return None
+    os.makedirs(pages_dir, exist_ok=True)
+    path = os.path.join(pages_dir, f"{date_yyyymmdd}.html")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地大商所日行情表替身服务")
+    subparsers = parser.add_subparsers(dest="command")
+    record_parser = subparsers.add_parser("record", help="从大商所网站录制日行情表页面")
+    record_parser.add_argument("--date", required=True, action="append", help="日期YYYY-MM-DD，可重复指定")
+    record_parser.add_argument("--pages", required=True, help="保存页面的目录")
+
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外随机延迟的上限秒数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="请求失败的比例")
+    parser.add_argument("--pages", help="录制页面目录（文件名 YYYYMMDD.html）")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        failed = False
+        for date in args.date:
+            path = record_page(date, args.pages)
+            print(f"{date}: {path or '行情表不可用'}")
+            failed = failed or path is None
+        return 1 if failed else 0
+
+    stub = DceStubServer(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.pages)
+    print(f"日行情表替身服务已启动: {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""行情获取审计日志
+
+每次获取日行情表（包括命中缓存）写一行紧凑的JSON到滚动日志文件，用于分析大商所网站的延迟和失败率：
+
+    {"ts": 时间戳, "date": 交易日期, "cache": "hit"/"miss", "status": HTTP状态码, "bytes": 字节数,
+     "ms": 网络耗时, "parse_ms": 解析耗时, "fail": 失败类型或null}
+
+    python main.py fetch-report --log fetch_audit.log --days 7
+"""
+import glob
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+
+# 失败类型
+FAILURE_TIMEOUT = "timeout"
+FAILURE_CONNECTION = "connection"
+FAILURE_HTTP = "http_error"  # HTTP状态码 >= 400
+FAILURE_UNAVAILABLE = "unavailable"  # 页面中没有日行情表（未发布、非交易日等）
+FAILURE_PARSE = "parse_error"
+FAILURE_CANCELED = "canceled"
+FAILURE_BACKOFF = "backoff"  # 连续失败后的暂停期内，未访问网络
+FAILURE_OTHER = "other"
+
+
+def classify_exception(error):
+    import requests  # 发生过请求才会出错，此时已导入
+
+    if isinstance(error, requests.Timeout):
+        return FAILURE_TIMEOUT
+    if isinstance(error, requests.ConnectionError):
+        return FAILURE_CONNECTION
+    return FAILURE_OTHER
+
+
+class FetchAuditLog:
+    """按大小滚动的审计日志，写入线程安全"""
+
+    def __init__(self, path="fetch_audit.log", max_bytes=5 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                            encoding="utf-8", delay=True)
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._lock = threading.Lock()
+
+    def record(self, trade_date, cache, status=None, bytes=0, ms=None, parse_ms=None, fail=None):
+        entry = {"ts": round(time.time(), 3), "date": trade_date, "cache": cache, "status": status,
+                 "bytes": bytes, "ms": None if ms is None else round(ms, 1),
+                 "parse_ms": None if parse_ms is None else round(parse_ms, 1), "fail": fail}
+        message = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._handler.emit(logging.makeLogRecord({"msg": message, "levelno": logging.INFO}))
+
+    def close(self):
+        self._handler.close()
+
+
+def read_records(path):
+    """按时间顺序读取日志及其滚动备份中的记录"""
+    backups = [name for name in glob.glob(f"{glob.escape(path)}.*") if name.rsplit(".", 1)[1].isdigit()]
+    backups.sort(key=lambda name: -int(name.rsplit(".", 1)[1]))  # 编号越大越旧
+    for file_name in backups + [path]:
+        try:
+            with open(file_name, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(records, by="fetch"):
+    """按天汇总：by="fetch" 按获取日期，by="trade" 按交易日期
+
+    返回 {日期: {"attempts", "hits", "misses", "p50_ms", "p95_ms", "p99_ms", "parse_p50_ms",
+                 "mean_bytes", "failures": {失败类型: 次数}}}，延迟只统计实际的网络请求。
+    """
+    days = {}
+    for record in records:
+        if by == "trade":
+            day = record["date"]
+        else:
+            day = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d")
+        group = days.setdefault(day, {"attempts": 0, "hits": 0, "ms": [], "parse_ms": [], "bytes": [],
+                                      "failures": {}})
+        group["attempts"] += 1
+        if record["cache"] == "hit":
+            group["hits"] += 1
+            continue
+        if record.get("ms") is not None:
+            group["ms"].append(record["ms"])
+        if record.get("parse_ms") is not None:
+            group["parse_ms"].append(record["parse_ms"])
+        if record.get("bytes"):
+            group["bytes"].append(record["bytes"])
+        if record.get("fail"):
+            group["failures"][record["fail"]] = group["failures"].get(record["fail"], 0) + 1
+
+    summary = {}
+    for day, group in sorted(days.items()):
+        summary[day] = {
+            "attempts": group["attempts"], "hits": group["hits"], "misses": group["attempts"] - group["hits"],
+            "p50_ms": percentile(group["ms"], 50), "p95_ms": percentile(group["ms"], 95),
+            "p99_ms": percentile(group["ms"], 99), "parse_p50_ms": percentile(group["parse_ms"], 50),
+            "mean_bytes": sum(group["bytes"]) / len(group["bytes"]) if group["bytes"] else None,
+            "failures": group["failures"],
+        }
+    return summary
+
+
+def format_report(summary):
+    def ms(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    lines = [f"{'日期':<12}{'次数':>8}{'命中':>8}{'请求':>8}{'p50ms':>8}{'p95ms':>8}{'p99ms':>8}"
+             f"{'解析p50':>9}{'平均KB':>9}  失败"]
+    for day, row in summary.items():
+        mean_kb = "-" if row["mean_bytes"] is None else f"{row['mean_bytes'] / 1024:.0f}"
+        failures = ", ".join(f"{name} {count}" for name, count in sorted(row["failures"].items())) or "-"
+        lines.append(f"{day:<12}{row['attempts']:>8}{row['hits']:>8}{row['misses']:>8}{ms(row['p50_ms']):>8}"
+                     f"{ms(row['p95_ms']):>8}{ms(row['p99_ms']):>8}{ms(row['parse_p50_ms']):>9}{mean_kb:>9}  {failures}")
+    return "\n".join(lines)
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from perf_stats import stats
+
+
+class FetchController:
+    """大商所请求的自适应并发和超时控制
+
+    - 并发上限按 AIMD 调整：请求成功且延迟正常时每轮加一，失败（超时、连接错误、5xx/429）
+      或延迟明显高于近期中位数时减半（延迟偏高时减少 1/4）。
+    - 超时取近期成功请求 p99 的若干倍，限制在 [min_timeout, max_timeout] 内，样本不足时用 max_timeout。
+    - 连续失败达到 backoff_after 次后暂停所有请求，暂停时间从 1 秒起每次加倍，成功一次后恢复；
+      暂停期间的请求直接失败而不访问网络（见 paused()），避免界面等待。
+    """
+
+    CONGESTION_FAILURES = ("timeout", "connection", "http_error")
+
+    def __init__(self, initial_limit=2, min_limit=1, max_limit=8, min_timeout=2.0, max_timeout=10.0,
+                 timeout_factor=3.0, window=100, backoff_after=5, max_backoff=60.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.backoff_after = backoff_after
+        self.max_backoff = max_backoff
+        self.limit = float(initial_limit)  # 当前并发上限（取整后生效）
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self._latencies = deque(maxlen=window)  # 近期成功请求的延迟（秒）
+        self._cond = threading.Condition()
+        self._publish()
+
+    @property
+    def timeout(self):
+        """按近期延迟分位数得到的请求超时（秒）"""
+        with self._cond:
+            return self._timeout()
+
+    def _timeout(self):
+        if len(self._latencies) < 10:
+            return self.max_timeout
+        ordered = sorted(self._latencies)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def _median(self):
+        ordered = sorted(self._latencies)
+        return ordered[len(ordered) // 2] if ordered else None
+
+    def paused(self):
+        """是否处于连续失败后的暂停期"""
+        return time.monotonic() < self.paused_until
+
+    @contextmanager
+    def slot(self, token=None, canceled=None):
+        """等待并占用一个请求名额，产出本次请求应使用的超时；token 取消时抛出 canceled()"""
+        with self._cond:
+            while True:
+                if token is not None and token.is_canceled():
+                    raise canceled()
+                if self.in_flight < max(self.min_limit, int(self.limit)):
+                    break
+                self._cond.wait(0.05)
+            self.in_flight += 1
+            timeout = self._timeout()
+        try:
+            yield timeout
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def observe(self, elapsed, failure=None, status=None):
+        """记录一次请求的结果，failure 为 fetch_audit 中的失败类型，status 为 HTTP 状态码"""
+        congestion = failure in self.CONGESTION_FAILURES
+        if failure == "http_error" and status is not None and status < 500 and status != 429:
+            congestion = False  # 404 等客户端错误与网站负载无关
+        with self._cond:
+            if congestion:
+                self.consecutive_failures += 1
+                self.limit = max(self.min_limit, self.limit / 2)
+                stats.count("fetch.limit_decrease")
+                if self.consecutive_failures >= self.backoff_after:
+                    self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else 1.0)
+                    self.paused_until = time.monotonic() + self.backoff
+                    stats.count("fetch.backoff")
+            elif failure not in ("canceled", "http_error"):
+                self.consecutive_failures = 0
+                self.backoff = 0.0
+                median = self._median()
+                self._latencies.append(elapsed)
+                if median is not None and len(self._latencies) >= 10 and elapsed > median * 3:
+                    self.limit = max(self.min_limit, self.limit * 0.75)
+                    stats.count("fetch.limit_decrease")
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / max(1.0, self.limit))
+            self._publish()
+            self._cond.notify_all()
+
+    def _publish(self):
+        stats.gauge("fetch.limit", round(self.limit, 2))
+        stats.gauge("fetch.timeout_s", round(self._timeout(), 2))
+        stats.gauge("fetch.backoff_s", self.backoff)
+
+    def snapshot(self):
+        with self._cond:
+            return {"limit": self.limit, "in_flight": self.in_flight, "timeout": self._timeout(),
+                    "consecutive_failures": self.consecutive_failures, "backoff": self.backoff,
+                    "paused_for": max(0.0, self.paused_until - time.monotonic())}
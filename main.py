@@ -1,15 +1,31 @@
 import sys
+import csv
 import json
+import multiprocessing
+import time
+import argparse
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QLineEdit, QPushButton, QTableWidget, QTableWidgetItem,
                              QDateEdit, QComboBox, QMessageBox, QTabWidget, QHeaderView,
                              QFileDialog, QInputDialog, QFrame, QDialog, QGridLayout,
-                             QProgressBar)
-from PyQt5.QtCore import QDate, Qt, QThread, pyqtSignal, pyqtSlot
-import requests
-import pandas as pd
-from io import StringIO
-from datetime import datetime, timedelta
+                             QProgressBar, QTableView, QAbstractItemView, QActionGroup, QCheckBox,
+                             QDoubleSpinBox)
+from PyQt5.QtCore import (QDate, Qt, QObject, QTimer, pyqtSignal, pyqtSlot, QAbstractTableModel, QModelIndex,
+                          QSortFilterProxyModel, QSettings)
+from datetime import timedelta
+
+from position_engine import (PositionEngine, ProgressReporter, QueryError, filter_options, latest_published_date,
+                             FetchCanceled)
+from day_table import CLOSE, PRICE_FIELDS, SETTLEMENT, ParsePool
+from fetch_audit import FetchAuditLog, format_report, read_records, summarize
+from perf_stats import stats
+from position_export import ExportError, export_positions
+from quote_cache import QuoteCache
+from task_scheduler import BACKGROUND, INTERACTIVE, PREFETCH, PRIORITY_NAMES, CancelToken, TaskScheduler
+
+
+PRICE_FIELD_ARGS = {"close": CLOSE, "settlement": SETTLEMENT}  # 命令行 --price-field 的取值
+DATA_FILE_FILTER = "JSON文件 (*.json);;快照文件（加载更快） (*.dcesnap)"
 
 
 class BatchAddDatesDialog(QDialog):
@@ -59,8 +75,267 @@ class BatchAddDatesDialog(QDialog):
         return dates
 
 
-class DataRefreshThread(QThread):
-    """用于刷新市场数据的线程，避免UI卡顿"""
+class CloseBlotterDialog(QDialog):
+    """批量导入平仓记录：选择表格后预览按 (期权, 日期) 合并的记录，确认后一次写入"""
+
+    def __init__(self, options, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("批量导入平仓记录")
+        self.resize(700, 500)
+        self.options = options
+        self.rows = []
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+
+        file_layout = QHBoxLayout()
+        self.file_label = QLabel("表头: 期权名称, 日期, 平仓量, 收盘价（平仓量和收盘价至少填一项）")
+        file_layout.addWidget(self.file_label)
+        file_layout.addStretch()
+        choose_btn = QPushButton("选择文件...")
+        choose_btn.clicked.connect(self.choose_file)
+        file_layout.addWidget(choose_btn)
+        layout.addLayout(file_layout)
+
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(["期权名称", "日期", "平仓量", "收盘价"])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        self.summary_label = QLabel("同一期权同一日期的多行平仓量相加，替换该日原有的平仓量")
+        layout.addWidget(self.summary_label)
+
+        btn_layout = QHBoxLayout()
+        btn_layout.addStretch()
+        self.ok_btn = QPushButton("导入")
+        self.ok_btn.setEnabled(False)
+        self.ok_btn.clicked.connect(self.accept)
+        btn_layout.addWidget(self.ok_btn)
+        cancel_btn = QPushButton("取消")
+        cancel_btn.clicked.connect(self.reject)
+        btn_layout.addWidget(cancel_btn)
+        layout.addLayout(btn_layout)
+
+        self.setLayout(layout)
+
+    def choose_file(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "选择平仓记录", "", "表格文件 (*.csv *.xlsx *.xls)")
+        if not file_name:
+            return
+        self.file_label.setText(file_name)
+        from option_import import OptionImportError, load_close_table  # 依赖 pandas，用到时才导入
+        try:
+            self.rows = load_close_table(file_name, self.options)
+        except OptionImportError as e:
+            self.rows = []
+            shown = "\n".join(str(e).splitlines()[:20])
+            more = f"\n……共 {len(e.errors)} 处错误" if len(e.errors) > 20 else ""
+            QMessageBox.warning(self, "导入失败", f"表格中有错误：\n\n{shown}{more}")
+        except Exception as e:
+            self.rows = []
+            QMessageBox.warning(self, "错误", f"读取表格失败: {str(e)}")
+        self.show_rows()
+
+    def show_rows(self):
+        def text(value):
+            return "" if value is None else f"{value:g}"
+
+        self.table.setRowCount(len(self.rows))
+        for index, row in enumerate(self.rows):
+            for column, value in enumerate((row["name"], row["date"], text(row["close_amount"]),
+                                            text(row["close_price"]))):
+                self.table.setItem(index, column, QTableWidgetItem(value))
+        options = len({row["name"] for row in self.rows})
+        self.summary_label.setText(f"共 {len(self.rows)} 条记录，涉及 {options} 个期权" if self.rows
+                                   else "没有可导入的记录")
+        self.ok_btn.setEnabled(bool(self.rows))
+
+
+class PerfStatsDialog(QDialog):
+    """性能统计：各阶段计时区间的次数和耗时分布，以及计数器"""
+    SPAN_LABELS = {
+        "query.total": "查询总耗时",
+        "query.check": "查询-检查N/A",
+        "query.refetch": "查询-重新获取（每个日期）",
+        "query.compute": "查询-计算（每个期权）",
+        "fetch.network": "获取行情-网络",
+        "fetch.parse": "获取行情-解析HTML",
+        "recalculate": "重新计算头寸",
+        "save": "保存数据文件",
+        "load": "加载数据文件",
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("性能统计")
+        self.resize(900, 600)
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+        self.span_table = QTableWidget(0, 9)
+        self.span_table.setHorizontalHeaderLabels(
+            ["名称", "说明", "次数", "总耗时(s)", "平均(ms)", "p50(ms)", "p95(ms)", "p99(ms)", "最大(ms)"])
+        self.span_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.span_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        layout.addWidget(self.span_table)
+
+        self.counter_table = QTableWidget(0, 2)
+        self.counter_table.setHorizontalHeaderLabels(["计数器", "值"])
+        self.counter_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.counter_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        layout.addWidget(self.counter_table)
+
+        button_layout = QHBoxLayout()
+        refresh_btn = QPushButton("刷新")
+        refresh_btn.clicked.connect(self.refresh)
+        button_layout.addWidget(refresh_btn)
+        reset_btn = QPushButton("清零")
+        reset_btn.clicked.connect(self.reset)
+        button_layout.addWidget(reset_btn)
+        dump_btn = QPushButton("导出到文件...")
+        dump_btn.clicked.connect(self.dump)
+        button_layout.addWidget(dump_btn)
+        layout.addLayout(button_layout)
+
+        self.setLayout(layout)
+
+    def refresh(self):
+        snapshot = stats.snapshot()
+        self.summary_label.setText(f"统计时长 {snapshot['elapsed']:.0f}s")
+
+        spans = snapshot["spans"]
+        self.span_table.setRowCount(len(spans))
+        for row, (name, span) in enumerate(spans.items()):
+            values = [name, self.SPAN_LABELS.get(name, ""), str(span["count"]), f"{span['total']:.3f}"]
+            values += [f"{span[key] * 1000:.2f}" for key in ("mean", "p50", "p95", "p99", "max")]
+            for column, value in enumerate(values):
+                self.span_table.setItem(row, column, QTableWidgetItem(value))
+
+        counters = dict(snapshot["counters"], **snapshot["gauges"])
+        self.counter_table.setRowCount(len(counters))
+        for row, (name, value) in enumerate(counters.items()):
+            self.counter_table.setItem(row, 0, QTableWidgetItem(name))
+            self.counter_table.setItem(row, 1, QTableWidgetItem(f"{value:,}"))
+
+    def reset(self):
+        stats.reset()
+        self.refresh()
+
+    def dump(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "导出性能统计", "perf_stats.json", "JSON文件 (*.json)")
+        if file_name:
+            try:
+                stats.dump(file_name)
+            except Exception as e:
+                QMessageBox.warning(self, "错误", f"导出失败: {str(e)}")
+
+
+class ValuationDialog(QDialog):
+    """估值参数：是否计算理论价格和希腊值、默认波动率、无风险利率和可选的波动率曲面文件"""
+
+    def __init__(self, settings, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("估值参数")
+        self.surface = settings.get("surface") or {}
+        self.setup_ui(settings)
+
+    def setup_ui(self, settings):
+        layout = QGridLayout()
+
+        self.enabled_check = QCheckBox("计算理论价格和希腊值（Black-76），在查询结果和导出中显示")
+        self.enabled_check.setChecked(bool(settings.get("enabled")))
+        layout.addWidget(self.enabled_check, 0, 0, 1, 3)
+
+        layout.addWidget(QLabel("默认波动率(%):"), 1, 0)
+        self.vol_input = QDoubleSpinBox()
+        self.vol_input.setRange(0.01, 500)
+        self.vol_input.setDecimals(2)
+        self.vol_input.setValue(settings.get("vol", 0.2) * 100)
+        layout.addWidget(self.vol_input, 1, 1)
+
+        layout.addWidget(QLabel("无风险利率(%):"), 2, 0)
+        self.rate_input = QDoubleSpinBox()
+        self.rate_input.setRange(-10, 50)
+        self.rate_input.setDecimals(3)
+        self.rate_input.setValue(settings.get("rate", 0.0) * 100)
+        layout.addWidget(self.rate_input, 2, 1)
+
+        layout.addWidget(QLabel("波动率曲面:"), 3, 0)
+        self.surface_label = QLabel()
+        layout.addWidget(self.surface_label, 3, 1)
+        surface_layout = QHBoxLayout()
+        import_btn = QPushButton("导入...")
+        import_btn.clicked.connect(self.import_surface)
+        surface_layout.addWidget(import_btn)
+        clear_btn = QPushButton("清除")
+        clear_btn.clicked.connect(self.clear_surface)
+        surface_layout.addWidget(clear_btn)
+        layout.addLayout(surface_layout, 3, 2)
+        self.update_surface_label()
+
+        btn_layout = QHBoxLayout()
+        ok_btn = QPushButton("确定")
+        ok_btn.clicked.connect(self.accept)
+        cancel_btn = QPushButton("取消")
+        cancel_btn.clicked.connect(self.reject)
+        btn_layout.addWidget(ok_btn)
+        btn_layout.addWidget(cancel_btn)
+        layout.addLayout(btn_layout, 4, 0, 1, 3)
+
+        self.setLayout(layout)
+
+    def update_surface_label(self):
+        self.surface_label.setText(f"{len(self.surface)} 个合约/品种" if self.surface else "未设置（全部使用默认波动率）")
+
+    def import_surface(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "导入波动率曲面", "", "JSON文件 (*.json)")
+        if not file_name:
+            return
+        from option_valuation import ValuationParams
+        try:
+            with open(file_name, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            params = ValuationParams.from_dict(data)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "错误", f"波动率曲面文件格式不正确: {str(e)}")
+            return
+        self.surface = params.to_dict()["surface"]
+        if "vol" in data:
+            self.vol_input.setValue(params.vol * 100)
+        if "rate" in data:
+            self.rate_input.setValue(params.rate * 100)
+        self.update_surface_label()
+
+    def clear_surface(self):
+        self.surface = {}
+        self.update_surface_label()
+
+    def settings(self):
+        return {"enabled": self.enabled_check.isChecked(), "vol": self.vol_input.value() / 100,
+                "rate": self.rate_input.value() / 100, "surface": self.surface}
+
+
+def valuation_params(settings):
+    """由估值设置生成 ValuationParams，未启用时返回None"""
+    if not settings.get("enabled"):
+        return None
+    from option_valuation import ValuationParams  # 依赖 numpy，启用估值时才导入
+    return ValuationParams.from_dict(settings)
+
+
+class DataRefreshTask(QObject):
+    """重新获取市场数据：作为一个后台优先级任务交给调度器，不占用交互任务的线程
+
+    各日期的日行情表由 PositionEngine.iter_refresh_prices 并发获取，实际并发数由 fetch_controller 自适应控制。
+    """
     progress_updated = pyqtSignal(int, str)
     finished = pyqtSignal(bool, str)
 
@@ -73,122 +348,95 @@ class DataRefreshThread(QThread):
         self.na_dates = na_dates if na_dates is not None else {}  # 格式: {期权名称: [日期列表]}
         self.total_tasks = 0
         self.completed_tasks = 0
-        self.is_canceled = False
+        self.token = CancelToken()
+        self.reporter = ProgressReporter(self.progress_updated.emit)
+        self.scheduler = None
+        self.started_at = None
+        self.cancel_requested_at = None
+        self.cancel_latency = None  # 从请求取消到刷新结束的耗时（秒）
+
+    @property
+    def is_canceled(self):
+        return self.token.is_canceled()
+
+    def start(self, scheduler):
+        self.scheduler = scheduler
+        self.started_at = time.time()  # 此前缓存的日行情表不再使用，每天重新访问网络一次
+
+        # 筛选需要处理的期权
+        target_options = self.parent.options
+        if self.keyword:
+            target_options = filter_options(self.parent.options, self.keyword)
+            if not target_options:
+                self.finished.emit(False, f"没有找到包含关键词 '{self.keyword}' 的期权数据!")
+                return
 
-    def run(self):
-        try:
-            # 筛选需要处理的期权
-            target_options = self.parent.options
-            if self.keyword:
-                target_options = {
-                    name: option for name, option in self.parent.options.items()
-                    if self.keyword.lower() in option["name"].lower()
-                }
-                if not target_options:
-                    self.finished.emit(False, f"没有找到包含关键词 '{self.keyword}' 的期权数据!")
-                    return
-
-            # 计算总任务量
-            if self.na_dates:  # 只刷新N/A数据
-                for name, dates in self.na_dates.items():
-                    if name in target_options:  # 只处理筛选后的期权
-                        self.total_tasks += len(dates)
-
-                # 执行刷新
-                for name, dates in self.na_dates.items():
-                    if self.is_canceled or name not in target_options:
-                        break
+        # 确定需要刷新的 (期权, 日期)
+        tasks = []
+        if self.na_dates:  # 只刷新N/A数据
+            for name, dates in self.na_dates.items():
+                if name in target_options:  # 只处理筛选后的期权
+                    tasks.extend((target_options[name], date) for date in dates)
+        elif self.option_name is None:  # 所有筛选后的期权
+            for option in target_options.values():
+                tasks.extend((option, date) for date in option["trade_dates"] if date <= self.query_date)
+        elif self.option_name in target_options:  # 特定期权
+            option = target_options[self.option_name]
+            tasks.extend((option, date) for date in option["trade_dates"] if date <= self.query_date)
+
+        self.total_tasks = len(tasks)
+        self.reporter.start_phase("获取", self.total_tasks)
+        self.reporter.report("准备获取市场数据", force=True)
+        if not tasks:
+            self._complete()
+            return
 
-                    option = self.parent.options[name]
-
-                    for date in dates:
-                        if self.is_canceled:
-                            break
-
-                        self.progress_updated.emit(
-                            int(self.completed_tasks / self.total_tasks * 100) if self.total_tasks > 0 else 0,
-                            f"正在重新获取 {option['name']} 在 {date} 的数据..."
-                        )
-                        self.parent.refresh_option_data(option, date)
-                        self.completed_tasks += 1
-                        self.progress_updated.emit(
-                            int(self.completed_tasks / self.total_tasks * 100) if self.total_tasks > 0 else 100,
-                            f"已处理 {option['name']} 在 {date} 的数据"
-                        )
-            elif self.option_name is None:  # 所有筛选后的期权
-                # 计算总任务量
-                for name, option in target_options.items():
-                    for date in option["trade_dates"]:
-                        if date <= self.query_date:
-                            self.total_tasks += 1
-
-                # 执行刷新
-                for name, option in target_options.items():
-                    if self.is_canceled:
-                        break
+        task = scheduler.submit(lambda token: self._refresh(token, tasks), BACKGROUND, token=self.token)
+        task.add_done_callback(self._on_task_done)
 
-                    dates_to_update = []
-                    for date in option["trade_dates"]:
-                        if date <= self.query_date:
-                            dates_to_update.append(date)
-
-                    for date in dates_to_update:
-                        if self.is_canceled:
-                            break
-
-                        self.progress_updated.emit(
-                            int(self.completed_tasks / self.total_tasks * 100) if self.total_tasks > 0 else 0,
-                            f"正在获取 {option['name']} 在 {date} 的数据..."
-                        )
-                        self.parent.refresh_option_data(option, date)
-                        self.completed_tasks += 1
-                        self.progress_updated.emit(
-                            int(self.completed_tasks / self.total_tasks * 100) if self.total_tasks > 0 else 100,
-                            f"已获取 {option['name']} 在 {date} 的数据"
-                        )
-            else:  # 特定期权
-                if self.option_name in target_options:
-                    option = self.parent.options[self.option_name]
-                    # 计算总任务量
-                    for date in option["trade_dates"]:
-                        if date <= self.query_date:
-                            self.total_tasks += 1
-
-                    # 执行刷新
-                    for date in option["trade_dates"]:
-                        if self.is_canceled or date > self.query_date:
-                            break
-
-                        self.progress_updated.emit(
-                            int(self.completed_tasks / self.total_tasks * 100) if self.total_tasks > 0 else 0,
-                            f"正在获取 {option['name']} 在 {date} 的数据..."
-                        )
-                        self.parent.refresh_option_data(option, date)
-                        self.completed_tasks += 1
-                        self.progress_updated.emit(
-                            int(self.completed_tasks / self.total_tasks * 100) if self.total_tasks > 0 else 100,
-                            f"已获取 {option['name']} 在 {date} 的数据"
-                        )
-
-            if self.is_canceled:
-                self.finished.emit(False, "操作已取消")
-                return
+    def _refresh(self, token, tasks):
+        # 每个 (期权, 日期) 写入后即已发布，取消时保留已完成的部分
+        try:
+            for option, date, _ in self.parent.engine.iter_refresh_prices(tasks, token, fresh_since=self.started_at):
+                self.completed_tasks += 1
+                self.reporter.task_done(f"已获取 {option['name']} 在 {date} 的数据", fetched=True)
+        except FetchCanceled:
+            pass
 
-            # 保存更新后的数据
-            self.parent.save_data()
-            self.finished.emit(True, "市场数据已重新获取并更新!")
+    def _on_task_done(self, task):
+        self._complete(task.error)
+
+    def _complete(self, error=None):
+        # 已完成的日期都已重新计算并发布，取消或出错时同样保存
+        try:
+            self.parent.engine.save_data()
         except Exception as e:
             self.finished.emit(False, f"发生错误: {str(e)}")
+            return
+
+        if error is not None:
+            self.finished.emit(False, f"发生错误: {str(error)}，已保存已获取的数据")
+        elif self.is_canceled:
+            self.cancel_latency = time.perf_counter() - self.cancel_requested_at
+            self.finished.emit(False, f"操作已取消，已保存已获取的数据（取消耗时 {self.cancel_latency * 1000:.0f}ms）")
+        else:
+            self.finished.emit(True, "市场数据已重新获取并更新!")
 
     def cancel(self):
-        self.is_canceled = True
+        """中止正在进行的请求并移除排队中的获取任务"""
+        if self.cancel_requested_at is None:
+            self.cancel_requested_at = time.perf_counter()
+        self.token.cancel()
+        if self.scheduler:
+            self.scheduler.drain(self.token)
 
 
-class QueryThread(QThread):
-    """用于执行查询操作的线程，避免UI卡顿"""
+class QueryTask(QObject):
+    """查询操作，以交互优先级在调度器的工作线程中执行，避免UI卡顿"""
     progress_updated = pyqtSignal(int, str)
     finished = pyqtSignal(bool, dict)  # 第二个参数是错误信息字典 {期权名称: [日期列表]}
-    result_ready = pyqtSignal(dict)  # 用于传递查询结果
+    rows_ready = pyqtSignal(str, object)  # 分批传递结果行 (分组, 结果行列表)
+    result_ready = pyqtSignal(object)  # 查询全部完成后传递完整结果
 
     def __init__(self, parent, query_date, option_name=None, keyword=None, is_keyword_query=False):
         super().__init__(parent)
@@ -197,229 +445,199 @@ class QueryThread(QThread):
         self.option_name = option_name
         self.keyword = keyword  # 查询关键词
         self.is_keyword_query = is_keyword_query  # 标识是否是关键词查询
-        self.is_canceled = False
+        self.token = CancelToken()
         self.results = {
             "single_option": [],
             "active_options": [],
             "expired_options": []
         }
         self.error_messages = {}
+        self.reporter = ProgressReporter(self.progress_updated.emit)  # 限频发布进度并统计各阶段耗时
 
-    def run(self):
-        try:
-            if not self.parent.options:
-                self.finished.emit(False, {"error": "没有可查询的期权数据!"})
-                return
+    def start(self, scheduler):
+        scheduler.submit(self.run, INTERACTIVE, token=self.token)
 
+    def run(self, token):
+        try:
             # 保存当前数据
-            self.parent.save_data()
+            if self.parent.options:
+                self.parent.engine.save_data()
+
+            self.results, self.error_messages = self.parent.engine.run_query(
+                self.query_date, self.option_name, self.keyword, self.is_keyword_query,
+                progress=self.reporter,
+                on_rows=self.rows_ready.emit,
+                token=token
+            )
 
-            # 处理关键词筛选
-            filtered_options = self.parent.options.copy()
-            if self.is_keyword_query and self.keyword:
-                filtered_options = {
-                    name: option for name, option in self.parent.options.items()
-                    if self.keyword.lower() in option["name"].lower()
-                }
+            self.result_ready.emit(self.results)
+            self.finished.emit(True, self.error_messages)
+        except QueryError as e:
+            self.finished.emit(False, {"error": str(e)})
+        except Exception as e:
+            self.finished.emit(False, {"error": f"发生错误: {str(e)}"})
 
-                if not filtered_options:
-                    self.finished.emit(False, {"error": f"没有找到包含关键词 '{self.keyword}' 的期权数据!"})
-                    return
+    def cancel(self):
+        self.token.cancel()
 
-            # 第一阶段：计算需要查询的数据量并检查N/A
-            na_dates = {}  # 存储需要重新获取的日期 {期权名称: [日期列表]}
-            total_options = len(filtered_options) if self.option_name is None and not self.is_keyword_query else 1
-            if self.is_keyword_query:
-                total_options = len(filtered_options)
 
-            processed_options = 0
+class QueryResultModel(QAbstractTableModel):
+    """查询结果表格模型，直接引用引擎生成的结果行，只在显示时格式化可见单元格"""
+    COLUMNS = ("date", "name", "strike_price", "daily_reversal", "close_price",
+               "actual_volume", "close_amount", "position", "theo_price", "delta", "gamma", "vega")
+    HEADERS = ["日期", "期权名称", "执行价格", "每日冲回量", "收盘价", "实际成交量", "平仓量", "最新头寸",
+               "理论价格", "Delta", "Gamma", "Vega"]
+    VALUATION_COLUMNS = ("theo_price", "delta", "gamma", "vega")  # 设置估值参数后才有值，否则隐藏
+    DECIMALS = {"delta": 4, "gamma": 6, "vega": 4}  # 其余数值列保留2位小数
 
-            self.progress_updated.emit(0, "准备查询数据...")
+    def __init__(self, headers=None, parent=None):
+        super().__init__(parent)
+        self.headers = headers or self.HEADERS
+        self.rows = []
 
-            # 确定要查询的期权集合
-            target_options = filtered_options
-            if not self.is_keyword_query and self.option_name and self.option_name in self.parent.options:
-                target_options = {self.option_name: self.parent.options[self.option_name]}
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
 
-            if not target_options:
-                self.finished.emit(False, {"error": "未找到目标期权数据!"})
-                return
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
 
-            for name, option in target_options.items():
-                if self.is_canceled:
-                    break
-
-                processed_options += 1
-                progress_percent = int(processed_options / total_options * 30)  # 第一阶段占30%进度
-                self.progress_updated.emit(progress_percent, f"检查 {option['name']} 的数据... ({progress_percent}%)")
-
-                na_dates[name] = []
-                for date in option["trade_dates"]:
-                    # 修改处1：原代码是检查所有查询日期前的N/A数据
-                    # 原代码：if date < self.query_date and option["close_prices"].get(date) == "N/A":
-                    # 修改为：只检查查询日期当天的N/A数据（如果是查询当天）和查询日期前的N/A数据
-                    if (date == self.query_date or date < self.query_date) and option["close_prices"].get(date) == "N/A":
-                        na_dates[name].append(date)
-
-                # 如果没有需要重新获取的日期，移除该期权
-                if not na_dates[name]:
-                    del na_dates[name]
-
-            # 第二阶段：重新获取N/A数据
-            na_refresh_success = True
-            if na_dates and not self.is_canceled:
-                # 计算总任务量
-                total_na_tasks = sum(len(dates) for dates in na_dates.values())
-                completed_na_tasks = 0
-
-                if total_na_tasks > 0:
-                    for name, dates in na_dates.items():
-                        if self.is_canceled:
-                            break
-
-                        if name not in self.parent.options:
-                            continue
-
-                        option = self.parent.options[name]
-
-                        for date in dates:
-                            if self.is_canceled:
-                                break
-
-                            progress_percent = 30 + int(completed_na_tasks / total_na_tasks * 40)  # 第二阶段占30-70%进度
-                            self.progress_updated.emit(progress_percent,
-                                                       f"正在获取 {option['name']} 在 {date} 的数据... ({progress_percent}%)")
-
-                            # 修改处2：原代码无条件刷新N/A数据
-                            # 修改为：如果是查询日期当天且是N/A，尝试刷新但不报错；查询日期前仍报错
-                            if date == self.query_date:
-                                # 查询日期当天，尝试刷新但不报错
-                                self.parent.refresh_option_data(option, date)
-                                if option["close_prices"].get(date) == "N/A":
-                                    # 当天数据仍为N/A，不报错
-                                    pass
-                            else:
-                                # 查询日期前，保持原逻辑
-                                self.parent.refresh_option_data(option, date)
-                                if option["close_prices"].get(date) == "N/A":
-                                    if name not in self.error_messages:
-                                        self.error_messages[name] = []
-                                    self.error_messages[name].append(date)
-
-                            completed_na_tasks += 1
-                            self.progress_updated.emit(
-                                int(completed_na_tasks / total_na_tasks * 100) if total_na_tasks > 0 else 100,
-                                f"已处理 {option['name']} 在 {date} 的数据"
-                            )
-
-            # 第三阶段：计算并准备查询结果
-            if not self.is_canceled and na_refresh_success:
-                current_date = QDate.currentDate().toString("yyyy-MM-dd")
-                active_count = 0
-                expired_count = 0
-                target_count = len(target_options)
-
-                # 根据结果数量决定查询模式
-                use_single_mode = target_count == 1
-
-                if not use_single_mode:  # 多期权查询模式
-                    total_options = len(target_options)
-                    processed_options = 0
-
-                    for name, option in target_options.items():
-                        if self.is_canceled:
-                            break
-
-                        processed_options += 1
-                        progress_percent = 70 + int(processed_options / total_options * 30)  # 第三阶段占70-100%进度
-                        self.progress_updated.emit(progress_percent,
-                                                   f"处理 {option['name']} 的数据... ({progress_percent}%)")
-
-                        last_trade_date = max(option["trade_dates"]) if option["trade_dates"] else ""
-
-                        # 判断期权是否已到期
-                        if last_trade_date and last_trade_date < current_date:  # 已到期期权
-                            # 使用最后交易日的数据
-                            if last_trade_date in option["trade_dates"]:
-                                self.parent.calculate_option_data(option, last_trade_date)
-                                self.results["expired_options"].append({
-                                    "date": last_trade_date,
-                                    "option": option
-                                })
-                                expired_count += 1
-                        elif last_trade_date:  # 未到期期权
-                            # 使用查询日期的数据
-                            if self.query_date in option["trade_dates"]:
-                                self.parent.calculate_option_data(option, self.query_date)
-                                self.results["active_options"].append({
-                                    "date": self.query_date,
-                                    "option": option
-                                })
-                                active_count += 1
-
-                    self.results["active_count"] = active_count
-                    self.results["expired_count"] = expired_count
-                else:  # 单个期权查询模式
-                    # 获取唯一的期权
-                    name, option = next(iter(target_options.items()))
-                    self.progress_updated.emit(70, f"处理 {option['name']} 的数据... (70%)")
-
-                    # 显示该期权所有交易日数据（截止查询日期）
-                    valid_dates = [date for date in option["trade_dates"] if date <= self.query_date]
-                    total_dates = len(valid_dates)
-
-                    for i, date in enumerate(valid_dates):
-                        if self.is_canceled:
-                            break
-
-                        self.parent.calculate_option_data(option, date)
-                        self.results["single_option"].append({
-                            "date": date,
-                            "option": option
-                        })
-
-                        progress_percent = 70 + int((i + 1) / total_dates * 30)  # 第三阶段占70-100%进度
-                        self.progress_updated.emit(progress_percent,
-                                                   f"处理 {option['name']} 在 {date} 的数据... ({progress_percent}%)")
-
-                # 收集错误信息
-                for name, option in target_options.items():
-                    for date in option["trade_dates"]:
-                        if date < self.query_date and option["close_prices"].get(date) == "N/A":
-                            if name not in self.error_messages:
-                                self.error_messages[name] = []
-                            self.error_messages[name].append(date)
-
-                self.result_ready.emit(self.results)
-                self.progress_updated.emit(100, "查询完成")
-                self.finished.emit(True, self.error_messages)
-            elif self.is_canceled:
-                self.finished.emit(False, {"error": "查询已取消"})
-            else:
-                self.finished.emit(False, {"error": "N/A数据刷新失败"})
-        except Exception as e:
-            self.finished.emit(False, {"error": f"发生错误: {str(e)}"})
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
 
-    def cancel(self):
-        self.is_canceled = True
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = self.COLUMNS[index.column()]
+        value = self.rows[index.row()].get(column)
+        if role == Qt.DisplayRole:
+            if index.column() < 2 or value is None or value == "N/A":
+                return value
+            return f"{value:.{self.DECIMALS.get(column, 2)}f}"
+        if role == Qt.UserRole:  # 排序用的原始值，N/A 排在最前
+            if value is None or value == "N/A":
+                return float("-inf")
+            return value
+        return None
+
+    def set_header(self, section, text):
+        self.headers = list(self.headers)
+        self.headers[section] = text
+        self.headerDataChanged.emit(Qt.Horizontal, section, section)
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def row_data(self, row):
+        return self.rows[row]
+
+
+class ExposureResultModel(QueryResultModel):
+    """净头寸汇总表格模型，结果行由 PositionEngine.exposure_rows 生成"""
+    COLUMNS = ("group", "date", "options", "position", "daily_reversal", "actual_volume", "uncalculated")
+    HEADERS = ["期货合约", "日期", "期权数", "净头寸", "每日冲回量合计", "实际成交量合计", "头寸未计算"]
+    DECIMALS = {"options": 0, "uncalculated": 0}
+
+
+class PnlResultModel(QueryResultModel):
+    """逐日损益表格模型，结果行由 PositionEngine.pnl_rows 生成"""
+    COLUMNS = ("date", "name", "close_price", "position", "carry", "reversal_pnl", "exercise_pnl", "close_out_pnl",
+               "pnl", "cumulative_pnl")
+    HEADERS = ["日期", "期权名称", "收盘价", "头寸", "持仓损益", "冲回损益", "行权损益", "平仓损益", "当日损益", "累计损益"]
+    DECIMALS = {}
+
+
+class QueryResultProxyModel(QSortFilterProxyModel):
+    """查询结果的排序/筛选代理，按原始值排序、按期权名称筛选"""
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.setSourceModel(source)
+        self.setSortRole(Qt.UserRole)
+        self.setFilterKeyColumn(1)
+        self.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+    def row_data(self, proxy_index):
+        return self.sourceModel().row_data(self.mapToSource(proxy_index).row())
 
 
 class OptionPositionCalculator(QMainWindow):
+    save_failed = pyqtSignal(str)  # 调度器中的保存任务失败
+    prefetch_finished = pyqtSignal(str, object)  # (目标日期, 行情表不可用的日期列表；取消时为None)
+    export_finished = pyqtSignal(bool, str)  # (是否成功, 提示信息)
+    data_loaded = pyqtSignal(bool, str)  # 启动时的后台加载完成 (是否找到数据文件, 失败时的错误信息)
+    exposure_ready = pyqtSignal(object, object)  # (汇总条件, 结果行；失败时为错误信息)
+    pnl_ready = pyqtSignal(object, object)  # (计算条件, 逐日损益行；失败时为错误信息)
+    option_updated = pyqtSignal(str, object)  # (期权名称, edit_schedule 的结果；失败时为错误信息)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("期权头寸计算及期货数据统计系统")
         self.setGeometry(100, 100, 1200, 800)
 
-        self.options = {}  # 存储所有期权数据
+        # 期权数据及计算引擎，默认数据文件名；日行情表缓存与命令行预取共用，窗口显示后在后台读取
+        self.engine = PositionEngine("options_data.json", QuoteCache("quote_cache.json", defer_load=True),
+                                     audit_log=FetchAuditLog("fetch_audit.log"))
+        self.scheduler = TaskScheduler(workers=4)  # 查询、刷新、保存共用的工作线程池
+        self.settings = QSettings("DCE-Options-Position-Calculator", "OptionPositionCalculator")
+        # 数据文件中的价格按上次选择的价格字段取得，加载前恢复
+        price_field = self.settings.value("price_field", CLOSE)
+        self.engine.price_field = price_field if price_field in PRICE_FIELDS else CLOSE
         self.current_option = None
-        self.data_file = "options_data.json"  # 默认数据文件名
-        self.refresh_thread = None
-        self.query_thread = None  # 查询线程
+        self.refresh_task = None
+        self.query_task = None  # 查询任务
+        self.last_query_is_keyword = False
         self.query_in_progress = False
-        self.na_refresh_thread = None  # 用于N/A数据刷新的线程
+        self.requery_pending = False  # 查询进行中又需要重新查询时，待其结束后再查询
+        self.save_failed.connect(lambda message: QMessageBox.warning(self, "错误", f"保存数据失败: {message}"))
+        self.prefetch_token = None  # 正在进行的收盘后预取
+        self.prefetched_date = None  # 已完成预取的交易日
+        self.prefetch_retry_at = 0.0  # 行情表尚未发布时，下次重试的时间
+        self.prefetch_finished.connect(self.on_prefetch_finished)
+        self.export_finished.connect(self.on_export_finished)
+        self.data_loaded.connect(self.on_data_loaded)
+        self.exposure_ready.connect(self.on_exposure_ready)
+        self.exposure_request = ("code", None)  # 净头寸汇总条件 (汇总方式, 日期)
+        self.pnl_ready.connect(self.on_pnl_ready)
+        self.option_updated.connect(self.on_option_updated)
+        self.pnl_request = (None, None)  # 逐日损益条件 (期权名称，为空时为组合, 截止日期)
+        self.data_ready = False  # 启动时的后台加载是否已完成
 
         self.init_ui()
-        self.load_data()  # 尝试加载保存的数据
+        self.update_price_headers()
+        self.update_valuation_columns()
+
+        # 收盘后预取当日行情表并补齐缺失的收盘价，数据加载完成后先补一次
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.timeout.connect(self.check_prefetch)
+
+        # 先显示窗口，再在后台加载保存的数据，加载期间界面为占位状态
+        self.set_loading(True)
+        QTimer.singleShot(0, self.start_loading)
+
+    @property
+    def options(self):
+        """当前发布的期权数据版本（只读，修改需通过 engine.update_option 等方法）"""
+        return self.engine.options
+
+    @property
+    def data_file(self):
+        return self.engine.data_file
+
+    @data_file.setter
+    def data_file(self, value):
+        self.engine.data_file = value
 
     def init_ui(self):
         # 创建主控件和布局
@@ -447,6 +665,17 @@ class OptionPositionCalculator(QMainWindow):
         self.setup_close_tab(close_tab)
         self.tab_widget.addTab(close_tab, "平仓操作")
 
+        # 添加净头寸汇总标签页
+        self.exposure_tab = QWidget()
+        self.setup_exposure_tab(self.exposure_tab)
+        self.tab_widget.addTab(self.exposure_tab, "净头寸汇总")
+
+        # 添加损益归因标签页
+        self.pnl_tab = QWidget()
+        self.setup_pnl_tab(self.pnl_tab)
+        self.tab_widget.addTab(self.pnl_tab, "损益归因")
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
+
         main_layout.addWidget(self.tab_widget)
 
         # 添加进度显示区域
@@ -481,6 +710,119 @@ class OptionPositionCalculator(QMainWindow):
         main_widget.setLayout(main_layout)
         self.setCentralWidget(main_widget)
 
+        # 状态栏显示调度器各优先级的排队任务数
+        self.queue_depth_label = QLabel()
+        self.statusBar().addPermanentWidget(self.queue_depth_label)
+        self.queue_depth_timer = QTimer(self)
+        self.queue_depth_timer.timeout.connect(self.update_queue_depth)
+        self.queue_depth_timer.start(500)
+        self.update_queue_depth()
+
+    def set_price_field(self, field):
+        if field == self.engine.price_field:
+            return
+        updated = self.engine.set_price_field(field)
+        self.settings.setValue("price_field", field)
+        self.update_price_headers()
+        if updated:
+            self.schedule_save()
+            self.requery_based_on_last_action()
+        if self.tab_widget.currentWidget() is self.pnl_tab:
+            self.update_pnl()
+        self.statusBar().showMessage(f"已改为按{field}计算头寸，{updated} 个期权的价格已更新", 10000)
+
+    def valuation_settings(self):
+        try:
+            return json.loads(self.settings.value("valuation", "") or "{}")
+        except ValueError:
+            return {}
+
+    def edit_valuation(self):
+        dialog = ValuationDialog(self.valuation_settings(), self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        settings = dialog.settings()
+        try:
+            self.engine.valuation = valuation_params(settings)
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+        self.settings.setValue("valuation", json.dumps(settings, ensure_ascii=False))
+        self.update_valuation_columns()
+        self.requery_based_on_last_action()
+
+    def update_valuation_columns(self):
+        """未设置估值参数时隐藏理论价格和希腊值列"""
+        hidden = self.engine.valuation is None
+        for table in (self.single_option_table, self.active_options_table, self.expired_options_table):
+            for column in QueryResultModel.VALUATION_COLUMNS:
+                table.setColumnHidden(QueryResultModel.COLUMNS.index(column), hidden)
+
+    def update_price_headers(self):
+        column = QueryResultModel.COLUMNS.index("close_price")
+        for table in (self.single_option_table, self.active_options_table, self.expired_options_table):
+            table.model().sourceModel().set_header(column, self.engine.price_field)
+        self.pnl_table.model().sourceModel().set_header(PnlResultModel.COLUMNS.index("close_price"),
+                                                         self.engine.price_field)
+        self.pnl_label.setText(self.pnl_note())
+
+    def update_queue_depth(self):
+        depth = self.scheduler.queue_depth()
+        self.queue_depth_label.setText("排队任务  " + "  ".join(
+            f"{PRIORITY_NAMES[priority]}: {count}" for priority, count in sorted(depth.items())))
+
+    def closeEvent(self, event):
+        # 取消未完成的操作，等待正在执行的任务和排队中的保存结束，避免修改丢失或数据文件写到一半
+        if self.query_task:
+            self.query_task.cancel()
+        if self.refresh_task:
+            self.refresh_task.cancel()
+        if self.prefetch_token:
+            self.prefetch_token.cancel()
+        self.scheduler.shutdown()
+        self.engine.parse_pool.shutdown()
+        super().closeEvent(event)
+
+    def check_prefetch(self):
+        """最近一个已发布的交易日尚未预取时，以预取优先级在后台获取日行情表并计算头寸"""
+        target = latest_published_date()
+        if self.prefetch_token or target == self.prefetched_date or time.time() < self.prefetch_retry_at:
+            return
+        if not self.options:
+            return
+
+        self.prefetch_token = CancelToken()
+
+        def prefetch(token):
+            unavailable = []
+
+            def on_day(date, summary):
+                if summary is None:
+                    unavailable.append(date)
+
+            try:
+                summaries = self.engine.prefetch_missing(target, token, on_day)
+                if any(summary and summary["updated"] for summary in summaries):
+                    self.engine.save_data()
+            except FetchCanceled:
+                unavailable = None
+            except Exception as e:
+                self.save_failed.emit(str(e))
+            self.prefetch_finished.emit(target, unavailable)
+
+        self.scheduler.submit(prefetch, PREFETCH, key="prefetch", token=self.prefetch_token)
+
+    def on_prefetch_finished(self, target, unavailable):
+        self.prefetch_token = None
+        if unavailable is None:
+            return
+        if target in unavailable:
+            # 当日行情表尚未发布，10分钟后重试
+            self.prefetch_retry_at = time.time() + 10 * 60
+            return
+        self.prefetched_date = target
+        self.statusBar().showMessage(f"已预取 {target} 及之前缺失的行情数据", 10000)
+
     def create_menu_bar(self):
         menubar = self.menuBar()
 
@@ -496,11 +838,40 @@ class OptionPositionCalculator(QMainWindow):
         load_action = file_menu.addAction('加载数据...')
         load_action.triggered.connect(self.load_data_from_file)
 
+        export_action = file_menu.addAction('导出头寸历史...')
+        export_action.triggered.connect(self.export_history)
+
+        archive_action = file_menu.addAction('归档已到期期权')
+        archive_action.triggered.connect(self.archive_expired_options)
+
+        restore_action = file_menu.addAction('恢复归档期权...')
+        restore_action.triggered.connect(self.restore_archived_option)
+
         file_menu.addSeparator()
 
         exit_action = file_menu.addAction('退出')
         exit_action.triggered.connect(self.close)
 
+        # 诊断菜单
+        diagnostics_menu = menubar.addMenu('诊断')
+
+        perf_action = diagnostics_menu.addAction('性能统计...')
+        perf_action.triggered.connect(lambda: PerfStatsDialog(self).exec_())
+
+        # 设置菜单：计算头寸使用收盘价或结算价，切换时使用已缓存的日行情表，不访问网络
+        settings_menu = menubar.addMenu('设置')
+        price_group = QActionGroup(self)
+        for field in PRICE_FIELDS:
+            action = settings_menu.addAction(f'按{field}计算头寸')
+            action.setCheckable(True)
+            action.setChecked(field == self.engine.price_field)
+            action.triggered.connect(lambda checked, field=field: self.set_price_field(field))
+            price_group.addAction(action)
+
+        settings_menu.addSeparator()
+        valuation_action = settings_menu.addAction('估值参数...')
+        valuation_action.triggered.connect(self.edit_valuation)
+
     def setup_input_tab(self, tab):
         layout = QVBoxLayout()
 
@@ -598,6 +969,10 @@ class OptionPositionCalculator(QMainWindow):
         self.delete_btn.clicked.connect(self.delete_option)
         btn_layout.addWidget(self.delete_btn)
 
+        self.import_btn = QPushButton("批量导入...")
+        self.import_btn.clicked.connect(self.import_options)
+        btn_layout.addWidget(self.import_btn)
+
         btn_group.setLayout(btn_layout)
         layout.addWidget(btn_group)
 
@@ -651,19 +1026,18 @@ class OptionPositionCalculator(QMainWindow):
         self.keyword_query_btn.clicked.connect(self.keyword_query)
         keyword_layout.addWidget(self.keyword_query_btn)
 
+        keyword_layout.addWidget(QLabel("结果筛选:"))
+        self.result_filter_input = QLineEdit()
+        self.result_filter_input.setPlaceholderText("按期权名称筛选已显示的结果...")
+        self.result_filter_input.textChanged.connect(self.filter_query_results)
+        keyword_layout.addWidget(self.result_filter_input)
+
         keyword_layout.addStretch()  # 右侧留白，使控件左对齐
         keyword_group.setLayout(keyword_layout)
         layout.addWidget(keyword_group)
 
         # 查询结果表格 - 单个期权显示
-        self.single_option_table = QTableWidget()
-        self.single_option_table.setColumnCount(8)
-        self.single_option_table.setHorizontalHeaderLabels([
-            "日期", "期权名称", "执行价格", "每日冲回量", "收盘价",
-            "实际成交量", "平仓量", "最新头寸"
-        ])
-        # 调整列宽：加宽期权名称列（索引1），其余列均分
-        self.adjust_table_column_widths(self.single_option_table)
+        self.single_option_table = self.create_result_table()
         layout.addWidget(self.single_option_table)
 
         # 分隔线
@@ -678,14 +1052,7 @@ class OptionPositionCalculator(QMainWindow):
         layout.addWidget(self.active_options_label)
         self.active_options_label.hide()
 
-        self.active_options_table = QTableWidget()
-        self.active_options_table.setColumnCount(8)
-        self.active_options_table.setHorizontalHeaderLabels([
-            "日期", "期权名称", "执行价格", "每日冲回量", "收盘价",
-            "实际成交量", "平仓量", "最新头寸"
-        ])
-        # 调整列宽
-        self.adjust_table_column_widths(self.active_options_table)
+        self.active_options_table = self.create_result_table()
         layout.addWidget(self.active_options_table)
         self.active_options_table.hide()
 
@@ -701,23 +1068,30 @@ class OptionPositionCalculator(QMainWindow):
         layout.addWidget(self.expired_options_label)
         self.expired_options_label.hide()
 
-        self.expired_options_table = QTableWidget()
-        self.expired_options_table.setColumnCount(8)
-        self.expired_options_table.setHorizontalHeaderLabels([
-            "到期日期", "期权名称", "执行价格", "每日冲回量", "收盘价",
-            "实际成交量", "平仓量", "最新头寸"
-        ])
-        # 调整列宽
-        self.adjust_table_column_widths(self.expired_options_table)
+        self.expired_options_table = self.create_result_table(["到期日期"] + QueryResultModel.HEADERS[1:])
+        # 双击已到期期权查看其历史，归档的期权此时才读取
+        self.expired_options_table.doubleClicked.connect(self.show_expired_history)
         layout.addWidget(self.expired_options_table)
         self.expired_options_table.hide()
 
         tab.setLayout(layout)
 
+    def create_result_table(self, headers=None):
+        """创建查询结果表格（模型/视图），只为可见行生成单元格"""
+        table = QTableView()
+        table.setModel(QueryResultProxyModel(QueryResultModel(headers), table))
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setSortingEnabled(True)
+        table.sortByColumn(-1, Qt.AscendingOrder)  # 默认保持引擎输出顺序
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        # 调整列宽：加宽期权名称列（索引1），其余列均分
+        self.adjust_table_column_widths(table)
+        return table
+
     def adjust_table_column_widths(self, table):
         """加宽期权名称列（索引1），其余列均分"""
         # 设置所有列默认模式为Stretch
-        for col in range(table.columnCount()):
+        for col in range(table.model().columnCount()):
             table.horizontalHeader().setSectionResizeMode(col, QHeaderView.Stretch)
 
         table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Interactive)
@@ -759,8 +1133,193 @@ class OptionPositionCalculator(QMainWindow):
         self.close_btn.clicked.connect(self.record_close)
         layout.addWidget(self.close_btn)
 
+        self.import_closes_btn = QPushButton("批量导入平仓记录...")
+        self.import_closes_btn.clicked.connect(self.import_closes)
+        layout.addWidget(self.import_closes_btn)
+
         tab.setLayout(layout)
 
+    def setup_exposure_tab(self, tab):
+        layout = QVBoxLayout()
+
+        exposure_group = QWidget()
+        exposure_layout = QHBoxLayout()
+
+        exposure_layout.addWidget(QLabel("汇总方式:"))
+        self.exposure_by_combo = QComboBox()
+        self.exposure_by_combo.addItem("按期货合约", "code")
+        self.exposure_by_combo.addItem("按品种", "product")
+        self.exposure_by_combo.currentIndexChanged.connect(self.update_exposure)
+        exposure_layout.addWidget(self.exposure_by_combo)
+
+        exposure_layout.addWidget(QLabel("日期:"))
+        self.exposure_date_input = QDateEdit()
+        self.exposure_date_input.setCalendarPopup(True)
+        self.exposure_date_input.setDate(QDate.currentDate())
+        self.exposure_date_input.dateChanged.connect(self.update_exposure)
+        exposure_layout.addWidget(self.exposure_date_input)
+
+        self.exposure_all_dates_check = QCheckBox("全部交易日")
+        self.exposure_all_dates_check.toggled.connect(self.exposure_date_input.setDisabled)
+        self.exposure_all_dates_check.toggled.connect(self.update_exposure)
+        exposure_layout.addWidget(self.exposure_all_dates_check)
+
+        self.exposure_btn = QPushButton("汇总")
+        self.exposure_btn.clicked.connect(self.update_exposure)
+        exposure_layout.addWidget(self.exposure_btn)
+
+        exposure_layout.addStretch()
+        exposure_group.setLayout(exposure_layout)
+        layout.addWidget(exposure_group)
+
+        self.exposure_table = QTableView()
+        self.exposure_table.setModel(QueryResultProxyModel(ExposureResultModel(), self.exposure_table))
+        self.exposure_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.exposure_table.setSortingEnabled(True)
+        self.exposure_table.sortByColumn(-1, Qt.AscendingOrder)
+        self.exposure_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.exposure_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        layout.addWidget(self.exposure_table)
+
+        self.exposure_label = QLabel("只汇总已计算头寸的交易日，“头寸未计算”不为0时可先在“数据查询”中查询这些期权")
+        self.exposure_label.setStyleSheet("color: #666;")
+        layout.addWidget(self.exposure_label)
+
+        tab.setLayout(layout)
+
+    def setup_pnl_tab(self, tab):
+        layout = QVBoxLayout()
+
+        pnl_group = QWidget()
+        pnl_layout = QHBoxLayout()
+
+        pnl_layout.addWidget(QLabel("期权名称:"))
+        self.pnl_option_combo = QComboBox()
+        self.pnl_option_combo.addItem("全部期权（组合）", None)
+        self.pnl_option_combo.activated.connect(self.update_pnl)
+        pnl_layout.addWidget(self.pnl_option_combo)
+
+        pnl_layout.addWidget(QLabel("截止日期:"))
+        self.pnl_date_input = QDateEdit()
+        self.pnl_date_input.setCalendarPopup(True)
+        self.pnl_date_input.setDate(QDate.currentDate())
+        self.pnl_date_input.dateChanged.connect(self.update_pnl)
+        pnl_layout.addWidget(self.pnl_date_input)
+
+        self.pnl_btn = QPushButton("计算")
+        self.pnl_btn.clicked.connect(self.update_pnl)
+        pnl_layout.addWidget(self.pnl_btn)
+
+        self.pnl_export_btn = QPushButton("导出CSV...")
+        self.pnl_export_btn.clicked.connect(self.export_pnl)
+        pnl_layout.addWidget(self.pnl_export_btn)
+
+        pnl_layout.addStretch()
+        pnl_group.setLayout(pnl_layout)
+        layout.addWidget(pnl_group)
+
+        self.pnl_table = QTableView()
+        self.pnl_table.setModel(QueryResultProxyModel(PnlResultModel(), self.pnl_table))
+        self.pnl_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.pnl_table.setSortingEnabled(True)
+        self.pnl_table.sortByColumn(-1, Qt.AscendingOrder)
+        self.pnl_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.adjust_table_column_widths(self.pnl_table)
+        layout.addWidget(self.pnl_table)
+
+        self.pnl_label = QLabel(self.pnl_note())
+        self.pnl_label.setStyleSheet("color: #666;")
+        layout.addWidget(self.pnl_label)
+
+        tab.setLayout(layout)
+
+    def pnl_note(self):
+        """损益的计价说明，价格为计算头寸使用的价格字段（收盘价或结算价）"""
+        return (f"按{self.engine.price_field}计价，每笔数量按执行价格计入；"
+                "价格为N/A的交易日沿用之前最近的价格")
+
+    def on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.exposure_tab:
+            self.update_exposure()
+        elif self.tab_widget.widget(index) is self.pnl_tab:
+            self.update_pnl()
+
+    def update_pnl(self):
+        """在后台计算逐日损益，只重新计算上次计算后变化的期权"""
+        if not self.data_ready:
+            return
+        # 排队中的计算任务会合并为一个，执行时读取最新的条件
+        self.pnl_request = (self.pnl_option_combo.currentData(), self.pnl_date_input.date().toString("yyyy-MM-dd"))
+
+        def calculate(token):
+            request = self.pnl_request
+            try:
+                self.pnl_ready.emit(request, self.engine.pnl_rows(request[0], end_date=request[1]))
+            except Exception as e:
+                self.pnl_ready.emit(request, f"计算损益失败: {str(e)}")
+
+        self.scheduler.submit(calculate, INTERACTIVE, key="pnl")
+
+    def on_pnl_ready(self, request, rows):
+        if request != self.pnl_request:
+            return  # 条件已改变，等待之后的结果
+        if isinstance(rows, str):
+            QMessageBox.warning(self, "错误", rows)
+            return
+        rows = rows or []
+        self.pnl_table.model().sourceModel().set_rows(rows)
+        total = f"，累计损益 {rows[-1]['cumulative_pnl']:.2f}" if rows else ""
+        self.pnl_label.setText(f"共 {len(rows)} 个交易日{total}（{self.pnl_note()}）")
+
+    def export_pnl(self):
+        """把当前显示的逐日损益写入CSV"""
+        rows = self.pnl_table.model().sourceModel().rows
+        if not rows:
+            QMessageBox.warning(self, "警告", "没有可导出的损益数据")
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "导出逐日损益", "pnl.csv", "CSV文件 (*.csv)")
+        if not file_name:
+            return
+        from position_pnl import write_pnl_csv
+        try:
+            write_pnl_csv(rows, file_name)
+        except OSError as e:
+            QMessageBox.warning(self, "错误", f"导出失败: {str(e)}")
+            return
+        self.statusBar().showMessage(f"已导出 {len(rows)} 行到 {file_name}", 10000)
+
+    def update_exposure(self):
+        """在后台汇总净头寸，只重新计算上次汇总后变化的期权"""
+        if not self.data_ready:
+            return
+        by = self.exposure_by_combo.currentData()
+        date = None if self.exposure_all_dates_check.isChecked() else \
+            self.exposure_date_input.date().toString("yyyy-MM-dd")
+        self.exposure_table.model().sourceModel().set_header(
+            0, ExposureResultModel.HEADERS[0] if by == "code" else "品种")
+        # 排队中的汇总任务会合并为一个，执行时读取最新的汇总条件
+        self.exposure_request = (by, date)
+
+        def aggregate(token):
+            request = self.exposure_request
+            try:
+                self.exposure_ready.emit(request, self.engine.exposure_rows(*request))
+            except Exception as e:
+                self.exposure_ready.emit(request, f"汇总净头寸失败: {str(e)}")
+
+        self.scheduler.submit(aggregate, INTERACTIVE, key="exposure")
+
+    def on_exposure_ready(self, request, rows):
+        if request != self.exposure_request:
+            return  # 汇总条件已改变，等待之后的结果
+        if isinstance(rows, str):
+            QMessageBox.warning(self, "错误", rows)
+            return
+        self.exposure_table.model().sourceModel().set_rows(rows)
+        pending = sum(row["uncalculated"] for row in rows)
+        self.exposure_label.setText(f"共 {len(rows)} 行" + (f"，{pending} 个 (期权, 交易日) 的头寸尚未计算，"
+                                                          "可先在“数据查询”中查询这些期权" if pending else ""))
+
     def batch_add_trade_dates(self):
         dialog = BatchAddDatesDialog(self)
         if dialog.exec_() == QDialog.Accepted:
@@ -831,9 +1390,11 @@ class OptionPositionCalculator(QMainWindow):
             daily_reversal = -initial_amount / row_count
             option_name = self.option_name_input.text().strip()
             if option_name in self.options:
-                self.options[option_name]["daily_reversal"] = daily_reversal
-                self.recalculate_option_from_date(self.options[option_name],
-                                                  self.options[option_name]["trade_dates"][0])
+                def apply(option):
+                    option["daily_reversal"] = daily_reversal
+                    self.engine.recalculate_option_from_date(option, option["trade_dates"][0])
+
+                self.engine.update_option(option_name, apply)
 
     def save_option(self):
         name = self.option_name_input.text().strip()
@@ -892,12 +1453,48 @@ class OptionPositionCalculator(QMainWindow):
             if reply == QMessageBox.No:
                 return
 
-        self.options[name] = option_data
+        self.engine.put_option(option_data)
         self.update_option_combos()
         QMessageBox.information(self, "成功", f"期权 {name} 已保存!")
         self.clear_inputs()
         self.save_data()
 
+    def import_options(self):
+        """从CSV/Excel表格批量导入期权，整张表校验通过后一次发布、一次保存"""
+        file_name, _ = QFileDialog.getOpenFileName(self, "批量导入期权", "", "表格文件 (*.csv *.xlsx *.xls)")
+        if not file_name:
+            return
+
+        from option_import import OptionImportError, load_option_table  # 依赖 pandas，用到时才导入
+        try:
+            options = load_option_table(file_name)
+        except OptionImportError as e:
+            shown = "\n".join(str(e).splitlines()[:20])
+            more = f"\n……共 {len(e.errors)} 处错误" if len(e.errors) > 20 else ""
+            QMessageBox.warning(self, "导入失败", f"表格中有错误，未导入任何期权：\n\n{shown}{more}")
+            return
+        except Exception as e:
+            QMessageBox.warning(self, "错误", f"读取表格失败: {str(e)}")
+            return
+
+        existing = [option["name"] for option in options if option["name"] in self.options]
+        if existing:
+            reply = QMessageBox.question(
+                self, '确认覆盖',
+                f'{len(existing)} 个期权已存在（{"、".join(existing[:5])}{"等" if len(existing) > 5 else ""}），是否覆盖?\n'
+                f'选择“否”将跳过已存在的期权。',
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.No
+            )
+            if reply == QMessageBox.Cancel:
+                return
+            if reply == QMessageBox.No:
+                options = [option for option in options if option["name"] not in self.options]
+
+        self.engine.put_options(options)
+        self.update_option_combos()
+        self.save_data()
+        QMessageBox.information(self, "成功", f"已导入 {len(options)} 个期权")
+
     def update_option(self):
         name = self.option_name_input.text().strip()
         if not name or name not in self.options:
@@ -933,16 +1530,39 @@ class OptionPositionCalculator(QMainWindow):
             QMessageBox.warning(self, "警告", "没有有效的交易日!")
             return
 
-        daily_reversal = -initial_amount / len(trade_dates)
-
-        self.options[name]["code"] = code
-        self.options[name]["strike_price"] = strike_price
-        self.options[name]["initial_amount"] = initial_amount
-        self.options[name]["trade_dates"] = trade_dates
-        self.options[name]["daily_reversal"] = daily_reversal
-
-        self.recalculate_option_from_date(self.options[name], trade_dates[0])
-        QMessageBox.information(self, "成功", f"期权 {name} 已更新!")
+        fields = {"code": code, "strike_price": strike_price, "initial_amount": initial_amount,
+                  "daily_reversal": -initial_amount / len(set(trade_dates))}
+
+        # 新增的已发布交易日在后台批量获取收盘价，只从最早受影响的日期重新计算
+        def edit(token):
+            try:
+                self.option_updated.emit(name, self.engine.edit_schedule(name, trade_dates, fields, token=token))
+            except FetchCanceled:
+                self.option_updated.emit(name, "已取消")
+            except Exception as e:
+                self.option_updated.emit(name, f"更新期权失败: {str(e)}")
+
+        self.update_btn.setEnabled(False)
+        self.scheduler.submit(edit, INTERACTIVE)
+        self.statusBar().showMessage(f"正在更新期权 {name}...")
+
+    def on_option_updated(self, name, result):
+        self.update_btn.setEnabled(True)
+        self.statusBar().clearMessage()
+        if isinstance(result, str):
+            QMessageBox.warning(self, "错误", result)
+            return
+        if result is None:
+            QMessageBox.warning(self, "警告", f"期权 {name} 已被删除!")
+            return
+        details = []
+        if result["added"] or result["removed"]:
+            details.append(f"新增 {len(result['added'])} 个、删除 {len(result['removed'])} 个交易日")
+        if result["fetched"]:
+            details.append(f"获取 {result['fetched']} 个交易日的收盘价")
+        if result["start"]:
+            details.append(f"从 {result['start']} 起重新计算")
+        QMessageBox.information(self, "成功", f"期权 {name} 已更新!" + ("\n" + "，".join(details) if details else ""))
         self.save_data()
 
     def delete_option(self):
@@ -957,7 +1577,7 @@ class OptionPositionCalculator(QMainWindow):
         if reply == QMessageBox.No:
             return
 
-        del self.options[name]
+        self.engine.remove_option(name)
         self.update_option_combos()
         self.clear_inputs()
         QMessageBox.information(self, "成功", f"期权 {name} 已删除!")
@@ -1005,10 +1625,63 @@ class OptionPositionCalculator(QMainWindow):
         self.option_select_combo.clear()
         self.option_select_combo.addItem("新建期权", "")
 
+        pnl_option = self.pnl_option_combo.currentData()
+        self.pnl_option_combo.clear()
+        self.pnl_option_combo.addItem("全部期权（组合）", None)
+
         for name in sorted(self.options.keys()):
             self.query_option_combo.addItem(name, name)
             self.close_option_combo.addItem(name, name)
             self.option_select_combo.addItem(name, name)
+            self.pnl_option_combo.addItem(name, name)
+        self.pnl_option_combo.setCurrentIndex(max(self.pnl_option_combo.findData(pnl_option), 0))
+
+    def show_expired_history(self, index):
+        option_name = self.expired_options_table.model().row_data(index)["name"]
+        query_date = self.query_date_input.date().toString("yyyy-MM-dd")
+        self.start_query(QueryTask(self, query_date, option_name, is_keyword_query=False))
+
+    def archive_expired_options(self):
+        """把最后交易日已过、价格齐全的期权移入归档，之后的查询和保存只涉及未归档的期权"""
+        try:
+            names = self.engine.archive_expired()
+            if names:
+                self.engine.save_data()
+        except Exception as e:
+            QMessageBox.warning(self, "错误", f"归档失败: {str(e)}")
+            return
+        if not names:
+            QMessageBox.information(self, "提示", "没有可以归档的期权（需已过最后交易日且每个交易日都有价格）")
+            return
+        self.update_option_combos()
+        self.requery_based_on_last_action()
+        QMessageBox.information(self, "成功", f"已归档 {len(names)} 个已到期期权，共 {len(self.engine.archive)} 个归档期权")
+
+    def restore_archived_option(self):
+        archive = self.engine.archive
+        if not archive:
+            QMessageBox.information(self, "提示", "没有归档的期权")
+            return
+        name, ok = QInputDialog.getItem(self, "恢复归档期权", "选择要恢复的期权:", sorted(archive), 0, False)
+        if not ok:
+            return
+        try:
+            self.engine.restore_archived(name)
+        except Exception as e:
+            QMessageBox.warning(self, "错误", f"恢复失败: {str(e)}")
+            return
+        self.update_option_combos()
+        QMessageBox.information(self, "成功", f"已恢复 {name}，可以继续修改")
+
+    def check_editable(self, option_name):
+        """结果行对应的期权可以修改时返回True，否则提示原因"""
+        if option_name in self.options:
+            return True
+        if option_name in self.engine.archive:
+            QMessageBox.warning(self, "警告", "该期权已归档，请先通过“文件”->“恢复归档期权...”恢复后再修改!")
+        else:
+            QMessageBox.warning(self, "警告", "找不到对应的期权数据!")
+        return False
 
     def update_close_dates(self):
         self.close_date_combo.clear()
@@ -1023,36 +1696,14 @@ class OptionPositionCalculator(QMainWindow):
 
     def normal_query(self):
         """普通查询（按期权名称）"""
-        if self.query_thread and self.query_thread.isRunning():
-            QMessageBox.information(self, "提示", "查询正在进行中，请稍候...")
-            return
-
         query_date = self.query_date_input.date().toString("yyyy-MM-dd")
         option_name = self.query_option_combo.currentData()
 
-        # 初始化进度显示
-        self.query_in_progress = True
-        self.progress_bar.show()
-        self.progress_bar.setValue(0)
-        self.cancel_btn.show()
-        self.disable_buttons_during_operation(True)
-
-        # 创建并启动查询线程（非关键词查询）
-        self.query_thread = QueryThread(self, query_date, option_name, is_keyword_query=False)
-
-        # 连接信号和槽
-        self.query_thread.progress_updated.connect(self.update_progress)
-        self.query_thread.finished.connect(self.on_query_finished)
-        self.query_thread.result_ready.connect(self.display_query_results)
-
-        self.query_thread.start()
+        # 创建并启动查询任务（非关键词查询）
+        self.start_query(QueryTask(self, query_date, option_name, is_keyword_query=False))
 
     def keyword_query(self):
         """关键词查询"""
-        if self.query_thread and self.query_thread.isRunning():
-            QMessageBox.information(self, "提示", "查询正在进行中，请稍候...")
-            return
-
         query_date = self.query_date_input.date().toString("yyyy-MM-dd")
         keyword = self.keyword_input.text().strip()
 
@@ -1060,32 +1711,69 @@ class OptionPositionCalculator(QMainWindow):
             QMessageBox.warning(self, "警告", "请输入关键词后再查询!")
             return
 
+        # 创建并启动查询任务（关键词查询）
+        self.start_query(QueryTask(self, query_date, keyword=keyword, is_keyword_query=True))
+
+    def start_query(self, query_task):
+        """以交互优先级提交查询，结果行分批到达时追加到表格
+
+        新查询取代正在进行的查询：旧查询被取消，其后续信号不再显示。
+        """
+        if self.query_task:
+            self.disconnect_query_task(self.query_task)
+            self.query_task.cancel()
+
         # 初始化进度显示
         self.query_in_progress = True
-        self.progress_bar.show()
         self.progress_bar.setValue(0)
-        self.cancel_btn.show()
-        self.disable_buttons_during_operation(True)
+        self.update_operation_buttons()
 
-        # 创建并启动查询线程（关键词查询）
-        self.query_thread = QueryThread(self, query_date, keyword=keyword, is_keyword_query=True)
+        for table in (self.single_option_table, self.active_options_table, self.expired_options_table):
+            self.set_result_rows(table, [])
+        self.query_started_at = time.perf_counter()
+        self.first_rows_latency = None  # 首批结果到达界面的耗时（秒）
 
-        # 连接信号和槽
-        self.query_thread.progress_updated.connect(self.update_progress)
-        self.query_thread.finished.connect(self.on_query_finished)
-        self.query_thread.result_ready.connect(self.display_query_results)
+        self.query_task = query_task
+        self.last_query_is_keyword = query_task.is_keyword_query
 
-        self.query_thread.start()
+        # 连接信号和槽
+        self.query_task.progress_updated.connect(self.update_progress)
+        self.query_task.finished.connect(self.on_query_finished)
+        self.query_task.rows_ready.connect(self.append_query_results)
+        self.query_task.result_ready.connect(self.display_query_results)
+
+        self.query_task.start(self.scheduler)
+
+    def disconnect_query_task(self, query_task):
+        for signal in (query_task.progress_updated, query_task.finished,
+                       query_task.rows_ready, query_task.result_ready):
+            signal.disconnect()
+
+    def append_query_results(self, section, rows):
+        """追加一批结果行"""
+        if self.first_rows_latency is None:
+            self.first_rows_latency = time.perf_counter() - self.query_started_at
+
+        table = {
+            "single_option": self.single_option_table,
+            "active_options": self.active_options_table,
+            "expired_options": self.expired_options_table,
+        }[section]
+        table.model().sourceModel().append_rows(rows)
+        self.update_result_visibility()
 
     def display_query_results(self, results):
-        """显示查询结果到表格中"""
-        # 清空所有表格
-        self.single_option_table.setRowCount(0)
-        self.active_options_table.setRowCount(0)
-        self.expired_options_table.setRowCount(0)
+        """查询完成，结果行已分批显示，只需刷新表格和数量标签"""
+        self.update_result_visibility()
+
+    def update_result_visibility(self):
+        """根据已显示的结果行决定显示单期权表格还是未到期/已到期表格"""
+        single_count = self.single_option_table.model().sourceModel().rowCount()
+        active_count = self.active_options_table.model().sourceModel().rowCount()
+        expired_count = self.expired_options_table.model().sourceModel().rowCount()
 
         # 根据查询类型显示不同的表格
-        if results["single_option"]:
+        if single_count:
             # 显示单个期权数据
             self.single_option_table.show()
             self.separator.hide()
@@ -1094,38 +1782,45 @@ class OptionPositionCalculator(QMainWindow):
             self.separator2.hide()
             self.expired_options_table.hide()
             self.expired_options_label.hide()
-
-            for item in results["single_option"]:
-                self.add_query_result_row(self.single_option_table, item["date"], item["option"], False)
         else:
             # 显示所有期权数据（分为未到期和已到期）
             self.single_option_table.hide()
             self.separator.show()
 
-            if results["active_options"]:
+            if active_count:
                 self.active_options_table.show()
                 self.active_options_label.show()
-                self.active_options_label.setText(f"未到期期权 ({results['active_count']}个):")
-
-                for item in results["active_options"]:
-                    self.add_query_result_row(self.active_options_table, item["date"], item["option"], True)
+                self.active_options_label.setText(f"未到期期权 ({active_count}个):")
             else:
                 self.active_options_table.hide()
                 self.active_options_label.hide()
 
             self.separator2.show()
 
-            if results["expired_options"]:
+            if expired_count:
                 self.expired_options_table.show()
                 self.expired_options_label.show()
-                self.expired_options_label.setText(f"已到期期权 ({results['expired_count']}个):")
-
-                for item in results["expired_options"]:
-                    self.add_query_result_row(self.expired_options_table, item["date"], item["option"], True)
+                self.expired_options_label.setText(f"已到期期权 ({expired_count}个):")
             else:
                 self.expired_options_table.hide()
                 self.expired_options_label.hide()
 
+    def set_result_rows(self, table, rows):
+        table.model().sourceModel().set_rows(rows)
+
+    def filter_query_results(self, text):
+        """通过代理模型筛选结果，不重建表格"""
+        for table in (self.single_option_table, self.active_options_table, self.expired_options_table):
+            table.model().setFilterFixedString(text.strip())
+
+    def selected_result_row(self):
+        """返回查询结果表格中选中行的数据，没有选中时返回None"""
+        for table in (self.single_option_table, self.active_options_table, self.expired_options_table):
+            indexes = table.selectionModel().selectedRows()
+            if indexes:
+                return table.model().row_data(indexes[0])
+        return None
+
     @pyqtSlot(int, str)
     def update_progress(self, value, message):
         """更新进度条和状态信息"""
@@ -1135,12 +1830,17 @@ class OptionPositionCalculator(QMainWindow):
     def on_query_finished(self, success, error_messages):
         """查询完成后的处理"""
         self.progress_bar.setValue(100 if success else 0)
-        self.cancel_btn.hide()
-        self.disable_buttons_during_operation(False)
         self.query_in_progress = False
 
         if success:
-            self.progress_label.setText("查询完成")
+            elapsed = time.perf_counter() - self.query_started_at
+            timing = f"总耗时 {elapsed:.2f}s"
+            if self.first_rows_latency is not None:
+                timing = f"首批结果 {self.first_rows_latency:.2f}s，{timing}"
+            phases = self.query_task.reporter.summary()
+            if phases:
+                timing = f"{timing}；{phases}"
+            self.progress_label.setText(f"查询完成（{timing}）")
 
             # 显示错误信息（如果有）
             if error_messages and not ("error" in error_messages):
@@ -1157,110 +1857,28 @@ class OptionPositionCalculator(QMainWindow):
             self.progress_label.setText(error_msg)
             QMessageBox.warning(self, "查询失败", error_msg)
 
-        self.query_thread = None
-
-    def add_query_result_row(self, table, date, option, is_all_options_mode):
-        row = table.rowCount()
-        table.insertRow(row)
-
-        # 日期列
-        table.setItem(row, 0, QTableWidgetItem(date))
-
-        # 期权名称
-        table.setItem(row, 1, QTableWidgetItem(option["name"]))
+        self.query_task = None
+        self.update_operation_buttons()
 
-        # 执行价格
-        table.setItem(row, 2, QTableWidgetItem(f"{option['strike_price']:.2f}"))
-
-        # 每日冲回量
-        table.setItem(row, 3, QTableWidgetItem(f"{option['daily_reversal']:.2f}"))
-
-        # 收盘价
-        close_price = option["close_prices"].get(date, "N/A")
-        close_price_text = f"{close_price:.2f}" if close_price != "N/A" else "N/A"
-        table.setItem(row, 4, QTableWidgetItem(close_price_text))
-
-        # 实际成交量
-        actual_volume = option["actual_volumes"].get(date, 0)
-        table.setItem(row, 5, QTableWidgetItem(f"{actual_volume:.2f}"))
-
-        # 平仓量
-        close_amount = option["close_amounts"].get(date, 0)
-        table.setItem(row, 6, QTableWidgetItem(f"{close_amount:.2f}"))
-
-        # 最新头寸
-        position = option["positions"].get(date, 0)
-        table.setItem(row, 7, QTableWidgetItem(f"{position:.2f}"))
-
-    def calculate_option_data(self, option, end_date=None):
-        """计算期权数据，只计算到指定日期"""
-        prev_position = option["initial_amount"]
-
-        for date in option["trade_dates"]:
-            if end_date and date > end_date:
-                break
-
-            if date not in option["close_prices"]:
-                # 只获取查询日期及之前的数据
-                if date <= end_date if end_date else True:
-                    close_price = self.get_dce_daily_close(option["code"], date)
-                    option["close_prices"][date] = close_price if close_price is not None else "N/A"
-
-            if date not in option["actual_volumes"]:
-                actual_volume = 0
-                close_price = option["close_prices"].get(date, "N/A")
-
-                if close_price != "N/A":
-                    if option["initial_amount"] < 0:
-                        if close_price > option["strike_price"]:
-                            actual_volume = -option["daily_reversal"]
-                    else:
-                        if close_price < option["strike_price"]:
-                            actual_volume = -option["daily_reversal"]
-
-                option["actual_volumes"][date] = actual_volume
-
-            close_amount = option["close_amounts"].get(date, 0)
-
-            position_change = option["daily_reversal"] + option["actual_volumes"][date]
-            option["position_changes"][date] = position_change
-
-            current_position = prev_position + position_change + close_amount
-            option["positions"][date] = current_position
-            prev_position = current_position
+        # 查询期间有修改时按同样的查询方式再查询一次；查询已取消或失败时不再查询
+        requery, self.requery_pending = self.requery_pending, False
+        if requery and success:
+            self.requery_based_on_last_action()
 
     def edit_close_price(self):
-        # 检查哪个表格有选中项
-        selected_items = self.single_option_table.selectedItems()
-        table = self.single_option_table
-        if not selected_items or len(selected_items) < 5:
-            selected_items = self.active_options_table.selectedItems()
-            table = self.active_options_table
-            if not selected_items or len(selected_items) < 5:
-                selected_items = self.expired_options_table.selectedItems()
-                table = self.expired_options_table
-                if not selected_items or len(selected_items) < 5:
-                    QMessageBox.warning(self, "警告", "请先选择要修改的行!")
-                    return
-
-        row = selected_items[0].row()
-        option_name = table.item(row, 1).text()
-        date = table.item(row, 0).text()
-
-        if option_name not in self.options:
-            QMessageBox.warning(self, "警告", "找不到对应的期权数据!")
+        row_data = self.selected_result_row()
+        if row_data is None:
+            QMessageBox.warning(self, "警告", "请先选择要修改的行!")
             return
 
-        current_price_item = table.item(row, 4)
-        current_price = current_price_item.text()
+        option_name = row_data["name"]
+        date = row_data["date"]
 
-        try:
-            if current_price == "N/A":
-                default_value = 0.0
-            else:
-                default_value = float(current_price)
-        except ValueError:
-            default_value = 0.0
+        if not self.check_editable(option_name):
+            return
+
+        current_price = row_data["close_price"]
+        default_value = 0.0 if current_price == "N/A" else float(current_price)
 
         new_price, ok = QInputDialog.getDouble(
             self, "修改收盘价",
@@ -1270,43 +1888,26 @@ class OptionPositionCalculator(QMainWindow):
         )
 
         if ok:
-            self.options[option_name]["close_prices"][date] = new_price
-            self.recalculate_option_from_date(self.options[option_name], date)
+            self.set_option_daily_value(option_name, "close_prices", date, new_price)
             # 保存修改后的数据
-            self.save_data()
+            self.schedule_save()
             # 根据当前查询类型重新查询
             self.requery_based_on_last_action()
             QMessageBox.information(self, "成功", "收盘价已更新并重新计算!")
 
     def edit_close_amount(self):
-        # 检查哪个表格有选中项
-        selected_items = self.single_option_table.selectedItems()
-        table = self.single_option_table
-        if not selected_items or len(selected_items) < 7:
-            selected_items = self.active_options_table.selectedItems()
-            table = self.active_options_table
-            if not selected_items or len(selected_items) < 7:
-                selected_items = self.expired_options_table.selectedItems()
-                table = self.expired_options_table
-                if not selected_items or len(selected_items) < 7:
-                    QMessageBox.warning(self, "警告", "请先选择要修改的行!")
-                    return
-
-        row = selected_items[0].row()
-        option_name = table.item(row, 1).text()
-        date = table.item(row, 0).text()
-
-        if option_name not in self.options:
-            QMessageBox.warning(self, "警告", "找不到对应的期权数据!")
+        row_data = self.selected_result_row()
+        if row_data is None:
+            QMessageBox.warning(self, "警告", "请先选择要修改的行!")
             return
 
-        current_amount_item = table.item(row, 6)
-        current_amount = current_amount_item.text()
+        option_name = row_data["name"]
+        date = row_data["date"]
 
-        try:
-            default_value = float(current_amount)
-        except ValueError:
-            default_value = 0.0
+        if not self.check_editable(option_name):
+            return
+
+        default_value = float(row_data["close_amount"])
 
         new_amount, ok = QInputDialog.getDouble(
             self, "修改平仓量",
@@ -1315,17 +1916,16 @@ class OptionPositionCalculator(QMainWindow):
         )
 
         if ok:
-            self.options[option_name]["close_amounts"][date] = new_amount
-            self.recalculate_option_from_date(self.options[option_name], date)
+            self.set_option_daily_value(option_name, "close_amounts", date, new_amount)
             # 保存修改后的数据
-            self.save_data()
+            self.schedule_save()
             # 根据当前查询类型重新查询
             self.requery_based_on_last_action()
             QMessageBox.information(self, "成功", "平仓量已更新并重新计算!")
 
     def refresh_market_data(self):
-        """重新从网站获取数据并更新，使用线程避免UI卡顿"""
-        if self.refresh_thread and self.refresh_thread.isRunning():
+        """重新从网站获取数据并更新，拆分为后台任务避免UI卡顿"""
+        if self.refresh_task:
             QMessageBox.information(self, "提示", "数据更新正在进行中，请稍候...")
             return
 
@@ -1334,13 +1934,10 @@ class OptionPositionCalculator(QMainWindow):
         keyword = self.keyword_input.text().strip()
 
         # 初始化进度显示
-        self.progress_bar.show()
         self.progress_bar.setValue(0)
-        self.cancel_btn.show()
-        self.disable_buttons_during_operation(True)
 
-        # 创建并启动线程，传入关键词以便筛选需要刷新的数据
-        self.refresh_thread = DataRefreshThread(
+        # 创建并提交刷新任务，传入关键词以便筛选需要刷新的数据
+        self.refresh_task = DataRefreshTask(
             self,
             option_name if not keyword else None,
             query_date,
@@ -1348,85 +1945,65 @@ class OptionPositionCalculator(QMainWindow):
         )
 
         # 连接信号和槽
-        self.refresh_thread.progress_updated.connect(self.update_progress)
-        self.refresh_thread.finished.connect(self.on_refresh_finished)
+        self.refresh_task.progress_updated.connect(self.update_progress)
+        self.refresh_task.finished.connect(self.on_refresh_finished)
 
-        self.refresh_thread.start()
+        self.update_operation_buttons()
+        self.refresh_task.start(self.scheduler)
 
     def on_refresh_finished(self, success, message):
         """刷新完成后的处理"""
         self.progress_bar.setValue(100 if success else 0)
         self.progress_label.setText(message)
-        self.cancel_btn.hide()
-        self.disable_buttons_during_operation(False)
+        self.refresh_task = None
+        self.update_operation_buttons()
 
         if success:
             # 根据最后一次查询类型重新查询
             self.requery_based_on_last_action()
 
-        self.refresh_thread = None
-
     def requery_based_on_last_action(self):
         """根据最后一次查询类型重新查询"""
+        if self.query_in_progress:
+            # 正在进行的查询可能读到修改前的版本，结束后再查询一次
+            self.requery_pending = True
+            return
+
         # 判断最后一次是普通查询还是关键词查询
-        if self.query_thread and hasattr(self.query_thread, 'is_keyword_query'):
-            if self.query_thread.is_keyword_query:
-                # 重新执行关键词查询
-                self.keyword_query()
-            else:
-                # 重新执行普通查询
-                self.normal_query()
+        if self.last_query_is_keyword:
+            # 重新执行关键词查询
+            self.keyword_query()
         else:
-            # 默认执行普通查询
+            # 重新执行普通查询
             self.normal_query()
 
     def cancel_operation(self):
         """取消当前正在进行的操作"""
-        if self.refresh_thread and self.refresh_thread.isRunning():
-            self.refresh_thread.cancel()
+        if self.refresh_task:
+            self.refresh_task.cancel()
             self.progress_label.setText("正在取消操作...")
-        elif self.query_thread and self.query_thread.isRunning():
-            self.query_thread.cancel()
+        elif self.query_task:
+            self.query_task.cancel()
             self.progress_label.setText("正在取消查询...")
-        elif self.query_in_progress:
-            self.query_in_progress = False
-            self.progress_label.setText("查询已取消")
-            self.cancel_btn.hide()
-            self.disable_buttons_during_operation(False)
-
-    def disable_buttons_during_operation(self, disable):
-        """在操作进行时禁用相关按钮"""
-        # 查询标签页按钮
-        self.query_btn.setEnabled(not disable)
-        self.keyword_query_btn.setEnabled(not disable)
-        self.refresh_btn.setEnabled(not disable)
-        self.edit_close_price_btn.setEnabled(not disable)
-        self.edit_close_amount_btn.setEnabled(not disable)
-
-        # 其他标签页按钮
-        self.save_btn.setEnabled(not disable)
-        self.update_btn.setEnabled(not disable)
-        self.delete_btn.setEnabled(not disable)
-        self.add_date_btn.setEnabled(not disable)
-        self.batch_add_btn.setEnabled(not disable)
-        self.clear_dates_btn.setEnabled(not disable)
-        self.delete_date_btn.setEnabled(not disable)
-        self.close_btn.setEnabled(not disable)
+
+    def update_operation_buttons(self):
+        """按正在进行的操作更新按钮和进度显示
+
+        刷新发布的是新的期权版本，查询和修改始终基于一致的版本进行，
+        新查询会取代正在进行的查询，因此只有刷新不能重复启动，其余按钮始终可用。
+        """
+        refreshing = self.refresh_task is not None
+        querying = self.query_in_progress
+
+        self.refresh_btn.setEnabled(not refreshing)
+
+        if refreshing or querying:
+            self.progress_bar.show()
+        self.cancel_btn.setVisible(refreshing or querying)
 
     def refresh_option_data(self, option, date):
         """刷新单个期权的市场数据"""
-        # 重新获取收盘价
-        close_price = self.get_dce_daily_close(option["code"], date)
-        if close_price is not None:
-            option["close_prices"][date] = close_price
-            # 重新计算该日期及之后的数据
-            self.recalculate_option_from_date(option, date)
-        else:
-            # 查询日期前的数据获取失败才标记为N/A
-            current_date = QDate.currentDate().toString("yyyy-MM-dd")
-            if date < current_date:
-                option["close_prices"][date] = "N/A"
-            self.recalculate_option_from_date(option, date)
+        self.engine.refresh_option_data(option, date)
 
     def record_close(self):
         option_name = self.close_option_combo.currentData()
@@ -1445,114 +2022,135 @@ class OptionPositionCalculator(QMainWindow):
             QMessageBox.warning(self, "警告", "请输入有效的平仓量!")
             return
 
-        option = self.options[option_name]
-        option["close_amounts"][date] = close_amount
-        self.recalculate_option_from_date(option, date)
+        self.set_option_daily_value(option_name, "close_amounts", date, close_amount)
 
         QMessageBox.information(self, "成功", f"已记录 {option_name} 在 {date} 的平仓量 {close_amount}")
         self.close_amount_input.clear()
-        self.save_data()
+        self.schedule_save()
 
-    def recalculate_option_from_date(self, option, start_date):
-        if start_date not in option["trade_dates"]:
+    def import_closes(self):
+        """批量写入平仓量/收盘价：每个期权从最早修改的日期重新计算一次，一次保存、一次重新查询"""
+        dialog = CloseBlotterDialog(self.options, self)
+        if dialog.exec_() != QDialog.Accepted:
             return
-
-        start_index = option["trade_dates"].index(start_date)
-
-        prev_position = option["initial_amount"]
-        if start_index > 0:
-            prev_date = option["trade_dates"][start_index - 1]
-            prev_position = option["positions"].get(prev_date, option["initial_amount"])
-
-        for i in range(start_index, len(option["trade_dates"])):
-            date = option["trade_dates"][i]
-
-            actual_volume = 0
-            close_price = option["close_prices"].get(date, "N/A")
-
-            if close_price != "N/A":
-                if option["initial_amount"] < 0:
-                    if close_price > option["strike_price"]:
-                        actual_volume = -option["daily_reversal"]
-                else:
-                    if close_price < option["strike_price"]:
-                        actual_volume = -option["daily_reversal"]
-
-            option["actual_volumes"][date] = actual_volume
-
-            close_amount = option["close_amounts"].get(date, 0)
-
-            position_change = option["daily_reversal"] + option["actual_volumes"][date]
-            option["position_changes"][date] = position_change
-
-            current_position = prev_position + position_change + close_amount
-            option["positions"][date] = current_position
-            prev_position = current_position
+        from option_import import close_updates
+        starts = self.engine.set_daily_values(close_updates(dialog.rows))
+        self.schedule_save()
+        self.requery_based_on_last_action()
+        QMessageBox.information(self, "成功", f"已写入 {len(dialog.rows)} 条平仓记录，重新计算 {len(starts)} 个期权")
+
+    def set_option_daily_value(self, option_name, field, date, value):
+        """修改期权某日的收盘价/平仓量，并在新版本上重新计算该日期及之后的头寸"""
+        def apply(option):
+            option[field][date] = value
+            self.engine.recalculate_option_from_date(option, date)
+
+        return self.engine.update_option(option_name, apply)
+
+    def schedule_save(self):
+        """以交互优先级在后台保存，连续修改时排队中的保存任务合并为一次"""
+        def save(token):
+            try:
+                self.engine.save_data()
+            except Exception as e:
+                self.save_failed.emit(str(e))
+
+        self.scheduler.submit(save, INTERACTIVE, key="save")
 
     def save_data(self):
         try:
-            data_to_save = {}
-            for name, option in self.options.items():
-                data_to_save[name] = {
-                    "name": option["name"],
-                    "code": option["code"],
-                    "strike_price": option["strike_price"],
-                    "initial_amount": option["initial_amount"],
-                    "trade_dates": option["trade_dates"],
-                    "daily_reversal": option["daily_reversal"],
-                    "close_prices": option["close_prices"],
-                    "actual_volumes": option["actual_volumes"],
-                    "close_amounts": option["close_amounts"],
-                    "position_changes": option["position_changes"],
-                    "positions": option["positions"]
-                }
-
-            with open(self.data_file, 'w') as f:
-                json.dump(data_to_save, f, indent=4)
-
+            self.engine.save_data()
             return True
         except Exception as e:
             QMessageBox.warning(self, "错误", f"保存数据失败: {str(e)}")
             return False
 
     def save_data_as(self):
-        file_name, _ = QFileDialog.getSaveFileName(self, "保存数据", "", "JSON文件 (*.json)")
+        file_name, _ = QFileDialog.getSaveFileName(self, "保存数据", "", DATA_FILE_FILTER)
         if file_name:
-            self.data_file = file_name
-            if self.save_data():
-                QMessageBox.information(self, "成功", f"数据已保存到 {file_name}")
+            try:
+                self.engine.save_data_as(file_name)  # 已到期期权的归档一并复制
+            except Exception as e:
+                QMessageBox.warning(self, "错误", f"保存数据失败: {str(e)}")
+                return
+            QMessageBox.information(self, "成功", f"数据已保存到 {file_name}")
+
+    def export_history(self):
+        """把当前版本的头寸历史导出为长表（CSV或Parquet），在后台执行"""
+        file_name, selected = QFileDialog.getSaveFileName(
+            self, "导出头寸历史", "positions.csv", "CSV文件 (*.csv);;Parquet (*.parquet)")
+        if not file_name:
+            return
+        file_format = "parquet" if selected.startswith("Parquet") or file_name.endswith(".parquet") else "csv"
+        options = self.engine.all_options()  # 已发布的版本不会再被修改，归档的期权在导出时逐个读取
+        valuation = self.engine.valuation
+
+        def export(token):
+            try:
+                result = export_positions(options, file_name, file_format=file_format, valuation=valuation)
+                self.export_finished.emit(True, f"已导出 {result['options']} 个期权的 {result['rows']} 行到 {file_name}")
+            except ExportError as e:
+                self.export_finished.emit(False, str(e))
+            except Exception as e:
+                self.export_finished.emit(False, f"导出失败: {str(e)}")
+
+        self.scheduler.submit(export, BACKGROUND, key="export")
+        self.statusBar().showMessage("正在导出头寸历史...")
+
+    def on_export_finished(self, success, message):
+        if success:
+            self.statusBar().showMessage(message, 10000)
+        else:
+            self.statusBar().clearMessage()
+            QMessageBox.warning(self, "错误", message)
+
+    def set_loading(self, loading):
+        """加载期间禁用菜单和各标签页，避免在数据读入前修改或保存"""
+        self.menuBar().setEnabled(not loading)
+        self.tab_widget.setEnabled(not loading)
+        self.progress_label.setText("正在加载数据..." if loading else "准备就绪")
+
+    def start_loading(self):
+        """在后台读取行情缓存和期权数据，完成后发出 data_loaded"""
+        valuation = self.valuation_settings()
+
+        def load(token):
+            try:
+                self.engine.quote_cache.load()
+                try:
+                    self.engine.valuation = valuation_params(valuation)
+                except ValueError:
+                    pass  # 保存的估值设置无效时不估值，可在“设置”中重新设置
+                self.data_loaded.emit(self.engine.load_data(), "")
+            except Exception as e:
+                self.data_loaded.emit(False, str(e))
+
+        self.scheduler.submit(load, INTERACTIVE, key="load")
+
+    def on_data_loaded(self, loaded, error):
+        self.data_ready = True
+        self.set_loading(False)
+        self.update_valuation_columns()
+        if error:
+            QMessageBox.warning(self, "错误", f"加载数据失败: {error}")
+        elif loaded:
+            self.update_option_combos()
+        self.prefetch_timer.start(60 * 1000)
+        self.check_prefetch()
 
     def load_data(self):
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-
-            self.options = {}
-            for name, option_data in data.items():
-                self.options[name] = {
-                    "name": option_data["name"],
-                    "code": option_data["code"],
-                    "strike_price": option_data["strike_price"],
-                    "initial_amount": option_data["initial_amount"],
-                    "trade_dates": option_data["trade_dates"],
-                    "daily_reversal": option_data["daily_reversal"],
-                    "close_prices": option_data["close_prices"],
-                    "actual_volumes": option_data["actual_volumes"],
-                    "close_amounts": option_data["close_amounts"],
-                    "position_changes": option_data["position_changes"],
-                    "positions": option_data["positions"]
-                }
+            if not self.engine.load_data():
+                return False
 
             self.update_option_combos()
             return True
-        except FileNotFoundError:
-            return False
         except Exception as e:
             QMessageBox.warning(self, "错误", f"加载数据失败: {str(e)}")
             return False
 
     def load_data_from_file(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "加载数据", "", "JSON文件 (*.json)")
+        file_name, _ = QFileDialog.getOpenFileName(self, "加载数据", "", "数据文件 (*.json *.dcesnap);;" + DATA_FILE_FILTER)
         if file_name:
             self.data_file = file_name
             if self.load_data():
@@ -1561,50 +2159,346 @@ class OptionPositionCalculator(QMainWindow):
                 QMessageBox.warning(self, "错误", "加载数据失败")
 
     def get_dce_daily_close(self, contract_code: str, date_yyyymmdd: str) -> float | None:
-        date_yyyymmdd = date_yyyymmdd.replace("-", "")
-
-        url = "http://www.dce.com.cn/publicweb/quotesdata/dayQuotesCh.html"
-        params = {
-            "dayQuotes.variety": "all",
-            "dayQuotes.trade_type": "0",
-            "year": date_yyyymmdd[:4],
-            "month": str(int(date_yyyymmdd[4:6]) - 1),
-            "day": date_yyyymmdd[6:8],
-        }
-
-        try:
-            response = requests.get(
-                url,
-                params=params,
-                headers={"User-Agent": "Mozilla/5.0"},
-                timeout=10
-            )
-            response.encoding = 'utf-8'
-
-            if "大连商品交易所  日行情表" not in response.text:
-                return None
+        return self.engine.get_dce_daily_close(contract_code, date_yyyymmdd)
 
-            df = pd.read_html(StringIO(response.text), header=0)[0]
-            df.columns = [col.strip() for col in df.columns]
 
-            if '合约名称' not in df.columns or '收盘价' not in df.columns:
-                return None
+def run_prefetch(args):
+    engine = PositionEngine(args.data, QuoteCache(args.cache), audit_log=FetchAuditLog(args.audit_log),
+                            parse_pool=ParsePool(args.parse_workers), price_field=PRICE_FIELD_ARGS[args.price_field])
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.data}")
+        return 2
 
-            df['合约名称'] = df['合约名称'].astype(str).str.strip()
-            target_row = df[df['合约名称'].str.lower() == contract_code.strip().lower()]
+    target = args.date or latest_published_date()
+    unavailable = []
 
-            if target_row.empty:
-                return None
-
-            close_price = target_row.iloc[0]['收盘价']
-            return float(close_price) if pd.notna(close_price) and close_price != "-" else None
-
-        except Exception:
-            return None
+    def on_day(date, summary):
+        if summary is None:
+            unavailable.append(date)
+            print(f"{date}: 行情表不可用")
+        else:
+            print(f"{date}: 涉及 {summary['options']} 个期权，填入 {summary['updated']} 个收盘价")
+
+    started = time.perf_counter()
+    summaries = engine.prefetch_missing(target, on_day=on_day)
+    engine.save_data()
+    engine.parse_pool.shutdown()
+    print(f"预取完成，截止 {target}，共 {len(summaries)} 个交易日，耗时 {time.perf_counter() - started:.2f}s")
+    return 1 if target in unavailable else 0
+
+
+def run_fetch_report(args):
+    summary = summarize(read_records(args.log), args.by)
+    if not summary:
+        print(f"审计日志中没有记录: {args.log}")
+        return 1
+    if args.days:
+        summary = dict(list(summary.items())[-args.days:])
+    print(format_report(summary))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+    return 0
+
+
+def run_import_options(args):
+    from option_import import OptionImportError, load_option_table
+    engine = PositionEngine(args.data)
+    engine.load_data()
+    try:
+        options = load_option_table(args.file)
+    except OptionImportError as e:
+        print(f"表格中有错误，未导入任何期权：\n{e}")
+        return 1
+
+    skipped = [option["name"] for option in options if option["name"] in engine.options and not args.overwrite]
+    options = [option for option in options if option["name"] not in skipped]
+    engine.put_options(options)
+    engine.save_data()
+    print(f"已导入 {len(options)} 个期权" + (f"，跳过已存在的 {len(skipped)} 个（使用 --overwrite 覆盖）" if skipped else ""))
+    return 0
+
+
+def run_import_closes(args):
+    from option_import import OptionImportError, close_updates, load_close_table
+    engine = PositionEngine(args.data)
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.data}")
+        return 2
+    try:
+        rows = load_close_table(args.file, engine.options)
+    except OptionImportError as e:
+        print(f"表格中有错误，未写入任何记录：\n{e}")
+        return 1
+
+    started = time.perf_counter()
+    starts = engine.set_daily_values(close_updates(rows))
+    engine.save_data()
+    print(f"已写入 {len(rows)} 条平仓记录，重新计算 {len(starts)} 个期权，耗时 {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def run_export(args):
+    engine = PositionEngine(args.data)
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.data}")
+        return 2
+    valuation = None
+    if args.vol_surface or args.vol is not None or args.rate is not None:
+        from option_valuation import ValuationParams
+        try:
+            settings = ValuationParams.load(args.vol_surface).to_dict() if args.vol_surface else {}
+            settings.update({key: value for key, value in (("vol", args.vol), ("rate", args.rate)) if value is not None})
+            valuation = ValuationParams.from_dict(settings)
+        except (OSError, ValueError) as e:
+            print(f"估值参数不正确: {str(e)}")
+            return 1
+    started = time.perf_counter()
+    try:
+        result = export_positions(engine.all_options(), args.out, args.layout, args.format, args.incremental,
+                                  valuation)
+    except ExportError as e:
+        print(str(e))
+        return 1
+    mode = "增量" if result["incremental"] else "完整"
+    print(f"{mode}导出 {result['options']} 个期权的 {result['rows']} 行到 {args.out}（批次 {result['seq']}），"
+          f"耗时 {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def run_archive(args):
+    engine = PositionEngine(args.data)
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.data}")
+        return 2
+    names = engine.archive_expired(args.date)
+    if names:
+        engine.save_data()
+    print(f"已归档 {len(names)} 个已到期期权到 {engine.archive.path}，"
+          f"数据文件中剩余 {len(engine.options)} 个，共 {len(engine.archive)} 个归档期权")
+    return 0
+
+
+def run_restore_archived(args):
+    engine = PositionEngine(args.data)
+    engine.load_data()
+    missing = [name for name in args.names if engine.restore_archived(name) is None]
+    for name in missing:
+        print(f"归档中没有期权: {name}")
+    print(f"已恢复 {len(args.names) - len(missing)} 个期权到 {args.data}")
+    return 1 if missing else 0
+
+
+def run_convert_data(args):
+    engine = PositionEngine(args.source)
+    started = time.perf_counter()
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.source}")
+        return 2
+    loaded = time.perf_counter()
+    engine.save_data_as(args.target)
+    print(f"已将 {len(engine.options)} 个期权从 {args.source} 转换为 {args.target}"
+          f"（加载 {loaded - started:.2f}s，保存 {time.perf_counter() - loaded:.2f}s）")
+    return 0
+
+
+def run_exposure(args):
+    engine = PositionEngine(args.data)
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.data}")
+        return 2
+    started = time.perf_counter()
+    rows = engine.exposure_rows(args.by, args.date, args.group)
+    elapsed = time.perf_counter() - started
+    columns = ("group", "date", "options", "position", "daily_reversal", "actual_volume", "uncalculated")
+    if args.out:
+        with open(args.out, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows([row[column] for column in columns] for row in rows)
+        print(f"已将 {len(rows)} 行汇总结果写入 {args.out}")
+    else:
+        print("\t".join(columns))
+        for row in rows:
+            print("\t".join(str(row[column]) for column in columns))
+    pending = sum(row["uncalculated"] for row in rows)
+    if pending:
+        print(f"{pending} 个 (期权, 交易日) 的头寸尚未计算，未计入净头寸和实际成交量（可先运行 prefetch）")
+    print(f"汇总耗时 {elapsed:.3f}s")
+    return 0
+
+
+def run_pnl(args):
+    engine = PositionEngine(args.data)
+    if not engine.load_data():
+        print(f"找不到期权数据文件: {args.data}")
+        return 2
+    options = dict(engine.all_options()) if args.include_archived else engine.options
+    started = time.perf_counter()
+    rows = engine.pnl_rows(args.option, args.start, args.end, options=options)
+    elapsed = time.perf_counter() - started
+    if rows is None:
+        print(f"找不到期权: {args.option}")
+        return 1
+    if args.out:
+        from position_pnl import write_pnl_csv
+        write_pnl_csv(rows, args.out)
+        print(f"已将 {len(rows)} 个交易日的损益写入 {args.out}")
+    else:
+        columns = ("date", "position", "carry", "reversal_pnl", "exercise_pnl", "close_out_pnl", "pnl",
+                   "cumulative_pnl")
+        print("\t".join(columns))
+        for row in rows:
+            print("\t".join([row["date"]] + [f"{row[column]:.2f}" for column in columns[1:]]))
+    print(f"{'组合' if args.option is None else args.option}共 {len(rows)} 个交易日，计算耗时 {elapsed:.3f}s")
+    return 0
+
+
+def run_price_matrix(args):
+    from price_matrix import build_price_matrix
+    started = time.perf_counter()
+    try:
+        contracts, dates = build_price_matrix(QuoteCache(args.cache), args.out, PRICE_FIELD_ARGS[args.field])
+    except ValueError as e:
+        print(str(e))
+        return 1
+    print(f"价格矩阵已写入 {args.out}：{contracts} 个合约 × {dates} 个交易日，耗时 {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def main(argv=None):
+    multiprocessing.freeze_support()  # 打包为可执行文件时，解析进程池的子进程从这里启动
+    parser = argparse.ArgumentParser(description="期权头寸计算及期货数据统计系统")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="以本地HTTP/JSON服务模式运行")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    serve_parser.add_argument("--price-field", choices=PRICE_FIELD_ARGS, default="close",
+                              help="计算头寸使用收盘价(close)或结算价(settlement)")
+
+    prefetch_parser = subparsers.add_parser("prefetch", help="收盘后预取日行情表并计算头寸（可由计划任务定时运行）")
+    prefetch_parser.add_argument("--date", help="预取截止日期YYYY-MM-DD，默认最近一个已发布行情的交易日")
+    prefetch_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    prefetch_parser.add_argument("--cache", default="quote_cache.json", help="日行情表缓存文件")
+    prefetch_parser.add_argument("--audit-log", default="fetch_audit.log", help="行情获取审计日志")
+    prefetch_parser.add_argument("--parse-workers", type=int, help="解析进程数，0表示在下载线程中解析，默认按CPU核数")
+    prefetch_parser.add_argument("--price-field", choices=PRICE_FIELD_ARGS, default="close",
+                                 help="填入收盘价(close)或结算价(settlement)，应与界面中的设置一致")
+
+    report_parser = subparsers.add_parser("fetch-report", help="按天汇总行情获取审计日志的延迟和失败原因")
+    report_parser.add_argument("--log", default="fetch_audit.log", help="行情获取审计日志")
+    report_parser.add_argument("--by", choices=["fetch", "trade"], default="fetch",
+                               help="按获取日期(fetch)或交易日期(trade)汇总")
+    report_parser.add_argument("--days", type=int, help="只显示最近的天数")
+    report_parser.add_argument("--json", help="将汇总结果写入JSON文件")
+
+    import_parser = subparsers.add_parser("import-options", help="从CSV/Excel表格批量导入期权")
+    import_parser.add_argument("file", help="CSV或Excel文件，每行一个 (期权, 交易日)")
+    import_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    import_parser.add_argument("--overwrite", action="store_true", help="覆盖已存在的同名期权（默认跳过）")
+
+    closes_parser = subparsers.add_parser("import-closes", help="从CSV/Excel表格批量写入平仓量和收盘价")
+    closes_parser.add_argument("file", help="CSV或Excel文件，表头: 期权名称,日期,平仓量,收盘价")
+    closes_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+
+    export_parser = subparsers.add_parser("export", help="导出头寸历史（长表/宽表，CSV/Parquet/Arrow）")
+    export_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    export_parser.add_argument("--out", required=True, help="CSV文件，或Parquet/Arrow输出目录")
+    export_parser.add_argument("--layout", choices=["long", "wide"], default="long", help="长表或宽表")
+    export_parser.add_argument("--format", choices=["csv", "parquet", "arrow"],
+                               help="默认按 --out 的扩展名，其他为CSV")
+    export_parser.add_argument("--incremental", action="store_true",
+                               help="只追加上次导出后新增或有变化的 (期权, 交易日)，仅支持长表")
+    export_parser.add_argument("--vol", type=float, help="附加 Black-76 理论价格和希腊值，默认波动率（小数，如0.2）")
+    export_parser.add_argument("--rate", type=float, help="无风险利率（小数），指定时同样附加估值列")
+    export_parser.add_argument("--vol-surface", help="波动率曲面JSON文件（格式见 option_valuation.py）")
+
+    archive_parser = subparsers.add_parser("archive", help="把最后交易日已过、价格齐全的期权移入归档目录")
+    archive_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    archive_parser.add_argument("--date", help="当前日期 YYYY-MM-DD，最后交易日在此之前的期权才归档，默认今天")
+
+    restore_parser = subparsers.add_parser("restore-archived", help="把归档的期权恢复到数据文件")
+    restore_parser.add_argument("names", nargs="+", help="期权名称")
+    restore_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+
+    convert_parser = subparsers.add_parser("convert-data", help="在JSON和二进制快照（.dcesnap）之间转换数据文件")
+    convert_parser.add_argument("source", help="原数据文件（自动识别格式）")
+    convert_parser.add_argument("target", help="目标文件，扩展名为 .dcesnap 时保存为快照，否则为JSON")
+
+    exposure_parser = subparsers.add_parser("exposure", help="按期货合约或品种汇总每个交易日的净头寸")
+    exposure_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    exposure_parser.add_argument("--by", choices=["code", "product"], default="code",
+                                 help="按期货合约(code)或品种(product)汇总")
+    exposure_parser.add_argument("--date", help="只显示该日 YYYY-MM-DD，默认全部交易日")
+    exposure_parser.add_argument("--group", help="只显示该期货合约或品种")
+    exposure_parser.add_argument("--out", help="写入CSV文件，默认输出到终端")
+
+    pnl_parser = subparsers.add_parser("pnl", help="按计算头寸使用的价格计算逐日损益，分为持仓、冲回、行权、平仓四部分")
+    pnl_parser.add_argument("--data", default="options_data.json", help="期权数据文件")
+    pnl_parser.add_argument("--option", help="只计算该期权，默认输出组合逐日合计")
+    pnl_parser.add_argument("--start", help="起始日期 YYYY-MM-DD（累计损益仍从第一个交易日算起）")
+    pnl_parser.add_argument("--end", help="截止日期 YYYY-MM-DD")
+    pnl_parser.add_argument("--include-archived", action="store_true", help="包括已归档的期权（逐个读取归档文件）")
+    pnl_parser.add_argument("--out", help="写入CSV文件，默认输出到终端")
+
+    matrix_parser = subparsers.add_parser("price-matrix", help="由行情缓存构建内存映射的 合约×交易日 价格矩阵")
+    matrix_parser.add_argument("--cache", default="quote_cache.json", help="日行情表缓存文件")
+    matrix_parser.add_argument("--out", default="price_matrix", help="输出目录")
+    matrix_parser.add_argument("--field", choices=PRICE_FIELD_ARGS, default="close",
+                               help="收盘价(close)或结算价(settlement)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "prefetch":
+        return run_prefetch(args)
+
+    if args.command == "fetch-report":
+        return run_fetch_report(args)
+
+    if args.command == "import-options":
+        return run_import_options(args)
+
+    if args.command == "import-closes":
+        return run_import_closes(args)
+
+    if args.command == "export":
+        return run_export(args)
+
+    if args.command == "archive":
+        return run_archive(args)
+
+    if args.command == "restore-archived":
+        return run_restore_archived(args)
+
+    if args.command == "convert-data":
+        return run_convert_data(args)
+
+    if args.command == "exposure":
+        return run_exposure(args)
+
+    if args.command == "pnl":
+        return run_pnl(args)
+
+    if args.command == "price-matrix":
+        return run_price_matrix(args)
+
+    if args.command == "serve":
+        from position_service import PositionService
+        engine = PositionEngine(args.data, QuoteCache("quote_cache.json"), audit_log=FetchAuditLog("fetch_audit.log"),
+                                price_field=PRICE_FIELD_ARGS[args.price_field])
+        engine.load_data()
+        service = PositionService(args.data, args.host, args.port, engine=engine)
+        print(f"头寸服务已启动: {service.address}")
+        service.serve_forever()
+        return 0
+
+    app = QApplication(sys.argv[:1])
+    window = OptionPositionCalculator()
+    window.show()
+    return app.exec_()
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = OptionPositionCalculator()
-    window.show()
-    sys.exit(app.exec_())
+    sys.exit(main())
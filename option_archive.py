@@ -0,0 +1,150 @@
+"""已到期期权的归档
+
+最后交易日已过、每个交易日都有价格的期权可以移出期权数据文件，压缩保存在数据文件旁的归档目录中：
+
+    options_data_archive/
+        index.json        {"next_id": 下一个文件编号, "options": {期权名称: 索引项}}
+        000001.json.gz    每个期权一个文件，内容与数据文件中的期权相同
+
+索引项包含期货代码、初始计提量、最后交易日和到期日的查询结果行，"已到期期权"列表直接使用索引，不读取期权文件；
+查看单个期权的历史、导出或恢复时才读取（hydrate）该期权。
+归档后日常的查询、保存和下拉列表只涉及未归档的期权。
+
+先写期权文件、再替换索引，最后由调用方保存数据文件；中途中断时两边都有的期权以数据文件为准。
+数据文件另存为其他文件名（PositionEngine.save_data_as）时归档目录一并复制，原文件的归档保持不变。
+
+    python main.py archive --data options_data.json
+    python main.py restore-archived 豆粕期权A --data options_data.json
+"""
+import gzip
+import json
+import os
+import shutil
+import threading
+from collections.abc import Mapping
+
+
+ARCHIVE_SUFFIX = "_archive"
+INDEX_FILE = "index.json"
+
+
+def archive_dir_for(data_file):
+    """数据文件对应的归档目录：options_data.json -> options_data_archive"""
+    return os.path.splitext(data_file)[0] + ARCHIVE_SUFFIX
+
+
+def is_archivable(option, current_date):
+    """最后交易日在 current_date 之前，且每个交易日都有数值价格（没有N/A或尚未获取的日期）"""
+    trade_dates = option["trade_dates"]
+    if not trade_dates or max(trade_dates) >= current_date:
+        return False
+    prices = option["close_prices"]
+    return all(isinstance(prices.get(date), (int, float)) for date in trade_dates)
+
+
+class OptionArchive(Mapping):
+    """归档目录，按期权名称访问时读取并解压该期权
+
+    entries 为 {期权名称: 索引项}，修改时整体替换，读者取一次引用即可得到一致的索引。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        self.next_id = 1
+        try:
+            with open(os.path.join(path, INDEX_FILE), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.entries = index["options"]
+            self.next_id = index["next_id"]
+        except FileNotFoundError:
+            pass
+
+    def __getitem__(self, name):
+        entry = self.entries[name]
+        with gzip.open(os.path.join(self.path, entry["file"]), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hydrate(self, name):
+        """读取归档的期权，不在归档中时返回None"""
+        return self[name] if name in self.entries else None
+
+    def rows(self, keyword=None, exclude=()):
+        """已到期期权列表的结果行（只读取索引，返回副本），跳过 exclude 中（仍在数据文件中）的期权"""
+        keyword = keyword.lower() if keyword else None
+        return [dict(entry["row"]) for name, entry in self.entries.items()
+                if name not in exclude and (keyword is None or keyword in name.lower())]
+
+    def add(self, records):
+        """归档期权，records 为 [(期权数据, 到期日的结果行)]，同名的旧归档被替换"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            entries = dict(self.entries)
+            next_id = self.next_id
+            replaced = []
+            for option, row in records:
+                file_name = f"{next_id:06d}.json.gz"
+                next_id += 1
+                with gzip.open(os.path.join(self.path, file_name), 'wt', encoding='utf-8') as f:
+                    json.dump(option, f, ensure_ascii=False)
+                if option["name"] in entries:
+                    replaced.append(entries[option["name"]]["file"])
+                entries[option["name"]] = {"file": file_name, "code": option["code"],
+                                           "initial_amount": option["initial_amount"],
+                                           "last_trade_date": row["date"], "row": row}
+            self._write_index(entries, next_id)
+            self._remove_files(replaced)
+
+    def remove(self, names):
+        """从归档中删除期权（恢复到数据文件之后调用）"""
+        with self._lock:
+            entries = dict(self.entries)
+            removed = [entries.pop(name)["file"] for name in names if name in entries]
+            if removed:
+                self._write_index(entries, self.next_id)
+                self._remove_files(removed)
+
+    def copy_to(self, path):
+        """把归档复制为 path 目录（另存数据文件时使用），path 原有的归档被替换
+
+        先复制到临时目录再改名，中途出错不影响 path 原有的内容。
+        """
+        with self._lock:
+            tmp_path, old_path = path + ".tmp", path + ".old"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            for entry in self.entries.values():
+                shutil.copy2(os.path.join(self.path, entry["file"]), os.path.join(tmp_path, entry["file"]))
+            with open(os.path.join(tmp_path, INDEX_FILE), 'w', encoding='utf-8') as f:
+                json.dump({"next_id": self.next_id, "options": self.entries}, f, ensure_ascii=False)
+            # 目录不能直接替换已存在的目录：先把原目录改名，换入新目录后再删除
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.exists(path):
+                os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def _write_index(self, entries, next_id):
+        path = os.path.join(self.path, INDEX_FILE)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"next_id": next_id, "options": entries}, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self.entries = entries
+        self.next_id = next_id
+
+    def _remove_files(self, file_names):
+        for file_name in file_names:
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,212 @@
+"""从 CSV/Excel 批量导入期权和平仓记录
+
+期权表每行一个 (期权, 交易日)，同一期权各行的基本信息相同，表头可用中文或英文字段名：
+
+    期权名称,期货代码,执行价格,初始计提量,交易日
+    豆粕期权A,m2409,3200,-1000,2024-06-03
+    豆粕期权A,m2409,3200,-1000,2024-06-04
+
+交易日单元格中也可以写多个日期，以逗号、分号或空白分隔。
+整张表一次校验（必填、数字、日期格式、同一期权信息一致、交易日重复），有任何错误时不导入。
+
+平仓记录表（每日成交汇总）每行一个 (期权, 日期)，平仓量和收盘价至少填一项：
+
+    期权名称,日期,平仓量,收盘价
+    豆粕期权A,2024-06-03,-200,
+    豆粕期权A,2024-06-03,-50,
+    豆粕期权B,2024-06-04,,3215
+
+同一期权同一日期的多行平仓量相加（同一天的多笔成交），结果替换该日原有的平仓量；收盘价替换原有价格。
+
+读取 Excel 文件需要安装 openpyxl。
+
+    python main.py import-options options.xlsx --data options_data.json
+    python main.py import-closes blotter.csv --data options_data.json
+"""
+import pandas as pd
+
+
+HEADERS = {"期权名称": "name", "期货代码": "code", "执行价格": "strike_price", "初始计提量": "initial_amount",
+           "交易日": "trade_date"}
+FIELD_HEADERS = {field: header for header, field in HEADERS.items()}
+FIELDS = tuple(HEADERS.values())
+DATE_SEPARATORS = r"[,;，；、\s]+"
+
+CLOSE_HEADERS = {"期权名称": "name", "日期": "date", "平仓量": "close_amount", "收盘价": "close_price"}
+CLOSE_FIELD_HEADERS = {field: header for header, field in CLOSE_HEADERS.items()}
+
+
+class OptionImportError(Exception):
+    """表格无法导入时抛出，errors 为 [(行号或None, 错误信息)]，行号与表格中的行号一致"""
+
+    def __init__(self, errors):
+        super().__init__("\n".join(format_error(row, message) for row, message in errors))
+        self.errors = errors
+
+
+def format_error(row, message):
+    return message if row is None else f"第{row}行: {message}"
+
+
+def read_table(file_name):
+    """读取 CSV 或 Excel 表格，所有单元格按文本读取"""
+    if file_name.lower().endswith((".xlsx", ".xls")):
+        try:
+            return pd.read_excel(file_name, dtype=str)
+        except ImportError:
+            raise OptionImportError([(None, "读取Excel文件需要安装 openpyxl（pip install openpyxl）")])
+    try:
+        return pd.read_csv(file_name, dtype=str, encoding="utf-8-sig")
+    except UnicodeDecodeError:
+        return pd.read_csv(file_name, dtype=str, encoding="gbk")  # Excel 另存的中文CSV
+
+
+def text_columns(df, fields, first_row=2):
+    """各列去掉首尾空白，空单元格为NA，附加行号 row（表格第1行是表头，数据从第2行开始），跳过空行"""
+    text = pd.DataFrame({field: df[field].astype("string").str.strip().replace("", pd.NA) for field in fields})
+    text["row"] = df.index + first_row
+    return text[text[list(fields)].notna().any(axis=1)]
+
+
+def parse_option_table(df):
+    """校验表格并生成期权记录列表（按表格中首次出现的顺序），有错误时抛出 OptionImportError"""
+    df = df.rename(columns=lambda column: str(column).strip()).rename(columns=HEADERS)
+    missing = [FIELD_HEADERS[field] for field in FIELDS if field not in df.columns]
+    if missing:
+        raise OptionImportError([(None, f"缺少列: {'、'.join(missing)}")])
+
+    text = text_columns(df, FIELDS)
+
+    errors = []
+
+    def flag(mask, message):
+        errors.extend((int(row), message) for row in text.loc[mask, "row"])
+
+    for field in FIELDS:
+        flag(text[field].isna(), f"{FIELD_HEADERS[field]}不能为空")
+
+    numbers = {}
+    for field in ("strike_price", "initial_amount"):
+        numbers[field] = pd.to_numeric(text[field].str.replace(",", ""), errors="coerce")
+        flag(text[field].notna() & numbers[field].isna(), f"{FIELD_HEADERS[field]}必须是数字")
+    text = text.assign(**numbers)
+
+    # 同一期权各行的期货代码、执行价格、初始计提量必须一致
+    groups = text.groupby("name", sort=False)
+    for field in ("code", "strike_price", "initial_amount"):
+        inconsistent = groups[field].transform("nunique") > 1
+        flag(inconsistent, f"{FIELD_HEADERS[field]}与同名期权的其他行不一致")
+
+    dates = text[["row", "name", "trade_date"]].assign(
+        trade_date=text["trade_date"].str.split(DATE_SEPARATORS, regex=True)).explode("trade_date")
+    dates = dates[dates["trade_date"].notna() & (dates["trade_date"] != "")]
+    parsed = pd.to_datetime(dates["trade_date"], errors="coerce", format="mixed")
+    for row, value in dates.loc[parsed.isna(), ["row", "trade_date"]].itertuples(index=False):
+        errors.append((int(row), f"交易日格式不正确: {value}"))
+    dates = dates.assign(trade_date=parsed.dt.strftime("%Y-%m-%d"))[parsed.notna()]
+    duplicated = dates.duplicated(["name", "trade_date"])
+    for row, value in dates.loc[duplicated, ["row", "trade_date"]].itertuples(index=False):
+        errors.append((int(row), f"交易日重复: {value}"))
+
+    no_dates = text["trade_date"].notna() & ~text["name"].isin(dates["name"])
+    flag(no_dates, "没有有效的交易日")
+
+    if errors:
+        raise OptionImportError(sorted(errors, key=lambda error: error[0]))
+
+    trade_dates = dates.groupby("name", sort=False)["trade_date"].agg(lambda values: sorted(set(values)))
+    first = groups.first()
+    options = []
+    for name, row in first.iterrows():
+        option_dates = trade_dates[name]
+        initial_amount = float(row["initial_amount"])
+        options.append({
+            "name": name,
+            "code": row["code"],
+            "strike_price": float(row["strike_price"]),
+            "initial_amount": initial_amount,
+            "trade_dates": option_dates,
+            "daily_reversal": -initial_amount / len(option_dates),
+            "close_prices": {},
+            "actual_volumes": {},
+            "close_amounts": {},
+            "position_changes": {},
+            "positions": {},
+        })
+    return options
+
+
+def load_option_table(file_name):
+    return parse_option_table(read_table(file_name))
+
+
+def parse_close_table(df, options, first_row=2):
+    """按当前期权数据校验平仓记录表，返回按 (期权, 日期) 合并后的行列表
+
+    first_row 为第一条记录在错误信息中的行号。每行为 {"name", "date", "close_amount", "close_price"}，未填写的值为None；有错误时抛出 OptionImportError。
+    """
+    df = df.rename(columns=lambda column: str(column).strip()).rename(columns=CLOSE_HEADERS)
+    missing = [CLOSE_FIELD_HEADERS[field] for field in ("name", "date") if field not in df.columns]
+    if "close_amount" not in df.columns and "close_price" not in df.columns:
+        missing.append("平仓量或收盘价")
+    if missing:
+        raise OptionImportError([(None, f"缺少列: {'、'.join(missing)}")])
+    for field in ("close_amount", "close_price"):
+        if field not in df.columns:
+            df[field] = pd.NA
+
+    text = text_columns(df, tuple(CLOSE_HEADERS.values()), first_row)
+    errors = []
+
+    def flag(mask, message):
+        errors.extend((int(row), message) for row in text.loc[mask, "row"])
+
+    flag(text["name"].isna(), "期权名称不能为空")
+    flag(text["date"].isna(), "日期不能为空")
+    flag(text["close_amount"].isna() & text["close_price"].isna(), "平仓量和收盘价至少填写一项")
+
+    numbers = {}
+    for field in ("close_amount", "close_price"):
+        numbers[field] = pd.to_numeric(text[field].str.replace(",", ""), errors="coerce")
+        flag(text[field].notna() & numbers[field].isna(), f"{CLOSE_FIELD_HEADERS[field]}必须是数字")
+    flag(numbers["close_price"] < 0, "收盘价不能为负数")
+
+    dates = pd.to_datetime(text["date"], errors="coerce", format="mixed")
+    flag(text["date"].notna() & dates.isna(), "日期格式不正确")
+    text = text.assign(date=dates.dt.strftime("%Y-%m-%d"), **numbers)
+
+    known = text["name"].isin(list(options))
+    flag(text["name"].notna() & ~known, "找不到该期权")
+    trade_pairs = [(name, date) for name, option in options.items() for date in option["trade_dates"]]
+    is_trade_date = pd.MultiIndex.from_arrays([text["name"], text["date"]]).isin(trade_pairs)
+    flag(known & text["date"].notna() & ~is_trade_date, "日期不是该期权的交易日")
+
+    prices = text.groupby(["name", "date"])["close_price"].transform("nunique")
+    flag(prices > 1, "同一期权同一日期的收盘价不一致")
+
+    if errors:
+        raise OptionImportError(sorted(errors, key=lambda error: error[0]))
+
+    merged = text.groupby(["name", "date"], sort=False).agg(
+        close_amount=("close_amount", lambda values: values.sum(min_count=1)),
+        close_price=("close_price", "first"))
+    return [{"name": name, "date": date,
+             "close_amount": None if pd.isna(row.close_amount) else float(row.close_amount),
+             "close_price": None if pd.isna(row.close_price) else float(row.close_price)}
+            for (name, date), row in zip(merged.index, merged.itertuples(index=False))]
+
+
+def load_close_table(file_name, options):
+    return parse_close_table(read_table(file_name), options)
+
+
+def close_updates(rows):
+    """平仓记录行转换为 PositionEngine.set_daily_values 的参数"""
+    updates = {}
+    for row in rows:
+        fields = updates.setdefault(row["name"], {"close_amounts": {}, "close_prices": {}})
+        if row["close_amount"] is not None:
+            fields["close_amounts"][row["date"]] = row["close_amount"]
+        if row["close_price"] is not None:
+            fields["close_prices"][row["date"]] = row["close_price"]
+    return updates
@@ -0,0 +1,112 @@
+"""轻量的耗时统计：计时区间、计数器和直方图
+
+    from perf_stats import stats
+    with stats.span("fetch.network"):
+        ...
+    stats.count("fetch.bytes", len(data))
+
+直方图按 2 的幂分桶（0.1ms 起），只保存桶计数，记录开销固定，长时间运行也不会增长。
+"""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+BUCKET_BASE = 0.0001  # 第一个桶的上限（秒）
+BUCKET_COUNT = 24  # 最后一个桶约 0.1ms × 2^23 ≈ 14分钟
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * BUCKET_COUNT
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        index = 0 if value <= BUCKET_BASE else min(BUCKET_COUNT - 1, math.ceil(math.log2(value / BUCKET_BASE)))
+        self.buckets[index] += 1
+
+    def percentile(self, pct):
+        """按桶估算分位数（返回所在桶的上限，不超过最大值）"""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank and bucket:
+                return min(BUCKET_BASE * 2 ** index, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count, "total": self.total, "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min or 0.0, "max": self.max or 0.0,
+            "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+        }
+
+
+class PerfStats:
+    """线程安全的统计注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}  # 最新值，如当前并发上限
+
+    @contextmanager
+    def span(self, name):
+        """统计 with 块的耗时（秒），异常退出同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "elapsed": time.time() - self.started_at,
+                "spans": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+            }
+
+    def dump(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.snapshot(), f, indent=4, ensure_ascii=False)
+
+
+stats = PerfStats()  # 进程内共用的统计
@@ -0,0 +1,1190 @@
+import bisect
+import copy
+import json
+import os
+import threading
+import time
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from day_table import CLOSE, PAGE_MARKER, PRICE_FIELDS, ParsePool
+from fetch_audit import (FAILURE_BACKOFF, FAILURE_CANCELED, FAILURE_HTTP, FAILURE_PARSE, FAILURE_UNAVAILABLE,
+                         classify_exception)
+from fetch_control import FetchController
+from option_archive import OptionArchive, archive_dir_for, is_archivable
+from perf_stats import stats
+from position_snapshot import decode_snapshot, encode_snapshot, is_snapshot, is_snapshot_file_name
+from quote_cache import QuoteCache
+
+
+OPTION_FIELDS = (
+    "name", "code", "strike_price", "initial_amount", "trade_dates", "daily_reversal",
+    "close_prices", "actual_volumes", "close_amounts", "position_changes", "positions"
+)
+DAILY_FIELDS = ("close_prices", "actual_volumes", "close_amounts", "position_changes", "positions")
+
+# 可用环境变量 DCE_QUOTES_URL 指向本地替身服务（dce_stub_server.py）
+DCE_DAY_QUOTES_URL = os.environ.get("DCE_QUOTES_URL", "http://www.dce.com.cn/publicweb/quotesdata/dayQuotesCh.html")
+FETCH_TIMEOUT = 10  # 单次请求超时（秒）
+FETCH_CHUNK_SIZE = 16384  # 分块读取响应，块之间检查取消
+PREFETCH_TIME = "16:30"  # 大商所当日行情表发布后开始预取的时间
+
+
+class FetchCanceled(Exception):
+    """网络请求因取消而中止"""
+
+
+class QueryError(Exception):
+    """查询无法完成时抛出，消息直接展示给用户"""
+
+
+def today_str():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def compute_actual_volume(option, close_price):
+    """根据收盘价与执行价格计算实际成交量"""
+    if close_price == "N/A":
+        return 0
+    if option["initial_amount"] < 0:
+        if close_price > option["strike_price"]:
+            return -option["daily_reversal"]
+    else:
+        if close_price < option["strike_price"]:
+            return -option["daily_reversal"]
+    return 0
+
+
+def copy_option(option):
+    """复制期权的一个可修改版本，交易日列表和逐日数据字典都不与原版本共享"""
+    new_option = dict(option)
+    new_option["trade_dates"] = list(option["trade_dates"])
+    for field in DAILY_FIELDS:
+        new_option[field] = dict(option[field])
+    return new_option
+
+
+def option_row(option, date):
+    """生成一行查询结果（与期权数据脱离引用，可跨线程传递）"""
+    return {
+        "date": date,
+        "name": option["name"],
+        "strike_price": option["strike_price"],
+        "daily_reversal": option["daily_reversal"],
+        "close_price": option["close_prices"].get(date, "N/A"),
+        "actual_volume": option["actual_volumes"].get(date, 0),
+        "close_amount": option["close_amounts"].get(date, 0),
+        "position": option["positions"].get(date, 0),
+    }
+
+
+def filter_options(options, keyword):
+    """按期权名称关键词筛选（不区分大小写）"""
+    if not keyword:
+        return dict(options)
+    keyword = keyword.lower()
+    return {name: option for name, option in options.items() if keyword in option["name"].lower()}
+
+
+def position_section(last_trade_date, trade_dates, query_date, current_date):
+    """多期权模式下期权所属分组及取数日期：已到期期权取最后交易日，未到期期权取查询日期"""
+    if last_trade_date and last_trade_date < current_date:
+        return "expired_options", last_trade_date
+    if last_trade_date and query_date in trade_dates:
+        return "active_options", query_date
+    return None, None
+
+
+def collect_history_rows(option, query_date):
+    """单期权模式：截止查询日期的所有交易日数据"""
+    return [option_row(option, date) for date in option["trade_dates"] if date <= query_date]
+
+
+class ProgressReporter:
+    """在工作线程内汇总进度，限频发布（最多每 interval 秒或每前进 step 个百分点一次）
+
+    每个阶段把完成的任务数映射到 [base, base + span] 的百分比区间，
+    发布的消息附带网络获取速率和当前阶段的预计剩余时间。
+    """
+
+    def __init__(self, publish=None, interval=0.1, step=1):
+        self.publish = publish or (lambda value, message: None)
+        self.interval = interval
+        self.step = step
+        self.started_at = time.perf_counter()
+        self.phase_times = {}  # {阶段名称: 耗时（秒）}
+        self.phase = None
+        self.phase_started_at = self.started_at
+        self.base = 0
+        self.span = 100
+        self.total = 0
+        self.completed = 0
+        self.fetches = 0  # 累计网络获取次数
+        self.last_publish = 0.0
+        self.last_value = None
+
+    def start_phase(self, name, total, base=0, span=100):
+        self._end_phase()
+        self.phase = name
+        self.phase_started_at = time.perf_counter()
+        self.total = total
+        self.completed = 0
+        self.base = base
+        self.span = span
+
+    def _end_phase(self):
+        if self.phase is not None:
+            elapsed = time.perf_counter() - self.phase_started_at
+            self.phase_times[self.phase] = self.phase_times.get(self.phase, 0.0) + elapsed
+            self.phase = None
+
+    @property
+    def value(self):
+        if not self.total:
+            return self.base + self.span
+        return self.base + int(min(self.completed, self.total) / self.total * self.span)
+
+    def fetch_rate(self):
+        elapsed = time.perf_counter() - self.started_at
+        return self.fetches / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """当前阶段预计剩余秒数，尚无完成任务时返回None"""
+        if not self.completed or self.completed >= self.total:
+            return None
+        elapsed = time.perf_counter() - self.phase_started_at
+        return elapsed / self.completed * (self.total - self.completed)
+
+    def report(self, message, force=False):
+        """报告进度，未到发布间隔且进度变化不足 step 时只记录不发布"""
+        now = time.perf_counter()
+        value = self.value
+        if not force and self.last_value is not None and value < 100 \
+                and now - self.last_publish < self.interval and value - self.last_value < self.step:
+            return
+        self.last_publish = now
+        self.last_value = value
+        self.publish(value, self.format(message, value))
+
+    def task_done(self, message, fetched=False):
+        self.completed += 1
+        if fetched:
+            self.fetches += 1
+        self.report(message)
+
+    def format(self, message, value):
+        parts = [f"{message} ({value}%)"]
+        if self.fetches:
+            parts.append(f"{self.fetch_rate():.1f}次/秒")
+        eta = self.eta()
+        if eta is not None:
+            parts.append(f"剩余约{eta:.0f}秒")
+        return " · ".join(parts)
+
+    def finish(self, value, message):
+        self._end_phase()
+        self.last_value = value
+        self.publish(value, message)
+
+    def summary(self):
+        """各阶段耗时摘要"""
+        return "，".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.phase_times.items())
+
+
+class RowChunker:
+    """把结果行按数量或时间间隔分批交给回调，避免逐行跨线程传递；prepare(结果行列表) 在交出前处理整批"""
+
+    def __init__(self, emit=None, chunk_size=200, interval=0.1, prepare=None):
+        self.emit = emit
+        self.prepare = prepare
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.pending = {}  # {分组: [结果行]}
+        self.pending_count = 0
+        self.last_flush = time.perf_counter()
+
+    def add(self, section, row):
+        if self.emit is None:
+            return
+        self.pending.setdefault(section, []).append(row)
+        self.pending_count += 1
+        if self.pending_count >= self.chunk_size or time.perf_counter() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        for section, rows in self.pending.items():
+            if self.prepare:
+                self.prepare(rows)
+            self.emit(section, rows)
+        self.pending = {}
+        self.pending_count = 0
+        self.last_flush = time.perf_counter()
+
+
+def fetch_text(url, params, token=None, timeout=FETCH_TIMEOUT, info=None):
+    """GET 请求并返回文本，info 字典中写入 HTTP 状态码 status 和字节数 bytes
+
+    传入取消标记（task_scheduler.CancelToken）时请求在辅助线程中执行，调用方同时等待请求完成和取消，
+    取消后立即抛出 FetchCanceled，不必等到超时；辅助线程在分块读取响应时发现已取消便放弃剩余内容。
+    """
+    import requests  # 导入较慢，第一次获取时才导入，不拖慢界面启动
+
+    headers = {"User-Agent": "Mozilla/5.0"}
+    info = info if info is not None else {}
+    if token is None:
+        response = requests.get(url, params=params, headers=headers, timeout=timeout)
+        response.encoding = 'utf-8'
+        info["status"] = response.status_code
+        info["bytes"] = len(response.content)
+        stats.count("fetch.bytes", info["bytes"])
+        return response.text
+
+    if token.is_canceled():
+        raise FetchCanceled()
+
+    done = threading.Event()
+    outcome = {}
+
+    def fetch():
+        try:
+            with requests.get(url, params=params, headers=headers, timeout=timeout, stream=True) as response:
+                info["status"] = response.status_code
+                chunks = []
+                for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+                    if token.is_canceled():
+                        return
+                    chunks.append(chunk)
+                data = b"".join(chunks)
+                info["bytes"] = len(data)
+                stats.count("fetch.bytes", len(data))
+                outcome["text"] = data.decode("utf-8", errors="replace")
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    token.add_callback(done.set)
+    try:
+        threading.Thread(target=fetch, name="dce-fetch", daemon=True).start()
+        done.wait()
+    finally:
+        token.remove_callback(done.set)
+
+    if token.is_canceled():
+        raise FetchCanceled()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["text"]
+
+
+def latest_published_date(now=None):
+    """最近一个已发布日行情表的交易日：工作日 PREFETCH_TIME 之后为当天，否则为前一个工作日"""
+    now = now or datetime.now()
+    day = now.date()
+    if day.weekday() >= 5 or now.strftime("%H:%M") < PREFETCH_TIME:
+        day -= timedelta(days=1)
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+    return day.strftime("%Y-%m-%d")
+
+
+def collect_missing_dates(options, query_date, include_unfetched=True):
+    """查询日期之前收盘价为N/A（可选包括尚未获取）的交易日 {期权名称: [日期列表]}"""
+    missing_value = "N/A" if include_unfetched else None
+    missing = {}
+    for name, option in options.items():
+        dates = [date for date in option["trade_dates"]
+                 if date < query_date and option["close_prices"].get(date, missing_value) == "N/A"]
+        if dates:
+            missing[name] = dates
+    return missing
+
+
+class PositionEngine:
+    """期权头寸计算引擎，不依赖界面，可供GUI线程和服务模式共用
+
+    options 是当前发布的期权数据版本：发布后的字典和期权都不再原地修改。
+    写操作复制要修改的期权，在副本上修改后于写锁内整体替换 options，
+    读者只需取一次 options 的引用即可得到一致的视图，不必等待正在进行的刷新。
+    """
+
+    def __init__(self, data_file="options_data.json", quote_cache=None, quotes_url=None, audit_log=None,
+                 fetch_controller=None, parse_pool=None, price_field=CLOSE):
+        self.options = {}  # 存储所有期权数据（当前发布版本）
+        self.data_file = data_file
+        self.quote_cache = quote_cache or QuoteCache()  # 按交易日缓存的日行情表
+        self.quotes_url = quotes_url or DCE_DAY_QUOTES_URL
+        self.audit_log = audit_log  # fetch_audit.FetchAuditLog，记录每次获取
+        self.fetch_controller = fetch_controller or FetchController()  # 下载阶段：自适应并发和超时
+        self.parse_pool = parse_pool or ParsePool()  # 解析阶段：独立的进程池
+        self.price_field = price_field  # 计算头寸使用的价格：收盘价或结算价
+        self.valuation = None  # option_valuation.ValuationParams，设置后查询结果附带理论价格和希腊值
+        self.version = 0  # 每次发布加一
+        self._write_lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._archive = None
+        self._exposure = {}  # {汇总方式: position_exposure.ExposureBook}
+        self._exposure_lock = threading.Lock()
+        self._pnl = None  # position_pnl.PnlBook，按期权版本缓存的逐日损益
+        self._pnl_lock = threading.Lock()
+
+    @property
+    def archive(self):
+        """当前数据文件对应的已到期期权归档（option_archive），第一次访问时读取索引"""
+        path = archive_dir_for(self.data_file)
+        if self._archive is None or self._archive.path != path:
+            self._archive = OptionArchive(path)
+        return self._archive
+
+    def value_rows(self, rows):
+        """设置了估值参数时，为一批查询结果行添加理论价格和希腊值（option_valuation）"""
+        valuation = self.valuation
+        if valuation is None or not rows:
+            return
+        from option_valuation import value_rows
+        options = self.options
+        entries = self.archive.entries
+        infos = {}
+        for name in {row["name"] for row in rows}:
+            option = options.get(name)
+            if option is not None and option["trade_dates"]:
+                infos[name] = (option["code"], max(option["trade_dates"]), option["initial_amount"])
+            elif name in entries:
+                entry = entries[name]
+                infos[name] = (entry["code"], entry["last_trade_date"], entry.get("initial_amount"))
+        value_rows(rows, infos, valuation)
+
+    def _value_remaining(self, results):
+        """没有分批回调时结果行未经 RowChunker 处理，查询结束时一次估值"""
+        if self.valuation is not None:
+            self.value_rows([row for section in ("single_option", "active_options", "expired_options")
+                             for row in results[section] if "delta" not in row])
+
+    def exposure_rows(self, by="code", date=None, group=None, options=None):
+        """按期货合约（code）或品种（product）汇总的净头寸（position_exposure），不访问网络
+
+        options 默认为当前发布的版本；汇总数组按汇总方式缓存，再次汇总时只重新计算变化的期权。
+        """
+        from position_exposure import ExposureBook
+        with self._exposure_lock:
+            book = self._exposure.get(by)
+            if book is None:
+                book = self._exposure[by] = ExposureBook(by)
+            book.update(self.options if options is None else options)
+            return book.rows(date, group)
+
+    def pnl_rows(self, name=None, start_date=None, end_date=None, options=None):
+        """逐日损益归因（position_pnl），不访问网络：name 为空时为组合逐日合计，否则为该期权的逐日损益
+
+        options 默认为当前发布的版本；损益按期权版本缓存，再次计算时只计算变化的期权。期权不存在时返回None。
+        """
+        from position_pnl import PnlBook
+        with self._pnl_lock:
+            if self._pnl is None:
+                self._pnl = PnlBook()
+            self._pnl.update(self.options if options is None else options)
+            if name is None:
+                return self._pnl.portfolio_rows(start_date, end_date)
+            return self._pnl.option_rows(name, start_date, end_date)
+
+    def all_options(self):
+        """当前发布的期权加上归档的期权，归档的期权在访问时才读取，用于导出等需要完整历史的操作"""
+        return ChainMap(self.options, self.archive)
+
+    def archive_expired(self, current_date=None):
+        """把最后交易日已过、每个交易日都有价格的期权移入归档，返回归档的期权名称
+
+        归档前计算到最后交易日（价格都已存在，不访问网络）。调用方随后保存数据文件。
+        """
+        current_date = current_date or today_str()
+        with self._write_lock:
+            names = [name for name, option in self.options.items() if is_archivable(option, current_date)]
+            records = []
+            for name in names:
+                option = self.ensure_option_data(name)
+                last_trade_date = max(option["trade_dates"])
+                records.append(({field: option[field] for field in OPTION_FIELDS}, option_row(option, last_trade_date)))
+            if records:
+                self.archive.add(records)
+                self._publish(removed=names)
+        return names
+
+    def restore_archived(self, name):
+        """把归档的期权移回 options 并保存数据文件，返回该期权；不在归档中时返回None"""
+        with self._write_lock:
+            option = self.archive.hydrate(name)
+            if option is None:
+                return None
+            self._publish({name: option})
+            self.save_data()
+            self.archive.remove([name])
+        return option
+
+    def _publish(self, changes=None, removed=()):
+        options = dict(self.options)
+        options.update(changes or {})
+        for name in removed:
+            options.pop(name, None)
+        self.options = options
+        self.version += 1
+
+    def update_option(self, name, mutate):
+        """复制期权的最新版本，执行 mutate(副本) 后原子发布，返回新版本；期权不存在时返回None"""
+        with self._write_lock:
+            current = self.options.get(name)
+            if current is None:
+                return None
+            option = copy_option(current)
+            mutate(option)
+            self._publish({name: option})
+            return option
+
+    def put_option(self, option):
+        """新增或整体替换一个期权"""
+        with self._write_lock:
+            self._publish({option["name"]: option})
+
+    def put_options(self, options):
+        """批量新增或整体替换期权，一次发布"""
+        with self._write_lock:
+            self._publish({option["name"]: option for option in options})
+
+    def remove_option(self, name):
+        with self._write_lock:
+            self._publish(removed=[name])
+
+    def calculate_option_data(self, option, end_date=None):
+        """计算期权数据，只计算到指定日期，返回计算后的最新版本"""
+        return self.ensure_option_data(option["name"], end_date)
+
+    def ensure_option_data(self, name, end_date=None, token=None):
+        option = None
+        for option, _ in self.iter_option_data(name, end_date, token):
+            pass
+        return option if option is not None else self.options.get(name)
+
+    def iter_option_data(self, name, end_date=None, token=None):
+        """逐日保证期权截止指定日期的收盘价和头寸已计算，产出 (最新版本, 日期)
+
+        缺失的收盘价在锁外获取，获取后才复制期权、写入并重新计算，再发布新版本。
+        取消时抛出 FetchCanceled，已发布的版本都是重新计算过的。
+        """
+        option = self.options.get(name)
+        if option is None:
+            return
+
+        dates = []
+        for date in option["trade_dates"]:
+            if end_date and date > end_date:
+                break
+            dates.append(date)
+
+        if any(date not in option["positions"] for date in dates):
+            option = self.update_option(
+                name, lambda target: self.recalculate_option_from_date(target, target["trade_dates"][0]))
+            if option is None:
+                return
+
+        for date in dates:
+            if date not in option["close_prices"]:
+                # 只获取查询日期及之前的数据
+                close_price = self.get_dce_daily_close(option["code"], date, token)
+                option = self.update_option(name, lambda target, date=date: self._fill_close_price(
+                    target, date, close_price if close_price is not None else "N/A"))
+                if option is None:
+                    return
+            yield option, date
+
+    def _fill_close_price(self, option, date, close_price):
+        # 获取期间如果收盘价已被修改，以修改后的为准
+        if date not in option["close_prices"]:
+            option["close_prices"][date] = close_price
+            self.recalculate_option_from_date(option, date)
+
+    def set_daily_values(self, updates):
+        """批量修改收盘价/平仓量，updates 为 {期权名称: {"close_prices"/"close_amounts": {日期: 值}}}
+
+        每个期权只复制一次，从最早修改的日期重新计算一次，全部修改一次发布。
+        返回 {期权名称: 重新计算的起始日期}，不存在的期权和非交易日的修改被忽略。
+        """
+        with self._write_lock:
+            changes = {}
+            starts = {}
+            for name, fields in updates.items():
+                current = self.options.get(name)
+                if current is None:
+                    continue
+                trade_dates = set(current["trade_dates"])
+                changed = [date for values in fields.values() for date in values if date in trade_dates]
+                if not changed:
+                    continue
+
+                option = copy_option(current)
+                for field, values in fields.items():
+                    option[field].update((date, value) for date, value in values.items() if date in trade_dates)
+                start = min(changed)
+                start_index = option["trade_dates"].index(start)
+                if start_index and option["trade_dates"][start_index - 1] not in option["positions"]:
+                    start = option["trade_dates"][0]  # 之前的头寸尚未计算
+                self.recalculate_option_from_date(option, start)
+                changes[name] = option
+                starts[name] = start
+            if changes:
+                self._publish(changes)
+            return starts
+
+    def edit_schedule(self, name, trade_dates, fields=None, until_date=None, token=None):
+        """按差异修改期权的交易日列表，fields 为同时修改的 code、strike_price、initial_amount、daily_reversal
+
+        交易日去重后按日期排序。新增的交易日中截止 until_date（默认最近一个已发布的交易日）的，
+        在锁外按日期批量从行情缓存/网站取整张日行情表填入收盘价；已有的收盘价（包括手工修改的）保留。
+        期货代码改变时原有的收盘价属于另一合约，全部重新获取。删除的交易日及逐日数据中不在新列表里的日期一并清除。
+        只从最早受影响的日期重新计算：新增或删除的最早日期；执行价格、初始计提量或每日冲回量改变时从第一个交易日。
+        一次发布，返回 {"added", "removed", "fetched", "start"}（start 为重新计算的起始日期，无需重新计算时为None）；
+        期权不存在时返回None，取消时抛出 FetchCanceled 且不修改期权。
+        """
+        fields = fields or {}
+        trade_dates = sorted(set(trade_dates))
+        current = self.options.get(name)
+        if current is None:
+            return None
+        until_date = until_date or latest_published_date()
+        code_changed = "code" in fields and fields["code"] != current["code"]
+        old_dates = set(current["trade_dates"])
+
+        def needs_price(option, date):
+            if code_changed:
+                return True
+            return date not in old_dates and option["close_prices"].get(date, "N/A") == "N/A"
+
+        # 锁外获取：每个日期一张日行情表，并发获取（由 fetch_controller 控制实际并发数）
+        fetch_dates = [date for date in trade_dates if date <= until_date and needs_price(current, date)]
+        tables = {}
+        if fetch_dates:
+            executor = ThreadPoolExecutor(max_workers=self.fetch_controller.max_limit, thread_name_prefix="schedule")
+            try:
+                futures = [(date, executor.submit(self.get_day_closes, date, token)) for date in fetch_dates]
+                tables = {date: future.result() for date, future in futures}
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        with self._write_lock:
+            current = self.options.get(name)
+            if current is None:
+                return None
+            option = copy_option(current)
+            recalculate_all = any(field in fields and fields[field] != current[field]
+                                  for field in ("code", "strike_price", "initial_amount", "daily_reversal"))
+            option.update(fields)
+            old_dates = set(current["trade_dates"])
+            new_dates = set(trade_dates)
+            added = sorted(new_dates - old_dates)
+            removed = sorted(old_dates - new_dates)
+
+            option["trade_dates"] = trade_dates
+            for field in DAILY_FIELDS:
+                daily = option[field]
+                for date in [date for date in daily if date not in new_dates]:
+                    del daily[date]
+            if code_changed:
+                option["close_prices"] = {}
+
+            contract = option["code"].strip().lower()
+            fetched = 0
+            for date, closes in tables.items():
+                # 获取期间收盘价可能已被修改，只填入仍然缺少的；行情表不可用的日期留到查询时再获取
+                if closes is None or date not in new_dates or option["close_prices"].get(date, "N/A") != "N/A":
+                    continue
+                close_price = closes.get(contract)
+                option["close_prices"][date] = close_price if close_price is not None else "N/A"
+                fetched += 1
+
+            start = None
+            if trade_dates:
+                affected = added + [date for date in trade_dates if removed and date > removed[0]][:1]
+                if recalculate_all:
+                    start = trade_dates[0]
+                elif affected:
+                    start = min(affected)
+                    start_index = trade_dates.index(start)
+                    if start_index and trade_dates[start_index - 1] not in option["positions"]:
+                        start = trade_dates[0]  # 之前的头寸尚未计算
+                if start:
+                    self.recalculate_option_from_date(option, start)
+            self._publish({name: option})
+        return {"added": added, "removed": removed, "fetched": fetched, "start": start}
+
+    def recalculate_option_from_date(self, option, start_date):
+        with stats.span("recalculate"):
+            self._recalculate_option_from_date(option, start_date)
+
+    def _recalculate_option_from_date(self, option, start_date):
+        if start_date not in option["trade_dates"]:
+            return
+
+        start_index = option["trade_dates"].index(start_date)
+
+        prev_position = option["initial_amount"]
+        if start_index > 0:
+            prev_date = option["trade_dates"][start_index - 1]
+            prev_position = option["positions"].get(prev_date, option["initial_amount"])
+
+        for i in range(start_index, len(option["trade_dates"])):
+            date = option["trade_dates"][i]
+
+            option["actual_volumes"][date] = compute_actual_volume(option, option["close_prices"].get(date, "N/A"))
+
+            close_amount = option["close_amounts"].get(date, 0)
+
+            position_change = option["daily_reversal"] + option["actual_volumes"][date]
+            option["position_changes"][date] = position_change
+
+            current_position = prev_position + position_change + close_amount
+            option["positions"][date] = current_position
+            prev_position = current_position
+
+    def recalculate_all(self):
+        """按已有收盘价重新计算所有期权的完整头寸（不访问网络），一次发布"""
+        with self._write_lock:
+            changes = {}
+            for name, option in self.options.items():
+                if option["trade_dates"]:
+                    option = copy_option(option)
+                    self.recalculate_option_from_date(option, option["trade_dates"][0])
+                    changes[name] = option
+            self._publish(changes)
+
+    def refresh_option_data(self, option, date, token=None, fresh_since=None):
+        """刷新单个期权的市场数据，返回刷新后的最新版本（期权已被删除或已取消时返回None）
+
+        fresh_since 为时间戳时不使用在此之前缓存的日行情表，直接访问网络（用户明确要求重新获取时传入刷新开始的时间）。
+        """
+        option = self.options.get(option["name"])
+        if option is None:
+            return None
+
+        # 重新获取收盘价，取消时不修改期权
+        try:
+            close_price = self.get_dce_daily_close(option["code"], date, token, fresh_since)
+        except FetchCanceled:
+            return None
+        return self._apply_refreshed_price(option["name"], date, close_price)
+
+    def iter_refresh_prices(self, pairs, token=None, fresh_since=None):
+        """重新获取多个 (期权, 日期) 的价格，按 pairs 的顺序逐项产出 (期权, 日期, 刷新后的最新版本)
+
+        涉及的日期一开始全部提交，各日期的日行情表并发获取（实际并发数由 fetch_controller 控制），
+        每项只等待它所需的日期；期权已被删除时产出的版本为None。取消时抛出 FetchCanceled。
+        """
+        dates = sorted({date for _, date in pairs})
+        if not dates:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(len(dates), self.fetch_controller.max_limit),
+                                      thread_name_prefix="refresh")
+        field = self.price_field
+        try:
+            futures = {date: executor.submit(self.get_day_table, date, token, field, fresh_since) for date in dates}
+            for option, date in pairs:
+                table = futures[date].result()
+                close_price = None if table is None else table.get(option["code"].strip().lower(), field)
+                yield option, date, self._apply_refreshed_price(option["name"], date, close_price)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _apply_refreshed_price(self, name, date, close_price):
+        def apply(target):
+            if close_price is not None:
+                target["close_prices"][date] = close_price
+            elif date < today_str():
+                # 查询日期前的数据获取失败才标记为N/A
+                target["close_prices"][date] = "N/A"
+            # 重新计算该日期及之后的数据
+            self.recalculate_option_from_date(target, date)
+
+        return self.update_option(name, apply)
+
+    def prefetch_day(self, date, token=None):
+        """预取某日行情表：写入行情缓存，把收盘价填入交易日包含该日的期权并重新计算头寸
+
+        已有的收盘价（可能是手工修改的）不覆盖，只填入缺失或N/A的收盘价，一次发布。
+        返回 {"date": 日期, "options": 涉及的期权数, "updated": 填入收盘价的期权数}，
+        该日行情表不可用时返回None，取消时抛出 FetchCanceled。
+        """
+        return self._apply_day_closes(date, self.get_day_closes(date, token))
+
+    def _apply_day_closes(self, date, closes):
+        if closes is None:
+            return None
+
+        with self._write_lock:
+            changes = {}
+            involved = updated = 0
+            for name, option in self.options.items():
+                if date not in option["trade_dates"]:
+                    continue
+                involved += 1
+                close_price = closes.get(option["code"].strip().lower())
+                fill = close_price is not None and option["close_prices"].get(date, "N/A") == "N/A"
+                complete = all(trade_date in option["positions"] for trade_date in option["trade_dates"])
+                if not fill and complete:
+                    continue
+
+                option = copy_option(option)
+                if fill:
+                    option["close_prices"][date] = close_price
+                    updated += 1
+                self.recalculate_option_from_date(option, date if complete else option["trade_dates"][0])
+                changes[name] = option
+            if changes:
+                self._publish(changes)
+        return {"date": date, "options": involved, "updated": updated}
+
+    def prefetch_missing(self, until_date=None, token=None, on_day=None):
+        """预取截止 until_date（默认最近一个已发布的交易日）所有期权中缺失或N/A收盘价的交易日
+
+        每个日期只获取一次整张日行情表，各日期并发获取（实际并发数由 fetch_controller 控制），
+        按日期顺序填入；on_day(日期, 结果) 在每个日期完成后调用，返回各日期结果列表。
+        """
+        until_date = until_date or latest_published_date()
+        dates = sorted({
+            date
+            for option in self.options.values()
+            for date in option["trade_dates"]
+            if date <= until_date and option["close_prices"].get(date, "N/A") == "N/A"
+        })
+        summaries = []
+        executor = ThreadPoolExecutor(max_workers=self.fetch_controller.max_limit, thread_name_prefix="prefetch")
+        try:
+            futures = [(date, executor.submit(self.get_day_closes, date, token)) for date in dates]
+            for date, future in futures:
+                summary = self._apply_day_closes(date, future.result())
+                summaries.append(summary)
+                if on_day:
+                    on_day(date, summary)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return summaries
+
+    def run_query(self, query_date, option_name=None, keyword=None, is_keyword_query=False,
+                  progress=None, is_canceled=None, on_rows=None, token=None):
+        """执行查询：检查N/A、重新获取、计算头寸
+
+        每个期权（单期权模式下每个交易日）算完即通过 on_rows(分组, 结果行列表) 分批输出，
+        progress 可以是 progress(百分比, 消息) 回调或 ProgressReporter。
+        传入取消标记 token 时，取消会立即中止正在进行的网络请求。
+        返回 (查询结果, 错误信息)，错误信息格式为 {期权名称: [日期列表]}。
+        失败或取消时抛出 QueryError。
+        """
+        try:
+            with stats.span("query.total"):
+                return self._run_query(query_date, option_name, keyword, is_keyword_query,
+                                       progress, is_canceled, on_rows, token)
+        except FetchCanceled:
+            raise QueryError("查询已取消")
+
+    def _run_query(self, query_date, option_name, keyword, is_keyword_query, progress, is_canceled, on_rows, token):
+        reporter = progress if isinstance(progress, ProgressReporter) else ProgressReporter(progress)
+        if is_canceled is None:
+            is_canceled = token.is_canceled if token is not None else (lambda: False)
+        error_messages = {}
+        archive = self.archive
+
+        if not self.options and not archive:
+            raise QueryError("没有可查询的期权数据!")
+
+        results = {"single_option": [], "active_options": [], "expired_options": []}
+        chunker = RowChunker(on_rows, prepare=self.value_rows)
+
+        if not is_keyword_query and option_name and option_name not in self.options and option_name in archive:
+            # 归档的期权已计算到最后交易日，读取后直接输出历史
+            results["single_option"] = collect_history_rows(archive[option_name], query_date)
+            for row in results["single_option"]:
+                chunker.add("single_option", row)
+            chunker.flush()
+            self._value_remaining(results)
+            reporter.finish(100, "查询完成")
+            results["active_count"] = results["expired_count"] = 0
+            return results, error_messages
+
+        # 处理关键词筛选
+        filtered_options = dict(self.options)
+        if is_keyword_query and keyword:
+            filtered_options = filter_options(self.options, keyword)
+
+        # 确定要查询的期权集合
+        target_options = filtered_options
+        archived_rows = []  # 归档期权的到期日结果行，只读取归档索引
+        if not is_keyword_query and option_name and option_name in self.options:
+            target_options = {option_name: self.options[option_name]}
+        else:
+            archived_rows = archive.rows(keyword if is_keyword_query else None, exclude=self.options)
+
+        if not target_options and not archived_rows:
+            if is_keyword_query and keyword:
+                raise QueryError(f"没有找到包含关键词 '{keyword}' 的期权数据!")
+            raise QueryError("未找到目标期权数据!")
+
+        reporter.report("准备查询数据", force=True)
+
+        # 第一阶段：检查查询日期及之前的N/A数据
+        na_dates = {}  # 存储需要重新获取的日期 {期权名称: [日期列表]}
+        reporter.start_phase("检查", len(target_options), 0, 30)  # 第一阶段占30%进度
+        with stats.span("query.check"):
+            for name, option in target_options.items():
+                if is_canceled():
+                    raise QueryError("查询已取消")
+
+                dates = [date for date in option["trade_dates"]
+                         if date <= query_date and option["close_prices"].get(date) == "N/A"]
+                if dates:
+                    na_dates[name] = dates
+                reporter.task_done(f"检查 {option['name']} 的数据...")
+
+        # 第二阶段：逐个期权重新获取N/A数据并计算，算完一个期权就输出它的结果行
+        use_single_mode = len(target_options) == 1 and not archived_rows
+        if use_single_mode:
+            option = next(iter(target_options.values()))
+            compute_tasks = sum(1 for date in option["trade_dates"] if date <= query_date)
+        else:
+            compute_tasks = len(target_options)
+        total_tasks = sum(len(dates) for dates in na_dates.values()) + compute_tasks
+        reporter.start_phase("获取/计算", total_tasks, 30, 70)  # 第二阶段占30-100%进度
+
+        current_date = today_str()
+        # 所有N/A日期一开始全部提交并发获取，每个期权只等待自己的日期，算完即输出
+        refreshed_prices = self.iter_refresh_prices(
+            [(option, date) for name, option in target_options.items() for date in na_dates.get(name, [])], token)
+
+        with closing(refreshed_prices):
+            for name, option in target_options.items():
+                for date in na_dates.get(name, []):
+                    if is_canceled():
+                        raise QueryError("查询已取消")
+
+                    with stats.span("query.refetch"):
+                        _, _, refreshed = next(refreshed_prices)
+                    # 查询日期当天仍为N/A不报错，查询日期前记录错误
+                    if refreshed and date != query_date and refreshed["close_prices"].get(date) == "N/A":
+                        error_messages.setdefault(name, []).append(date)
+                    reporter.task_done(f"已获取 {option['name']} 在 {date} 的数据", fetched=True)
+
+                if is_canceled():
+                    raise QueryError("查询已取消")
+
+                with stats.span("query.compute"):
+                    if use_single_mode:
+                        # 单个期权查询模式：该期权截止查询日期的所有交易日数据
+                        for option, date in self.iter_option_data(name, query_date, token):
+                            row = option_row(option, date)
+                            results["single_option"].append(row)
+                            chunker.add("single_option", row)
+                            reporter.task_done(f"处理 {option['name']} 在 {date} 的数据...")
+                            if is_canceled():
+                                raise QueryError("查询已取消")
+                    else:
+                        # 多期权查询模式
+                        last_trade_date = max(option["trade_dates"]) if option["trade_dates"] else ""
+                        section, row_date = position_section(last_trade_date, option["trade_dates"], query_date,
+                                                             current_date)
+                        if section:
+                            option = self.ensure_option_data(name, row_date, token)
+                            row = option_row(option, row_date)
+                            results[section].append(row)
+                            chunker.add(section, row)
+                        reporter.task_done(f"处理 {option['name']} 的数据...")
+
+        for row in archived_rows:
+            results["expired_options"].append(row)
+            chunker.add("expired_options", row)
+        chunker.flush()
+        self._value_remaining(results)
+        reporter.finish(100, "查询完成")
+        results["active_count"] = len(results["active_options"])
+        results["expired_count"] = len(results["expired_options"])
+
+        # 收集错误信息（基于计算后的最新版本）
+        latest_options = {name: self.options[name] for name in target_options if name in self.options}
+        for name, dates in collect_missing_dates(latest_options, query_date, include_unfetched=False).items():
+            known = error_messages.setdefault(name, [])
+            known.extend(date for date in dates if date not in known)
+
+        return results, error_messages
+
+    def save_data(self, file_name=None):
+        """保存所有期权数据，失败时抛出异常
+
+        文件名以 .dcesnap 结尾时保存为二进制快照（position_snapshot），否则为JSON。
+        先写入临时文件再替换，保存中途出错不会损坏原文件。
+        """
+        options = self.options  # 已发布的版本不会再被修改，写文件期间无需加写锁
+        file_name = file_name or self.data_file
+        tmp_name = file_name + ".tmp"
+        with stats.span("save"), self._save_lock:
+            if is_snapshot_file_name(file_name):
+                data = encode_snapshot(options)
+                with open(tmp_name, 'wb') as f:
+                    f.write(data)
+                size = len(data)
+            else:
+                data_to_save = {
+                    name: {field: option[field] for field in OPTION_FIELDS}
+                    for name, option in options.items()
+                }
+                with open(tmp_name, 'w') as f:
+                    json.dump(data_to_save, f, indent=4)
+                    size = f.tell()
+            os.replace(tmp_name, file_name)
+            stats.count("save.bytes", size)
+
+    def save_data_as(self, file_name):
+        """另存为 file_name 并改用该文件，已到期期权的归档复制到新文件对应的归档目录"""
+        with self._write_lock:
+            archive = self.archive
+            target = archive_dir_for(file_name)
+            if os.path.abspath(target) != os.path.abspath(archive.path) and (archive or os.path.exists(target)):
+                archive.copy_to(target)
+            self.save_data(file_name)
+            self.data_file = file_name
+
+    def load_data(self, file_name=None):
+        """加载期权数据（按文件头自动识别快照或JSON），文件不存在时返回False，其他错误抛出异常"""
+        try:
+            with stats.span("load"), open(file_name or self.data_file, 'rb') as f:
+                data = f.read()
+                if is_snapshot(data):
+                    options = decode_snapshot(data)
+                else:
+                    options = {
+                        name: {field: option_data[field] for field in OPTION_FIELDS}
+                        for name, option_data in json.loads(data).items()
+                    }
+        except FileNotFoundError:
+            return False
+
+        with self._write_lock:
+            self.options = options
+            self.version += 1
+        return True
+
+    def get_dce_daily_close(self, contract_code: str, date_yyyymmdd: str, token=None,
+                            fresh_since=None) -> float | None:
+        """获取合约某日的价格（price_field，默认收盘价），获取失败返回None，取消时抛出 FetchCanceled"""
+        return self.get_quote(contract_code, date_yyyymmdd, self.price_field, token, fresh_since)
+
+    def get_quote(self, contract_code, date, field=CLOSE, token=None, fresh_since=None):
+        """获取合约某日行情表中任一数值字段（开盘价、结算价、成交量、持仓量等），优先读取行情缓存"""
+        table = self.get_day_table(date, token, field, fresh_since)
+        if table is None:
+            return None
+        return table.get(contract_code.strip().lower(), field)
+
+    def get_day_closes(self, date, token=None):
+        """某日整张日行情表的价格（price_field） {合约名称(小写): 价格或None}，行情表不可用时返回None"""
+        table = self.get_day_table(date, token, self.price_field)
+        return None if table is None else table.column(self.price_field)
+
+    def get_day_table(self, date, token=None, field=None, fresh_since=None):
+        """某日整张日行情表（day_table.DayTable），优先读取行情缓存；缓存中缺少 field 字段时重新获取
+
+        晚于最近一个已发布交易日（latest_published_date）的表可能是发布前的空表或不完整的表，只返回、不写入缓存。
+        fresh_since 见 QuoteCache.get_or_fetch。行情表不可用时返回None，取消时抛出 FetchCanceled。
+        """
+        date_yyyymmdd = date.replace("-", "")
+        key = f"{date_yyyymmdd[:4]}-{date_yyyymmdd[4:6]}-{date_yyyymmdd[6:8]}"
+        attempt = {}  # 实际访问网络时由 _fetch_day_table 填写
+        try:
+            return self.quote_cache.get_or_fetch(
+                key, lambda: self._fetch_day_table(date_yyyymmdd, token, attempt), token, field,
+                store=key <= latest_published_date(), fresh_since=fresh_since)
+        finally:
+            if self.audit_log:
+                self.audit_log.record(key, "miss" if attempt else "hit", **attempt)
+
+    def set_price_field(self, field):
+        """切换计算头寸使用的价格字段，按行情缓存中的日行情表重新取价并计算，不访问网络
+
+        与原价格字段缓存值不同的价格视为手工修改，保留不变；缓存中没有该字段的日期（旧版缓存）也不变。
+        一次发布，返回价格有变化的期权数。
+        """
+        if field not in PRICE_FIELDS:
+            raise ValueError(f"不支持的价格字段: {field}")
+
+        with self._write_lock:
+            previous, self.price_field = self.price_field, field
+            if previous == field:
+                return 0
+
+            changes = {}
+            for name, option in self.options.items():
+                contract = option["code"].strip().lower()
+                updates = {}
+                for date in option["trade_dates"]:
+                    price = option["close_prices"].get(date)
+                    table = self.quote_cache.get(date)
+                    if price is None or table is None or not table.has_field(field):
+                        continue
+                    if price != "N/A" and price != table.get(contract, previous):
+                        continue
+                    value = table.get(contract, field)
+                    value = "N/A" if value is None else value
+                    if value != price:
+                        updates[date] = value
+                if updates:
+                    option = copy_option(option)
+                    option["close_prices"].update(updates)
+                    self.recalculate_option_from_date(option, min(updates))
+                    changes[name] = option
+            if changes:
+                self._publish(changes)
+            return len(changes)
+
+    def _fetch_day_table(self, date_yyyymmdd, token=None, attempt=None):
+        """从网站获取并解析整张日行情表（全部数值列），attempt 字典中记录状态码、字节数、耗时和失败类型"""
+        attempt = attempt if attempt is not None else {}
+        params = {
+            "dayQuotes.variety": "all",
+            "dayQuotes.trade_type": "0",
+            "year": date_yyyymmdd[:4],
+            "month": str(int(date_yyyymmdd[4:6]) - 1),
+            "day": date_yyyymmdd[6:8],
+        }
+
+        if self.fetch_controller.paused():
+            attempt["fail"] = FAILURE_BACKOFF
+            stats.count("fetch.skipped")
+            return None
+
+        stats.count("fetch.requests")
+        with self.fetch_controller.slot(token, FetchCanceled) as timeout:
+            started = time.perf_counter()
+            text = None
+            try:
+                text = fetch_text(self.quotes_url, params, token, timeout, info=attempt)
+                if attempt.get("status", 200) >= 400:
+                    attempt["fail"] = FAILURE_HTTP
+            except FetchCanceled:
+                attempt["fail"] = FAILURE_CANCELED
+            except Exception as e:
+                attempt["fail"] = classify_exception(e)
+            elapsed = time.perf_counter() - started
+            attempt["ms"] = elapsed * 1000
+            stats.observe("fetch.network", elapsed)
+            self.fetch_controller.observe(elapsed, attempt.get("fail"), attempt.get("status"))
+
+        if attempt.get("fail") == FAILURE_CANCELED:
+            stats.count("fetch.canceled")
+            raise FetchCanceled()
+        if attempt.get("fail"):
+            stats.count("fetch.errors")
+            return None
+
+        if PAGE_MARKER not in text:
+            attempt["fail"] = FAILURE_UNAVAILABLE
+            stats.count("fetch.unavailable")
+            return None
+
+        # 解析在进程池中进行，不占用下载线程的GIL
+        started = time.perf_counter()
+        try:
+            return self.parse_pool.parse(text, token, FetchCanceled)
+        except FetchCanceled:
+            attempt["fail"] = FAILURE_CANCELED
+            stats.count("fetch.canceled")
+            raise
+        except Exception:
+            attempt["fail"] = FAILURE_PARSE
+            stats.count("fetch.errors")
+            return None
+        finally:
+            attempt["parse_ms"] = (time.perf_counter() - started) * 1000
+            stats.observe("fetch.parse", attempt["parse_ms"] / 1000)
+
+
+class OptionIndex:
+    """快照中单个期权的只读派生索引，随期权版本一起构建"""
+
+    __slots__ = ("last_trade_date", "trade_date_set", "missing_dates")
+
+    def __init__(self, option):
+        self.last_trade_date = max(option["trade_dates"]) if option["trade_dates"] else ""
+        self.trade_date_set = frozenset(option["trade_dates"])
+        self.missing_dates = sorted(date for date in option["trade_dates"]
+                                    if option["close_prices"].get(date, "N/A") == "N/A")
+
+
+class PortfolioSnapshot:
+    """某一版本的期权数据只读视图，发布后任何线程都不得修改其内容"""
+
+    __slots__ = ("version", "options", "index", "archive", "published_at")
+
+    def __init__(self, version, options, index, archive=None):
+        self.version = version
+        self.options = options
+        self.index = index
+        self.archive = archive  # 已到期期权归档，已到期列表中附加归档索引中的结果行
+        self.published_at = time.time()
+
+    def position_rows(self, query_date, keyword=None, current_date=None):
+        """多期权模式的查询结果，只读取已计算好的头寸，利用索引避免逐日扫描"""
+        current_date = current_date or today_str()
+        results = {"single_option": [], "active_options": [], "expired_options": []}
+
+        for name, option in filter_options(self.options, keyword).items():
+            index = self.index[name]
+            section, row_date = position_section(index.last_trade_date, index.trade_date_set, query_date, current_date)
+            if section:
+                results[section].append(option_row(option, row_date))
+        if self.archive is not None:
+            results["expired_options"].extend(self.archive.rows(keyword, exclude=self.options))
+
+        results["active_count"] = len(results["active_options"])
+        results["expired_count"] = len(results["expired_options"])
+        return results
+
+    def missing_dates(self, query_date, keyword=None):
+        """与 collect_missing_dates 结果相同（按日期排序）"""
+        missing = {}
+        for name in filter_options(self.options, keyword):
+            dates = self.index[name].missing_dates
+            count = bisect.bisect_left(dates, query_date)
+            if count:
+                missing[name] = dates[:count]
+        return missing
+
+
+class SnapshotStore:
+    """单写者、多读者的期权数据存储
+
+    引擎发布的期权版本本身不可变，快照直接引用它们，只为发生变化的期权重建索引；
+    读者只需取一次 current() 的引用，即可在一致的版本上完成整个请求。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._write_lock = threading.Lock()
+        options = engine.options
+        self._snapshot = PortfolioSnapshot(0, options, {name: OptionIndex(option) for name, option in options.items()},
+                                           engine.archive)
+
+    def current(self):
+        return self._snapshot
+
+    def write(self, fn):
+        """在写锁内执行 fn(engine)，然后发布引擎的最新版本"""
+        with self._write_lock:
+            result = fn(self.engine)
+            self._publish()
+            return result
+
+    def _publish(self):
+        previous = self._snapshot
+        options = self.engine.options
+        index = {}
+        for name, option in options.items():
+            if previous.options.get(name) is option:
+                index[name] = previous.index[name]
+            else:
+                index[name] = OptionIndex(option)
+        self._snapshot = PortfolioSnapshot(previous.version + 1, options, index, self.engine.archive)
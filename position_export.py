@@ -0,0 +1,228 @@
+"""头寸历史导出：长表或宽表，CSV / Parquet / Arrow
+
+长表每行一个 (期权, 交易日)：
+
+    name, code, strike_price, date, close_price, actual_volume, close_amount, position_change, position, export_seq
+
+宽表每行一个 (期权, 字段)，每个交易日一列，适合直接在表格软件中查看。
+逐个期权生成行、按批写出，导出期间内存占用与期权数量无关。N/A 的收盘价导出为空值。
+传入估值参数（option_valuation.ValuationParams）时，长表在 position 之后附加 theo_price, delta, gamma, vega 四列，
+宽表附加这四个字段的行；整个持仓先一次估值，再逐个期权写出。
+
+增量模式（只支持长表）记录每行内容的校验值，之后只追加新增或有变化的 (期权, 交易日)，
+export_seq 为导出批次号，同一 (期权, 交易日) 以批次号最大的一行为准；删除的期权和交易日需要完整导出才会反映。
+CSV 导出为单个文件，增量时追加；Parquet/Arrow 导出为目录，每个批次一个 part 文件，需要安装 pyarrow。
+
+    python main.py export --out positions.csv
+    python main.py export --out positions_parquet --format parquet --incremental
+"""
+import csv
+import glob
+import json
+import os
+import zlib
+from datetime import date as date_type
+
+
+LONG_COLUMNS = ("name", "code", "strike_price", "date", "close_price", "actual_volume", "close_amount",
+                "position_change", "position")
+VALUATION_COLUMNS = ("theo_price", "delta", "gamma", "vega")  # 与 option_valuation.VALUATION_COLUMNS 相同
+WIDE_FIELDS = {  # 宽表的字段名 -> 期权数据中的逐日字典
+    "close_price": "close_prices",
+    "actual_volume": "actual_volumes",
+    "close_amount": "close_amounts",
+    "position_change": "position_changes",
+    "position": "positions",
+}
+FORMATS = ("csv", "parquet", "arrow")
+BATCH_ROWS = 50000  # Parquet/Arrow 每批（行组）的行数
+
+
+class ExportError(Exception):
+    """导出无法进行时抛出，消息直接展示给用户"""
+
+
+def daily_value(option, field, date):
+    value = option[field].get(date, 0 if field == "close_amounts" else None)  # 没有平仓即为0
+    return None if value == "N/A" else value
+
+
+def valuation_columns(values):
+    """估值结果 {列名: 与交易日对齐的列表} 中的 N/A 导出为空值"""
+    return [[None if value == "N/A" else value for value in values[column]] for column in VALUATION_COLUMNS]
+
+
+def long_rows(option, values=None):
+    """期权各交易日的长表行（不含 export_seq），values 为该期权的估值结果"""
+    extra = list(zip(*valuation_columns(values))) if values else None
+    for index, date in enumerate(option["trade_dates"]):
+        row = (option["name"], option["code"], option["strike_price"], date,
+               *(daily_value(option, field, date) for field in WIDE_FIELDS.values()))
+        yield row + extra[index] if extra else row
+
+
+def wide_rows(option, dates, values=None):
+    """期权每个字段一行，dates 为所有期权交易日的并集"""
+    trade_dates = set(option["trade_dates"])
+    for name, field in WIDE_FIELDS.items():
+        yield (option["name"], option["code"], option["strike_price"], name,
+               *(daily_value(option, field, date) if date in trade_dates else None for date in dates))
+    if values:
+        for name, column in zip(VALUATION_COLUMNS, valuation_columns(values)):
+            by_date = dict(zip(option["trade_dates"], column))
+            yield (option["name"], option["code"], option["strike_price"], name, *map(by_date.get, dates))
+
+
+def row_checksum(row):
+    return zlib.crc32(repr(row).encode("utf-8"))
+
+
+def state_path(out):
+    return out.rstrip("/\\") + ".export-state.json"
+
+
+class CsvSink:
+    def __init__(self, out, columns, append=False):
+        self._file = open(out, 'a' if append else 'w', newline='', encoding='utf-8-sig' if not append else 'utf-8')
+        self._writer = csv.writer(self._file)
+        if not append:
+            self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowSink:
+    """Parquet/Arrow 写入目录中的一个 part 文件，按批写出行组"""
+
+    def __init__(self, out, columns, file_format, seq, append=False):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ExportError("导出 Parquet/Arrow 需要安装 pyarrow（pip install pyarrow）")
+        self._pa = pa
+        os.makedirs(out, exist_ok=True)
+        if not append:
+            for old in glob.glob(os.path.join(glob.escape(out), f"part-*.{file_format}")):
+                os.remove(old)
+
+        self.schema = pa.schema([(column, self._column_type(column)) for column in columns])
+        path = os.path.join(out, f"part-{seq:05d}.{file_format}")
+        if file_format == "parquet":
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+        self._columns = columns
+        self._pending = []
+
+    def _column_type(self, column):
+        pa = self._pa
+        if column in ("name", "code", "field"):
+            return pa.string()
+        if column == "date":
+            return pa.date32()
+        if column == "export_seq":
+            return pa.int32()
+        return pa.float64()  # 数值列，宽表中每个日期一列
+
+    def write(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        columns = list(zip(*self._pending))
+        arrays = []
+        for name, values in zip(self._columns, columns):
+            if name == "date":
+                values = [date_type.fromisoformat(value) for value in values]
+            arrays.append(self._pa.array(values, type=self.schema.field(name).type))
+        self._writer.write_batch(self._pa.record_batch(arrays, schema=self.schema))
+        self._pending = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def export_positions(options, out, layout="long", file_format=None, incremental=False, valuation=None):
+    """导出头寸历史，options 为期权数据的一个版本（如 engine.options），valuation 为估值参数
+
+    返回 {"rows": 写出的行数, "options": 期权数, "seq": 导出批次号, "incremental": 是否为增量导出}。
+    """
+    file_format = file_format or ("parquet" if out.endswith(".parquet") else "arrow" if out.endswith(".arrow")
+                                  else "csv")
+    if file_format not in FORMATS:
+        raise ExportError(f"不支持的导出格式: {file_format}")
+    if layout not in ("long", "wide"):
+        raise ExportError(f"不支持的表格形式: {layout}")
+    if incremental and layout != "long":
+        raise ExportError("增量导出只支持长表")
+
+    base_columns = LONG_COLUMNS + (VALUATION_COLUMNS if valuation else ())
+    state = None
+    if incremental:
+        try:
+            with open(state_path(out), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = None
+        if state and (state.get("format") != file_format or not os.path.exists(out)
+                      or tuple(state.get("columns", LONG_COLUMNS)) != base_columns):
+            state = None  # 格式或列变化，或之前的导出已被删除，重新完整导出
+    seq = state["seq"] + 1 if state else 1
+    checksums = state["checksums"] if state else {}
+    append = state is not None
+
+    book = None
+    if valuation:
+        from option_valuation import value_book
+        book = value_book(options, valuation)
+
+    if layout == "long":
+        columns = base_columns + ("export_seq",)
+    else:
+        dates = sorted({date for option in options.values() for date in option["trade_dates"]})
+        columns = ("name", "code", "strike_price", "field") + tuple(dates)
+
+    if file_format == "csv":
+        sink = CsvSink(out, columns, append)
+    else:
+        sink = ArrowSink(out, columns, file_format, seq, append)
+
+    written = 0
+    try:
+        for name, option in options.items():
+            values = book.option(name) if book and name in book.offsets else None
+            if layout == "wide":
+                rows = list(wide_rows(option, dates, values))
+            else:
+                exported = checksums.get(name, {})
+                current = {}
+                rows = []
+                for row in long_rows(option, values):
+                    checksum = current[row[3]] = row_checksum(row)
+                    if exported.get(row[3]) != checksum:
+                        rows.append(row + (seq,))
+                checksums[name] = current
+            sink.write(rows)
+            written += len(rows)
+    finally:
+        sink.close()
+
+    if layout == "long":
+        for name in set(checksums) - set(options):
+            del checksums[name]
+        tmp = state_path(out) + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"format": file_format, "columns": base_columns, "seq": seq, "checksums": checksums}, f,
+                      ensure_ascii=False)
+        os.replace(tmp, state_path(out))
+
+    return {"rows": written, "options": len(options), "seq": seq, "incremental": append}
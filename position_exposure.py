@@ -0,0 +1,174 @@
+"""按标的期货合约汇总净头寸
+
+多个期权常常对应同一个期货合约（如 m2409），按期货代码（code）或品种（product，代码开头的字母）分组，
+逐个交易日汇总：
+
+    position        当日头寸合计（只含已计算头寸的期权）
+    daily_reversal  每日冲回量合计
+    actual_volume   实际成交量（行权）合计
+    options         当日为交易日的期权数
+    uncalculated    当日头寸尚未计算的期权数，不为0时 position 和 actual_volume 不完整
+
+每个期权的贡献为按交易日对齐的数组，首次汇总时所有期权的贡献连接后用 np.bincount 一次分组求和；
+之后期权版本变化时只减去旧贡献、加上新贡献，出现新的交易日时才重建日期轴。
+只汇总当前发布的期权，不包括已归档的期权。
+
+    python main.py exposure --by product --date 2024-06-28
+"""
+import math
+import re
+from itertools import repeat
+
+import numpy as np
+
+
+GROUP_BY = ("code", "product")
+EXPOSURE_FIELDS = ("position", "daily_reversal", "actual_volume")
+COUNT_FIELDS = ("options", "uncalculated")
+_ROWS = EXPOSURE_FIELDS + COUNT_FIELDS  # 汇总数组第一维的顺序
+REBUILD_RATIO = 0.5  # 变化的期权超过此比例时整体重建，比逐个增减更快
+
+
+def group_key(code, by="code"):
+    """期权所属分组：期货代码或品种代码（小写）"""
+    code = code.strip().lower()
+    if by == "product":
+        match = re.match(r"[a-z]+", code)
+        return match.group() if match else code
+    return code
+
+
+class ExposureBook:
+    """分组 × 交易日的汇总数组
+
+    totals 为 [len(_ROWS), 分组数, 交易日数] 的数组，dates 升序。
+    发布的期权版本不可变，以对象身份判断期权是否变化（与 SnapshotStore 相同）。
+    不是线程安全的，由调用方加锁。
+    """
+
+    def __init__(self, by="code"):
+        if by not in GROUP_BY:
+            raise ValueError(f"不支持的汇总方式: {by}")
+        self.by = by
+        self.dates = []
+        self.date_index = {}
+        self.groups = []
+        self.group_index = {}
+        self.totals = np.zeros((len(_ROWS), 0, 0))
+        self._contributions = {}  # {期权名称: (期权版本, 分组, 交易日下标数组, [len(_ROWS), 交易日数] 数组)}
+
+    def update(self, options):
+        """与 options 同步，返回重新计算贡献的期权数"""
+        contributions = self._contributions
+        changed = [name for name, option in options.items() if option["trade_dates"]
+                   and (name not in contributions or contributions[name][0] is not option)]
+        removed = [name for name in contributions if name not in options or not options[name]["trade_dates"]]
+        if not changed and not removed:
+            return 0
+        if (not contributions or len(changed) > len(options) * REBUILD_RATIO
+                or any(date not in self.date_index for name in changed for date in options[name]["trade_dates"])):
+            self._rebuild(options)
+            return len(changed)
+
+        for name in removed:
+            self._apply(contributions.pop(name), -1)
+        for name in changed:
+            if name in contributions:
+                self._apply(contributions.pop(name), -1)
+            option = options[name]
+            key = group_key(option["code"], self.by)
+            if key not in self.group_index:
+                self._add_group(key)
+            contribution = contributions[name] = (option, key, *self._contribution(option))
+            self._apply(contribution, 1)
+        return len(changed)
+
+    def _contribution(self, option):
+        trade_dates = option["trade_dates"]
+        columns = np.fromiter(map(self.date_index.__getitem__, trade_dates), dtype=np.intp, count=len(trade_dates))
+        positions = np.array(list(map(option["positions"].get, trade_dates, repeat(math.nan))), dtype=np.float64)
+        calculated = ~np.isnan(positions)
+        values = np.empty((len(_ROWS), len(trade_dates)))
+        values[0] = np.where(calculated, positions, 0)
+        values[1] = option["daily_reversal"]
+        values[2] = np.where(calculated, list(map(option["actual_volumes"].get, trade_dates, repeat(0))), 0)
+        values[3] = 1
+        values[4] = ~calculated
+        return columns, values
+
+    def _apply(self, contribution, sign):
+        _, key, columns, values = contribution
+        group = self.group_index[key]
+        for row in range(len(_ROWS)):
+            np.add.at(self.totals[row, group], columns, sign * values[row])
+
+    def _add_group(self, key):
+        self.group_index[key] = len(self.groups)
+        self.groups.append(key)
+        self.totals = np.concatenate([self.totals, np.zeros((len(_ROWS), 1, len(self.dates)))], axis=1)
+
+    def _rebuild(self, options):
+        """重建日期轴和分组，未变化的期权沿用已提取的逐日数值，只重新映射日期下标"""
+        previous = self._contributions
+        self.dates = sorted({date for option in options.values() for date in option["trade_dates"]})
+        self.date_index = {date: column for column, date in enumerate(self.dates)}
+        self.groups = sorted({group_key(option["code"], self.by) for option in options.values()
+                              if option["trade_dates"]})
+        self.group_index = {key: index for index, key in enumerate(self.groups)}
+
+        contributions = {}
+        for name, option in options.items():
+            if not option["trade_dates"]:
+                continue
+            old = previous.get(name)
+            if old is not None and old[0] is option:
+                columns = np.fromiter(map(self.date_index.__getitem__, option["trade_dates"]), dtype=np.intp,
+                                      count=len(option["trade_dates"]))
+                values = old[3]
+            else:
+                columns, values = self._contribution(option)
+            contributions[name] = (option, group_key(option["code"], self.by), columns, values)
+        self._contributions = contributions
+
+        size = len(self.groups) * len(self.dates)
+        if not contributions:
+            self.totals = np.zeros((len(_ROWS), len(self.groups), len(self.dates)))
+            return
+        flat = np.concatenate([self.group_index[key] * len(self.dates) + columns
+                               for _, key, columns, _ in contributions.values()])
+        values = np.concatenate([values for _, _, _, values in contributions.values()], axis=1)
+        self.totals = np.stack([np.bincount(flat, weights=values[row], minlength=size)
+                                for row in range(len(_ROWS))]).reshape(len(_ROWS), len(self.groups), len(self.dates))
+
+    def rows(self, date=None, group=None):
+        """汇总结果行，按分组、日期排序，只包含有交易的 (分组, 交易日)；date、group 指定时只返回该日、该分组"""
+        totals = self.totals
+        if date is not None:
+            if date not in self.date_index:
+                return []
+            column = self.date_index[date]
+            totals = totals[:, :, column:column + 1]
+            dates = [date]
+        else:
+            dates = self.dates
+        if group is not None:
+            group = group_key(group, self.by)
+            if group not in self.group_index:
+                return []
+            index = self.group_index[group]
+            totals = totals[:, index:index + 1]
+            groups = [group]
+        else:
+            groups = self.groups
+
+        group_ids, date_ids = np.nonzero(totals[3] > 0.5)
+        if groups != sorted(groups):  # 增量新增的分组追加在最后，按分组名称排序（稳定排序保持日期顺序）
+            order = np.argsort(np.array(groups)[group_ids], kind="stable")
+            group_ids, date_ids = group_ids[order], date_ids[order]
+        # 逐个增减贡献会累积浮点误差：数量保留6位小数，计数取整
+        columns = [np.round(totals[row, group_ids, date_ids], 6).tolist() for row in range(len(EXPOSURE_FIELDS))]
+        columns += [np.rint(totals[row, group_ids, date_ids]).astype(np.int64).tolist()
+                    for row in range(len(EXPOSURE_FIELDS), len(_ROWS))]
+        keys = ("group", "date") + _ROWS
+        return [dict(zip(keys, values)) for values in zip(map(groups.__getitem__, group_ids.tolist()),
+                                                           map(dates.__getitem__, date_ids.tolist()), *columns)]
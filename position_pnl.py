@@ -0,0 +1,191 @@
+"""逐日损益归因
+
+按计算头寸使用的价格（close_prices，按 price_field 取收盘价或结算价）计价，每个期权每个交易日的损益分为：
+
+    carry          前一日头寸 × 当日价格变动
+    reversal_pnl   每日冲回量 × (价格 - 执行价格)
+    exercise_pnl   实际成交量（行权）× (价格 - 执行价格)
+    close_out_pnl  平仓量 × (价格 - 执行价格)
+    pnl            以上四项之和，cumulative_pnl 为截至当日的累计
+
+即每笔数量都按执行价格成交、之后按该价格盯市：初始计提量在第一个交易日按执行价格计入，
+因此 cumulative_pnl 始终等于 当日头寸 × (价格 - 执行价格)。
+价格为N/A或尚未获取的交易日沿用之前最近的价格（之前没有价格时按执行价格，即损益为0），
+价格恢复的交易日一次计入期间的价格变动。
+
+头寸由 initial_amount、daily_reversal、close_prices、close_amounts 与 compute_actual_volume 相同的规则重新推算，
+不依赖已保存的头寸是否已计算。全部期权展开为一维数组一次计算，分段累加用整体 cumsum 减去各期权起点的值。
+结果按期权版本缓存（发布的期权不可变），再次计算时只计算变化的期权。
+
+    python main.py pnl --end 2024-12-31
+    python main.py pnl --option 豆粕期权A --out pnl.csv
+"""
+import csv
+from itertools import repeat
+
+import numpy as np
+
+from option_valuation import daily_prices
+
+
+PNL_FIELDS = ("carry", "reversal_pnl", "exercise_pnl", "close_out_pnl", "pnl", "cumulative_pnl")
+ROW_COLUMNS = ("date", "name", "close_price", "position") + PNL_FIELDS
+
+
+def segment_cumsum(values, starts, counts):
+    """按期权分段累加：整体 cumsum 减去每段起点之前的累计值"""
+    total = np.cumsum(values)
+    return total - np.repeat(total[starts] - values[starts], counts)
+
+
+def attribute_pnl(options):
+    """一次计算 options 中全部期权的逐日损益，返回 {期权名称: {"position"及各损益列: 数组}}"""
+    names, counts, strikes, calls, reversals, initials = [], [], [], [], [], []
+    prices, closes = [], []
+    for name, option in options.items():
+        trade_dates = option["trade_dates"]
+        if not trade_dates:
+            continue
+        names.append(name)
+        counts.append(len(trade_dates))
+        strikes.append(option["strike_price"])
+        calls.append(option["initial_amount"] < 0)
+        reversals.append(option["daily_reversal"])
+        initials.append(option["initial_amount"])
+        prices.extend(daily_prices(option["close_prices"], trade_dates))
+        closes.extend(map(option["close_amounts"].get, trade_dates, repeat(0)))
+    if not names:
+        return {}
+
+    counts = np.array(counts, dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    strike = np.repeat(np.array(strikes, dtype=np.float64), counts)
+    reversal = np.repeat(np.array(reversals, dtype=np.float64), counts)
+    price = np.array(prices, dtype=np.float64)
+    close = np.array(closes, dtype=np.float64)
+
+    # 实际成交量：价格在执行价格不利一侧时冲回当日的冲回量（compute_actual_volume）
+    valid = ~np.isnan(price)
+    with np.errstate(invalid='ignore'):
+        exercised = valid & np.where(np.repeat(np.array(calls, dtype=bool), counts), price > strike, price < strike)
+    actual = np.where(exercised, -reversal, 0.0)
+    change = reversal + actual + close
+    position = np.repeat(np.array(initials, dtype=np.float64), counts) + segment_cumsum(change, starts, counts)
+
+    # 沿用最近的价格：有价格的位置记下标，累计取最大值后落在本期权起点之前的表示之前没有价格
+    index = np.maximum.accumulate(np.where(valid, np.arange(len(price)), -1))
+    marked = np.where(index >= np.repeat(starts, counts), price[np.maximum(index, 0)], strike)
+    previous = np.empty_like(marked)
+    previous[1:] = marked[:-1]
+    previous[starts] = strike[starts]
+
+    moneyness = marked - strike
+    columns = {  # 加0.0把数量为0时得到的 -0.0 规范为 0.0
+        "position": position,
+        "carry": (position - change) * (marked - previous) + 0.0,
+        "reversal_pnl": reversal * moneyness + 0.0,
+        "exercise_pnl": actual * moneyness + 0.0,
+        "close_out_pnl": close * moneyness + 0.0,
+    }
+    columns["pnl"] = columns["carry"] + columns["reversal_pnl"] + columns["exercise_pnl"] + columns["close_out_pnl"]
+    columns["cumulative_pnl"] = segment_cumsum(columns["pnl"], starts, counts)
+
+    results = {}
+    for name, start, count in zip(names, starts.tolist(), counts.tolist()):
+        results[name] = {column: values[start:start + count] for column, values in columns.items()}
+    return results
+
+
+class PnlBook:
+    """各期权逐日损益的缓存，update 时只重新计算版本变化的期权（一次批量计算）
+
+    组合汇总使用所有期权交易日的并集作为日期轴，各期权保存交易日在轴上的下标，出现新的交易日时才重建。
+    不是线程安全的，由调用方加锁。
+    """
+
+    def __init__(self):
+        self._results = {}  # {期权名称: (期权版本, 损益数组, 交易日在日期轴上的下标)}
+        self._dates = []
+        self._date_index = {}
+        self._portfolio = None  # 组合逐日损益，任何期权变化时失效
+
+    def _columns(self, option):
+        trade_dates = option["trade_dates"]
+        return np.fromiter(map(self._date_index.__getitem__, trade_dates), dtype=np.intp, count=len(trade_dates))
+
+    def update(self, options):
+        """与 options 同步，返回重新计算的期权数"""
+        changed = {name: option for name, option in options.items()
+                   if name not in self._results or self._results[name][0] is not option}
+        removed = [name for name in self._results if name not in options]
+        for name in removed:
+            del self._results[name]
+        if changed:
+            results = attribute_pnl(changed)
+            if any(date not in self._date_index for option in changed.values() for date in option["trade_dates"]):
+                self._dates = sorted({date for option in options.values() for date in option["trade_dates"]})
+                self._date_index = {date: column for column, date in enumerate(self._dates)}
+                self._results = {name: (option, result, self._columns(option))
+                                 for name, (option, result, _) in self._results.items()}
+            for name, option in changed.items():
+                if name in results:
+                    self._results[name] = (option, results[name], self._columns(option))
+                else:
+                    self._results.pop(name, None)  # 没有交易日
+        if changed or removed:
+            self._portfolio = None
+        return len(changed)
+
+    def option_rows(self, name, start_date=None, end_date=None):
+        """单个期权的逐日损益行，期权不存在时返回None"""
+        if name not in self._results:
+            return None
+        option, columns, _ = self._results[name]
+        values = [columns[field].tolist() for field in ("position",) + PNL_FIELDS]
+        rows = []
+        for index, date in enumerate(option["trade_dates"]):
+            if (start_date and date < start_date) or (end_date and date > end_date):
+                continue
+            row = {"date": date, "name": name, "close_price": option["close_prices"].get(date, "N/A")}
+            row.update(zip(("position",) + PNL_FIELDS, (column[index] for column in values)))
+            rows.append(row)
+        return rows
+
+    def portfolio(self):
+        """组合逐日损益：(日期列表, 期权数数组, {列名: 数组})，各列为当日有交易的期权之和"""
+        if self._portfolio is None:
+            results = list(self._results.values())
+            size = len(self._dates)
+            columns = np.concatenate([columns for _, _, columns in results]) if results else np.zeros(0, np.intp)
+            totals = {}
+            for field in ("position",) + PNL_FIELDS[:-1]:
+                values = np.concatenate([result[field] for _, result, _ in results]) if results else np.zeros(0)
+                totals[field] = np.bincount(columns, weights=values, minlength=size)
+            totals["cumulative_pnl"] = np.cumsum(totals["pnl"])
+            self._portfolio = (self._dates, np.bincount(columns, minlength=size), totals)
+        return self._portfolio
+
+    def portfolio_rows(self, start_date=None, end_date=None):
+        """组合逐日损益行，name 为期权数说明，close_price 为空，position 为各期权头寸之和
+
+        只包含至少一个期权有交易的日期，合计保留6位小数以去掉求和的浮点误差。
+        """
+        dates, counts, totals = self.portfolio()
+        values = [np.round(totals[field], 6).tolist() for field in ("position",) + PNL_FIELDS]
+        rows = []
+        for index, (date, count) in enumerate(zip(dates, counts.tolist())):
+            if not count or (start_date and date < start_date) or (end_date and date > end_date):
+                continue
+            row = {"date": date, "name": f"{count} 个期权", "close_price": None}
+            row.update(zip(("position",) + PNL_FIELDS, (column[index] for column in values)))
+            rows.append(row)
+        return rows
+
+
+def write_pnl_csv(rows, out):
+    """把损益行写入CSV（列为 ROW_COLUMNS，N/A 写为空值）"""
+    with open(out, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(ROW_COLUMNS)
+        for row in rows:
+            writer.writerow(None if row[column] == "N/A" else row[column] for column in ROW_COLUMNS)
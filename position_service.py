@@ -0,0 +1,355 @@
+"""本地 HTTP/JSON 头寸服务
+
+读请求基于不可变快照并发处理；刷新和修改由唯一的写线程依次执行，
+完成后发布新快照，读请求不会看到写到一半的数据。
+
+    python main.py serve --port 8765 --data options_data.json
+"""
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from perf_stats import stats
+from position_engine import PositionEngine, SnapshotStore, collect_history_rows, filter_options, today_str
+
+
+_SAVE_DUE = object()  # 写队列等待超时，表示到达保存时间
+
+
+class ServiceError(Exception):
+    """带HTTP状态码的请求错误"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_date(value, default=None):
+    if not value:
+        if default is None:
+            raise ServiceError(400, "缺少日期参数")
+        return default
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ServiceError(400, f"日期格式应为YYYY-MM-DD: {value}")
+
+
+def parse_number(value, field):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ServiceError(400, f"{field} 必须是数字")
+
+
+class PositionService:
+    """头寸服务：一个写线程 + 多个读线程"""
+
+    def __init__(self, data_file="options_data.json", host="127.0.0.1", port=8765, engine=None,
+                 save_interval=1.0):
+        self.save_interval = save_interval  # 两次保存数据文件的最小间隔（秒）
+        self.engine = engine or PositionEngine(data_file)
+        if engine is None:
+            self.engine.load_data()
+        self.engine.recalculate_all()
+        self.store = SnapshotStore(self.engine)
+
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="position-writer", daemon=True)
+        self.server = ThreadingHTTPServer((host, port), PositionRequestHandler)
+        self.server.daemon_threads = True
+        self.server.service = self
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._writer.start()
+        threading.Thread(target=self.server.serve_forever, name="position-http", daemon=True).start()
+
+    def serve_forever(self):
+        self._writer.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._writes.put(None)
+        if self._writer.is_alive():
+            self._writer.join()
+
+    # ---- 写操作：全部经由写线程串行执行 ----
+
+    def submit_write(self, fn):
+        """提交写操作 fn(engine)，返回 Future"""
+        future = Future()
+        self._writes.put((fn, future))
+        return future
+
+    def _writer_loop(self):
+        unsaved = []  # 已发布但尚未持久化的写操作 [(Future, 结果)]
+        last_save = 0.0
+        while True:
+            timeout = max(0.0, last_save + self.save_interval - time.monotonic()) if unsaved else None
+            try:
+                item = self._writes.get(timeout=timeout)
+            except queue.Empty:
+                item = _SAVE_DUE
+
+            if item is not None and item is not _SAVE_DUE:
+                fn, future = item
+                if future.set_running_or_notify_cancel():
+                    try:
+                        unsaved.append((future, self.store.write(fn)))
+                    except Exception as e:
+                        future.set_exception(e)
+
+            # 保存整个文件代价较高，距上次保存不足 save_interval 的写操作合并为一次持久化
+            if unsaved and (item is None or time.monotonic() >= last_save + self.save_interval):
+                self._persist(unsaved)
+                unsaved = []
+                last_save = time.monotonic()
+            if item is None:
+                return
+
+    def _persist(self, unsaved):
+        try:
+            self.engine.save_data()
+        except Exception as e:
+            for future, _ in unsaved:
+                future.set_exception(e)
+        else:
+            for future, result in unsaved:
+                future.set_result(result)
+
+    def refresh(self, query_date, option_name=None, keyword=None):
+        """重新获取查询日期及之前的市场数据"""
+        options = self.store.current().options
+        if option_name:
+            if option_name not in options:
+                raise ServiceError(404, f"找不到期权: {option_name}")
+            names = [option_name]
+        else:
+            names = list(filter_options(options, keyword))
+
+        started_at = time.time()  # 明确要求的刷新不使用此前缓存的日行情表
+
+        def apply(engine):
+            pairs = [(option, date) for option in map(engine.options.get, names) if option is not None
+                     for date in option["trade_dates"] if date <= query_date]
+            # 各日期并发获取（并发数由 fetch_controller 控制）
+            updated = sum(1 for _ in engine.iter_refresh_prices(pairs, fresh_since=started_at))
+            return {"options": len(names), "updated_dates": updated}
+
+        return self.submit_write(apply)
+
+    def set_close_amount(self, option_name, date, amount):
+        return self._edit(option_name, date, "close_amounts", amount)
+
+    def set_close_price(self, option_name, date, price):
+        return self._edit(option_name, date, "close_prices", price)
+
+    def set_closes(self, rows):
+        """批量写入平仓量/收盘价，rows 为 [{"option", "date", "amount", "price"}]，一次重新计算、一次持久化"""
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ServiceError(400, "rows 必须是对象数组")
+        # 只有批量写入用到 pandas，延迟导入以免拖慢服务启动
+        import pandas as pd
+
+        from option_import import OptionImportError, close_updates, parse_close_table
+
+        df = pd.DataFrame({
+            "name": [row.get("option") for row in rows],
+            "date": [row.get("date") for row in rows],
+            "close_amount": [row.get("amount") for row in rows],
+            "close_price": [row.get("price") for row in rows],
+        }, dtype="string")
+        try:
+            updates = close_updates(parse_close_table(df, self.store.current().options, first_row=1))
+        except OptionImportError as e:
+            raise ServiceError(400, str(e))
+
+        def apply(engine):
+            starts = engine.set_daily_values(updates)
+            return {"rows": len(rows), "options": len(starts)}
+
+        return self.submit_write(apply)
+
+    def _edit(self, option_name, date, field, value):
+        option = self.store.current().options.get(option_name)
+        if option is None:
+            raise ServiceError(404, f"找不到期权: {option_name}")
+        if date not in option["trade_dates"]:
+            raise ServiceError(400, f"{date} 不是 {option_name} 的交易日")
+
+        def apply(engine):
+            def mutate(target):
+                target[field][date] = value
+                engine.recalculate_option_from_date(target, date)
+
+            target = engine.update_option(option_name, mutate)
+            if target is None:
+                raise ServiceError(404, f"找不到期权: {option_name}")
+            return {"option": option_name, "date": date, "position": target["positions"].get(date, 0)}
+
+        return self.submit_write(apply)
+
+    # ---- 读操作：只访问当前快照 ----
+
+    def positions(self, query_date, keyword=None):
+        snapshot = self.store.current()
+        results = snapshot.position_rows(query_date, keyword)
+        return {"version": snapshot.version, "date": query_date,
+                "active_options": results["active_options"], "expired_options": results["expired_options"]}
+
+    def history(self, option_name, query_date):
+        snapshot = self.store.current()
+        option = snapshot.options.get(option_name)
+        if option is None and snapshot.archive is not None:
+            option = snapshot.archive.hydrate(option_name)
+        if option is None:
+            raise ServiceError(404, f"找不到期权: {option_name}")
+        return {"version": snapshot.version, "date": query_date, "option": option_name,
+                "rows": collect_history_rows(option, query_date)}
+
+    def exposure(self, by="code", date=None, group=None):
+        """按期货合约或品种汇总的净头寸，date 为空时返回全部交易日"""
+        snapshot = self.store.current()
+        try:
+            rows = self.engine.exposure_rows(by, date, group, options=snapshot.options)
+        except ValueError as e:
+            raise ServiceError(400, str(e))
+        return {"version": snapshot.version, "by": by, "date": date, "rows": rows}
+
+    def missing(self, query_date, keyword=None):
+        snapshot = self.store.current()
+        return {"version": snapshot.version, "date": query_date,
+                "missing": snapshot.missing_dates(query_date, keyword)}
+
+    def list_options(self):
+        snapshot = self.store.current()
+        return {"version": snapshot.version,
+                "options": [{"name": name, "code": option["code"],
+                             "last_trade_date": snapshot.index[name].last_trade_date}
+                            for name, option in snapshot.options.items()]}
+
+    def quote(self, contract, date, field=None):
+        """行情缓存中合约某日的全部数值字段（或单个字段），不访问网络"""
+        table = self.engine.quote_cache.get(date)
+        row = None if table is None else table.row(contract.strip().lower())
+        if row is None:
+            raise ServiceError(404, f"行情缓存中没有 {contract} 在 {date} 的数据")
+        if field:
+            if field not in row:
+                raise ServiceError(404, f"行情缓存中没有字段: {field}")
+            row = {field: row[field]}
+        return {"contract": contract, "date": date, "fields": row}
+
+    def status(self):
+        snapshot = self.store.current()
+        return {"version": snapshot.version, "options": len(snapshot.options),
+                "published_at": snapshot.published_at, "pending_writes": self._writes.qsize()}
+
+
+class PositionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持长连接，避免每个请求重新建连
+    disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免长连接上的延迟确认等待
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch(self._handle_get)
+
+    def do_POST(self):
+        self._dispatch(self._handle_post)
+
+    def _dispatch(self, handler):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        try:
+            status, payload = handler(parts, params)
+        except ServiceError as e:
+            status, payload = e.status, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"发生错误: {str(e)}"}
+        self._send_json(status, payload)
+
+    def _handle_get(self, parts, params):
+        service = self.server.service
+        query_date = parse_date(params.get("date"), today_str())
+        keyword = params.get("keyword")
+
+        if parts == ["positions"]:
+            return 200, service.positions(query_date, keyword)
+        if len(parts) == 3 and parts[0] == "options" and parts[2] == "history":
+            return 200, service.history(parts[1], query_date)
+        if parts == ["exposure"]:
+            date = parse_date(params["date"]) if params.get("date") else None
+            return 200, service.exposure(params.get("by", "code"), date, params.get("group"))
+        if parts == ["missing"]:
+            return 200, service.missing(query_date, keyword)
+        if len(parts) == 2 and parts[0] == "quotes":
+            return 200, service.quote(parts[1], query_date, params.get("field"))
+        if parts == ["options"]:
+            return 200, service.list_options()
+        if parts == ["status"]:
+            return 200, service.status()
+        if parts == ["stats"]:
+            return 200, stats.snapshot()
+        raise ServiceError(404, f"未知路径: /{'/'.join(parts)}")
+
+    def _handle_post(self, parts, params):
+        service = self.server.service
+        body = self._read_json()
+        wait = body.get("wait", True)
+
+        if parts == ["refresh"]:
+            future = service.refresh(parse_date(body.get("date"), today_str()),
+                                     body.get("option"), body.get("keyword"))
+        elif parts == ["close_amount"]:
+            future = service.set_close_amount(body.get("option"), parse_date(body.get("date")),
+                                              parse_number(body.get("amount"), "amount"))
+        elif parts == ["closes"]:
+            future = service.set_closes(body.get("rows"))
+        elif parts == ["close_price"]:
+            future = service.set_close_price(body.get("option"), parse_date(body.get("date")),
+                                             parse_number(body.get("price"), "price"))
+        else:
+            raise ServiceError(404, f"未知路径: /{'/'.join(parts)}")
+
+        if not wait:
+            return 202, {"queued": True}
+        return 200, future.result()
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            raise ServiceError(400, "请求体不是有效的JSON")
+        if not isinstance(body, dict):
+            raise ServiceError(400, "请求体必须是JSON对象")
+        return body
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -0,0 +1,173 @@
+"""期权数据的二进制快照格式
+
+JSON 数据文件按日期键的嵌套字典保存，大持仓启动时解析很慢。快照按列存放：
+
+    文件头   MAGIC(8字节) + 版本号(uint16) + 元数据长度(uint32)，小端
+    元数据   JSON：各期权的名称、代码、执行价格等和交易日数量，以及逐日字段的顺序
+    数据     所有期权的交易日依次连接：日期 int32 (YYYYMMDD)，
+            每个逐日字段一个状态数组 uint8（0 无数据、1 数值、2 N/A）和一个数值数组 float64
+
+读取时只解析元数据，交易日列表和逐日字段的字典在第一次访问时才由数组切片生成（SnapshotOption），
+启动时不必为所有期权建立几十万个字符串和字典项。不在交易日列表中的逐日数据（很少见）保存在元数据中。
+只依赖标准库。文件名以 SNAPSHOT_SUFFIX 结尾时按快照格式保存，读取时按文件头自动识别。
+"""
+import json
+import struct
+import sys
+from array import array
+
+
+MAGIC = b"DCESNAP\x00"
+VERSION = 1
+SNAPSHOT_SUFFIX = ".dcesnap"
+HEADER = struct.Struct("<HI")
+
+INFO_FIELDS = ("name", "code", "strike_price", "initial_amount", "daily_reversal")
+DAILY_FIELDS = ("close_prices", "actual_volumes", "close_amounts", "position_changes", "positions")
+
+ABSENT, NUMBER, NOT_AVAILABLE = 0, 1, 2
+
+
+def is_snapshot(head):
+    """head 为文件开头的若干字节"""
+    return head.startswith(MAGIC)
+
+
+def is_snapshot_file_name(file_name):
+    return file_name.lower().endswith(SNAPSHOT_SUFFIX)
+
+
+def _little_endian(data):
+    if sys.byteorder != "little":
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data
+
+
+def encode_snapshot(options):
+    """把 {期权名称: 期权} 编码为快照字节串"""
+    meta = []
+    dates = array('i')
+    flags = {field: bytearray() for field in DAILY_FIELDS}
+    values = {field: array('d') for field in DAILY_FIELDS}
+
+    for option in options.values():
+        trade_dates = option["trade_dates"]
+        info = {field: option[field] for field in INFO_FIELDS}
+        info["count"] = len(trade_dates)
+        dates.extend(int(date.replace("-", "")) for date in trade_dates)
+
+        trade_date_set = set(trade_dates)
+        for field in DAILY_FIELDS:
+            daily = option[field]
+            field_flags = flags[field]
+            field_values = values[field]
+            extra = {}
+            for date in trade_dates:
+                value = daily.get(date)
+                if isinstance(value, (int, float)):
+                    field_flags.append(NUMBER)
+                    field_values.append(value)
+                else:
+                    field_flags.append(NOT_AVAILABLE if value == "N/A" else ABSENT)
+                    field_values.append(0.0)
+                    if value is not None and value != "N/A":
+                        extra[date] = value
+            extra.update((date, value) for date, value in daily.items() if date not in trade_date_set)
+            if extra:
+                info.setdefault("extra", {})[field] = extra
+        meta.append(info)
+
+    header = json.dumps({"fields": DAILY_FIELDS, "count": len(dates), "options": meta},
+                        ensure_ascii=False).encode("utf-8")
+    parts = [MAGIC, HEADER.pack(VERSION, len(header)), header, _little_endian(dates).tobytes()]
+    for field in DAILY_FIELDS:
+        parts.append(bytes(flags[field]))
+        parts.append(_little_endian(values[field]).tobytes())
+    return b"".join(parts)
+
+
+class DateNames(dict):
+    """YYYYMMDD 整数 -> "YYYY-MM-DD"，同一日期只格式化一次、共用同一个字符串"""
+
+    def __missing__(self, value):
+        name = self[value] = f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+        return name
+
+
+class SnapshotOption(dict):
+    """从快照读取的期权，交易日列表和逐日字段在第一次通过 option[字段] 访问时生成
+
+    已发布的期权不会被原地修改，多个线程同时生成同一字段时得到的内容相同。
+    copy_option 复制时会访问全部逐日字段，得到的副本是普通字典。
+    """
+
+    __slots__ = ("_columns", "_start", "_end", "_extra")
+
+    def __missing__(self, field):
+        if field == "trade_dates":
+            date_ints, names = self._columns[field]
+            trade_dates = self[field] = [names[value] for value in date_ints[self._start:self._end]]
+            return trade_dates
+        if field not in DAILY_FIELDS:
+            raise KeyError(field)
+        field_flags, field_values = self._columns[field]
+        start, end = self._start, self._end
+        trade_dates = self["trade_dates"]
+        daily = dict(zip(trade_dates, field_values[start:end].tolist()))
+        flags_slice = field_flags[start:end]
+        if flags_slice.count(NUMBER) != end - start:
+            for flag, replacement in ((ABSENT, None), (NOT_AVAILABLE, "N/A")):
+                index = flags_slice.find(flag)
+                while index != -1:
+                    if replacement is None:
+                        del daily[trade_dates[index]]
+                    else:
+                        daily[trade_dates[index]] = replacement
+                    index = flags_slice.find(flag, index + 1)
+        daily.update(self._extra.get(field, {}))
+        self[field] = daily
+        return daily
+
+
+def decode_snapshot(data):
+    """解码快照字节串，返回 {期权名称: SnapshotOption}，格式不符时抛出 ValueError"""
+    if not is_snapshot(data):
+        raise ValueError("不是期权数据快照文件")
+    version, header_size = HEADER.unpack_from(data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"不支持的快照版本: {version}")
+    offset = len(MAGIC) + HEADER.size
+    header = json.loads(data[offset:offset + header_size].decode("utf-8"))
+    offset += header_size
+    count = header["count"]
+
+    view = memoryview(data)
+
+    def read(typecode, size):
+        nonlocal offset
+        column = array(typecode)
+        column.frombytes(view[offset:offset + count * size])
+        offset += count * size
+        if sys.byteorder != "little":
+            column.byteswap()
+        return column
+
+    columns = {"trade_dates": (read('i', 4), DateNames())}
+    for field in header["fields"]:
+        field_flags = data[offset:offset + count]
+        offset += count
+        columns[field] = (field_flags, read('d', 8))
+    if offset != len(data):
+        raise ValueError("快照文件长度不正确")
+
+    options = {}
+    start = 0
+    for info in header["options"]:
+        end = start + info.pop("count")
+        extra = info.pop("extra", {})
+        option = SnapshotOption(info)
+        option._columns, option._start, option._end, option._extra = columns, start, end, extra
+        options[option["name"]] = option
+        start = end
+    return options
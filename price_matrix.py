@@ -0,0 +1,162 @@
+"""合约 × 交易日的价格矩阵，以内存映射方式打开
+
+由行情缓存（quote_cache.json）构建，每次构建写入一个新的子目录，目录中的 CURRENT 文件记录当前使用的子目录：
+
+    CURRENT         当前构建的子目录名
+    build-xxxx/
+        values.npy  float64 [合约数, 交易日数]，无价格处为 NaN
+        mask.npy    bool    [合约数, 交易日数]，True 表示该合约当日无价格（N/A）
+        index.json  价格字段、合约列表和交易日列表
+
+三个文件写完后一次替换 CURRENT 切换到新构建，打开时先读 CURRENT，三个文件总是来自同一次构建；
+已打开（内存映射）的旧构建不被改写，Windows 上重建也不会因文件被占用而失败。
+
+打开时只读入索引，数组按需从文件映射，查找就是数组下标访问，不复制数据；
+多个进程打开同一矩阵时共用操作系统的页缓存，不必各自加载一份。
+
+    python main.py price-matrix --cache quote_cache.json --out price_matrix --field close
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from day_table import CLOSE
+
+
+VALUES_FILE = "values.npy"
+MASK_FILE = "mask.npy"
+INDEX_FILE = "index.json"
+CURRENT_FILE = "CURRENT"
+BUILD_PREFIX = "build-"
+
+
+def current_build_dir(directory):
+    """directory 中当前构建的子目录；没有 CURRENT 时为 directory 本身（旧版直接写在目录中的矩阵）"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return directory
+
+
+def _remove_old_builds(directory, keep):
+    """删除 keep 之外已完成的旧构建；仍被打开的（Windows 上无法删除）留到下次构建再删"""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if (name.startswith(BUILD_PREFIX) and name not in keep
+                and os.path.exists(os.path.join(path, INDEX_FILE))):
+            shutil.rmtree(path, ignore_errors=True)
+    for name in (VALUES_FILE, MASK_FILE, INDEX_FILE):  # 旧版直接写在目录中的矩阵
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def _write_build(build_dir, quote_cache, dates, contracts, field):
+    """把三个文件写入构建子目录，index.json 最后写入（有 index.json 的构建才是完整的）"""
+    row_of = {contract: index for index, contract in enumerate(contracts)}
+    values = np.lib.format.open_memmap(os.path.join(build_dir, VALUES_FILE), mode='w+', dtype=np.float64,
+                                       shape=(len(contracts), len(dates)))
+    values[:] = np.nan
+    for column, date in enumerate(dates):
+        table = quote_cache.get(date)
+        table_values = np.frombuffer(table.values, dtype=np.float64).reshape(len(table), len(table.fields))
+        rows = np.fromiter((row_of[contract] for contract in table.contracts), dtype=np.intp, count=len(table))
+        values[rows, column] = table_values[:, table.fields.index(field)]
+    values.flush()
+
+    with open(os.path.join(build_dir, MASK_FILE), 'wb') as f:
+        np.save(f, np.isnan(values))
+    del values
+
+    with open(os.path.join(build_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"field": field, "contracts": contracts, "dates": dates}, f, ensure_ascii=False)
+
+
+def build_price_matrix(quote_cache, directory, field=CLOSE):
+    """由行情缓存构建价格矩阵写入 directory，返回 (合约数, 交易日数)
+
+    写入新的构建子目录后替换 CURRENT 切换，保留上一次构建（可能有进程刚读到旧的 CURRENT 正在打开），更早的删除。
+    """
+    dates = [date for date in quote_cache.dates() if quote_cache.get(date).has_field(field)]
+    contracts = sorted({contract for date in dates for contract in quote_cache.get(date).contracts})
+    if not dates or not contracts:
+        raise ValueError(f"行情缓存中没有包含{field}的日行情表")
+
+    os.makedirs(directory, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=directory)
+    os.chmod(build_dir, 0o755)  # mkdtemp 只允许创建者读取，矩阵需要其他进程也能打开
+    try:
+        _write_build(build_dir, quote_cache, dates, contracts, field)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    previous = os.path.basename(current_build_dir(directory))
+    current_tmp = os.path.join(directory, CURRENT_FILE + ".tmp")
+    with open(current_tmp, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(build_dir))
+    os.replace(current_tmp, os.path.join(directory, CURRENT_FILE))
+    _remove_old_builds(directory, keep={os.path.basename(build_dir), previous})
+    return len(contracts), len(dates)
+
+
+class PriceMatrix:
+    """只读的价格矩阵，values 和 mask 是内存映射的 numpy 数组，打开后不受之后重建的影响"""
+
+    def __init__(self, directory):
+        try:
+            self._open(current_build_dir(directory))
+        except FileNotFoundError:
+            # 读到 CURRENT 之后该构建已被删除（期间又重建了两次），重新读取 CURRENT
+            self._open(current_build_dir(directory))
+        self.contract_index = {contract: row for row, contract in enumerate(self.contracts)}
+        self.date_index = {date: column for column, date in enumerate(self.dates)}
+
+    def _open(self, build_dir):
+        with open(os.path.join(build_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.field = index["field"]
+        self.contracts = index["contracts"]
+        self.dates = index["dates"]
+        self.values = np.load(os.path.join(build_dir, VALUES_FILE), mmap_mode='r')
+        self.mask = np.load(os.path.join(build_dir, MASK_FILE), mmap_mode='r')
+        shape = (len(self.contracts), len(self.dates))
+        if self.values.shape != shape or self.mask.shape != shape:
+            raise ValueError("价格矩阵文件与索引不一致，请重新构建")
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def lookup(self, contract, date):
+        """合约某日的价格，不在矩阵中或为N/A时返回None"""
+        row = self.contract_index.get(contract.strip().lower())
+        column = self.date_index.get(date)
+        if row is None or column is None or self.mask[row, column]:
+            return None
+        return float(self.values[row, column])
+
+    def series(self, contract):
+        """合约在全部交易日的 (价格, 掩码) 视图（不复制），合约不在矩阵中时返回None"""
+        row = self.contract_index.get(contract.strip().lower())
+        if row is None:
+            return None
+        return self.values[row], self.mask[row]
+
+    def lookup_many(self, contracts, dates):
+        """批量查找，返回 (价格, 掩码) 两个 [len(contracts), len(dates)] 数组
+
+        矩阵中没有的合约或日期在掩码中为True。
+        """
+        rows = np.array([self.contract_index.get(contract.strip().lower(), -1) for contract in contracts],
+                        dtype=np.intp)
+        columns = np.array([self.date_index.get(date, -1) for date in dates], dtype=np.intp)
+        grid = np.ix_(np.maximum(rows, 0), np.maximum(columns, 0))
+        values = self.values[grid]
+        mask = self.mask[grid] | (rows < 0)[:, None] | (columns < 0)[None, :]
+        return values, mask
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+
+from day_table import DayTable
+from perf_stats import stats
+
+
+class QuoteCache:
+    """大商所日行情表缓存：{交易日期: DayTable}
+
+    日行情表发布后不再变化，同一天的所有合约只需获取一次整张表，表中全部数值列都保留，
+    需要结算价、成交量等其他字段时不必重新获取。
+    指定 path 时以 JSON Lines 追加写入文件，启动时读回（defer_load=True 时由调用方稍后调用 load），供命令行预取和界面共用；
+    旧版只有收盘价的记录读回后只包含收盘价字段，需要其他字段时才重新获取该日。
+    没有任何合约的表（行情发布前网站返回的空表）不写入缓存，读回时也跳过，之后会重新获取。
+    """
+
+    def __init__(self, path=None, defer_load=False):
+        self.path = path
+        self._tables = {}
+        self._lock = threading.Lock()
+        self._date_locks = {}
+        self._fetched_at = {}  # {交易日期: 本进程获取该表的时间}，从文件读回的表没有记录
+        self.hits = 0
+        self.misses = 0
+        if path and not defer_load:
+            self.load()
+
+    def load(self):
+        """从文件读回已缓存的日行情表"""
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        table = DayTable.from_json(entry)
+                        if len(table):
+                            self._tables[entry["date"]] = table
+                    except (ValueError, KeyError):
+                        continue  # 写到一半的最后一行
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, date):
+        return date in self._tables
+
+    def get(self, date):
+        return self._tables.get(date)
+
+    def dates(self):
+        """已缓存的交易日期（升序）"""
+        return sorted(self._tables)
+
+    def value(self, date, contract, field):
+        """从缓存读取合约某日某字段的值，不访问网络；未缓存或值缺失时返回None"""
+        table = self._tables.get(date)
+        return None if table is None else table.get(contract.strip().lower(), field)
+
+    def put(self, date, table):
+        with self._lock:
+            self._tables[date] = table
+            self._fetched_at[date] = time.time()
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({"date": date, **table.to_json()}, ensure_ascii=False) + "\n")
+
+    def _cached(self, date, field, fresh_since=None):
+        table = self._tables.get(date)
+        if table is None or not len(table) or (field is not None and not table.has_field(field)):
+            return None
+        if fresh_since is not None and self._fetched_at.get(date, 0) < fresh_since:
+            return None
+        return table
+
+    def get_or_fetch(self, date, fetch, token=None, field=None, store=True, fresh_since=None):
+        """返回缓存的日行情表，没有（或缺少 field 字段）时调用 fetch() 获取（同一天只有一个线程获取）
+
+        fetch 返回None表示该日行情表尚不可用，不写入缓存；store=False（尚未发布的日期）或表中没有合约时
+        获取到的表只返回、不写入缓存。fresh_since 为时间戳时忽略在此之前获取的缓存，重新获取
+        （同一次刷新中每天只重新获取一次）。
+        """
+        table = self._cached(date, field, fresh_since)
+        if table is not None:
+            self.hits += 1
+            stats.count("quote_cache.hit")
+            return table
+
+        with self._lock:
+            date_lock = self._date_locks.setdefault(date, threading.Lock())
+        # 等待其他线程获取同一天的数据时也要响应取消
+        while not date_lock.acquire(timeout=0.05):
+            if token is not None and token.is_canceled():
+                return fetch()  # fetch 会立即抛出取消异常
+        try:
+            table = self._cached(date, field, fresh_since)
+            if table is not None:
+                self.hits += 1
+                stats.count("quote_cache.hit")
+                return table
+            self.misses += 1
+            stats.count("quote_cache.miss")
+            table = fetch()
+            if table is not None and store and len(table):
+                self.put(date, table)
+            return table
+        finally:
+            date_lock.release()
@@ -0,0 +1,238 @@
+"""头寸服务压力测试
+
+默认在进程内用合成持仓启动服务（不访问网络），也可以用 --url 指向已运行的服务。
+并发读的同时由一个写线程持续提交平仓量修改，输出各接口延迟分位数并与目标比较，
+超出目标时以非零状态退出。
+
+    python service_loadtest.py --options 500 --dates 250 --threads 8 --requests 4000
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import quote, urlparse
+
+
+# 目标 p99 延迟（毫秒）：500 个期权 × 250 个交易日的持仓，8 个并发读线程，每秒约 5 次写入
+TARGET_P99_MS = {
+    "positions": 100.0,
+    "history": 80.0,
+    "missing": 80.0,
+}
+
+
+def make_trade_dates(start, count):
+    dates = []
+    current = start
+    while len(dates) < count:
+        if current.weekday() < 5:
+            dates.append(current.strftime("%Y-%m-%d"))
+        current += timedelta(days=1)
+    return dates
+
+
+def make_synthetic_book(n_options, n_dates, na_rate=0.0, seed=0):
+    """生成合成持仓：约一半期权已到期，收盘价按 na_rate 比例为N/A"""
+    rng = random.Random(seed)
+    today = date.today()
+    options = {}
+    for i in range(n_options):
+        start = today - timedelta(days=rng.randint(0, n_dates * 2))
+        trade_dates = make_trade_dates(start, n_dates)
+        strike_price = float(rng.randint(2000, 5000))
+        initial_amount = float(rng.choice([-1, 1]) * rng.randint(10, 1000))
+        close_prices = {}
+        for trade_date in trade_dates:
+            if trade_date >= today.strftime("%Y-%m-%d"):
+                break
+            close_prices[trade_date] = "N/A" if rng.random() < na_rate else round(
+                strike_price * rng.uniform(0.9, 1.1), 1)
+        name = f"合成期权{i:05d}"
+        options[name] = {
+            "name": name,
+            "code": f"m{2400 + i % 12 + 1}",
+            "strike_price": strike_price,
+            "initial_amount": initial_amount,
+            "trade_dates": trade_dates,
+            "daily_reversal": -initial_amount / len(trade_dates),
+            "close_prices": close_prices,
+            "actual_volumes": {},
+            "close_amounts": {},
+            "position_changes": {},
+            "positions": {}
+        }
+    return options
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class LoadClient:
+    def __init__(self, base_url):
+        url = urlparse(base_url)
+        self.host, self.port = url.hostname, url.port
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # 连接被关闭时重连一次
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+        payload = response.read()
+        return response.status, payload
+
+
+def run_load(base_url, names, query_dates, threads, total_requests, write_interval, seed=0):
+    latencies = {endpoint: [] for endpoint in TARGET_P99_MS}
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+    stop_writer = threading.Event()
+
+    def reader(worker_id):
+        rng = random.Random(seed + worker_id)
+        client = LoadClient(base_url)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            query_date = rng.choice(query_dates)
+            roll = rng.random()
+            if roll < 0.5:
+                endpoint, path = "positions", f"/positions?date={query_date}"
+            elif roll < 0.9:
+                endpoint, path = "history", f"/options/{quote(rng.choice(names))}/history?date={query_date}"
+            else:
+                endpoint, path = "missing", f"/missing?date={query_date}"
+            started = time.perf_counter()
+            status, _ = client.request("GET", path)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies[endpoint].append(elapsed)
+                if status != 200:
+                    errors.append((path, status))
+
+    def writer():
+        rng = random.Random(seed - 1)
+        client = LoadClient(base_url)
+        while not stop_writer.wait(write_interval):
+            name = rng.choice(names)
+            status, payload = client.request("GET", f"/options/{quote(name)}/history?date=9999-12-31")
+            rows = json.loads(payload)["rows"]
+            if not rows:
+                continue
+            row = rng.choice(rows)
+            client.request("POST", "/close_amount",
+                           {"option": name, "date": row["date"], "amount": rng.randint(-5, 5), "wait": False})
+
+    reader_threads = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+    writer_thread = threading.Thread(target=writer) if write_interval > 0 else None
+
+    started = time.perf_counter()
+    if writer_thread:
+        writer_thread.start()
+    for thread in reader_threads:
+        thread.start()
+    for thread in reader_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop_writer.set()
+    if writer_thread:
+        writer_thread.join()
+
+    return latencies, errors, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="头寸服务压力测试")
+    parser.add_argument("--url", help="已运行的服务地址，不指定则在进程内用合成持仓启动")
+    parser.add_argument("--options", type=int, default=500, help="合成持仓的期权数量")
+    parser.add_argument("--dates", type=int, default=250, help="每个期权的交易日数量")
+    parser.add_argument("--na-rate", type=float, default=0.01, help="合成收盘价中N/A的比例")
+    parser.add_argument("--threads", type=int, default=8, help="并发读线程数")
+    parser.add_argument("--requests", type=int, default=4000, help="读请求总数")
+    parser.add_argument("--write-interval", type=float, default=0.2, help="写请求间隔秒数，0表示不写")
+    parser.add_argument("--json", help="将结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    service = None
+    tmp_dir = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        from position_engine import PositionEngine
+        from position_service import PositionService
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        engine = PositionEngine(os.path.join(tmp_dir.name, "options_data.json"))
+        engine.options = make_synthetic_book(args.options, args.dates, args.na_rate)
+        service = PositionService(engine=engine, port=0)
+        service.start()
+        base_url = service.address
+
+    status, payload = LoadClient(base_url).request("GET", "/status")
+    if status != 200:
+        print(f"无法连接服务: {base_url}")
+        return 2
+    print(f"服务 {base_url}，期权数量 {json.loads(payload)['options']}")
+
+    client = LoadClient(base_url)
+    status, payload = client.request("GET", "/options")
+    names = [option["name"] for option in json.loads(payload)["options"]]
+    if not names:
+        print("服务中没有期权数据")
+        return 2
+    today = date.today()
+    query_dates = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(0, 60)]
+
+    latencies, errors, elapsed = run_load(base_url, names, query_dates, args.threads,
+                                          args.requests, args.write_interval)
+
+    report = {"url": base_url, "threads": args.threads, "requests": args.requests,
+              "elapsed_s": elapsed, "throughput_rps": args.requests / elapsed if elapsed else 0.0,
+              "errors": len(errors), "endpoints": {}}
+    failed = bool(errors)
+    print(f"总耗时 {elapsed:.2f}s，吞吐 {report['throughput_rps']:.0f} req/s，错误 {len(errors)}")
+    for endpoint, values in latencies.items():
+        stats = {"count": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95),
+                 "p99_ms": percentile(values, 99), "max_ms": max(values) if values else 0.0,
+                 "target_p99_ms": TARGET_P99_MS[endpoint]}
+        report["endpoints"][endpoint] = stats
+        ok = stats["p99_ms"] <= stats["target_p99_ms"]
+        failed = failed or not ok
+        print(f"{endpoint:<10} n={stats['count']:<6} p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms "
+              f"p99={stats['p99_ms']:.1f}ms (目标 {stats['target_p99_ms']:.0f}ms) {'OK' if ok else '超出目标'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+
+    if service:
+        service.shutdown()
+        tmp_dir.cleanup()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import threading
+
+
+# 优先级：数值越小越先执行
+INTERACTIVE = 0  # 查询、修改、保存
+BACKGROUND = 1  # 重新获取市场数据
+PREFETCH = 2  # 预取、缓存预热
+
+PRIORITY_NAMES = {INTERACTIVE: "交互", BACKGROUND: "后台", PREFETCH: "预取"}
+
+
+class CancelToken:
+    """协作式取消标记，任务在合适的位置检查 is_canceled()
+
+    阻塞在网络请求上的代码可以用 add_callback 注册取消回调，取消时立即中止等待。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def is_canceled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback):
+        """取消时调用 callback()；已取消则立即调用"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class ScheduledTask:
+    """调度器中的一个任务，可等待结果或注册完成回调"""
+
+    def __init__(self, fn, priority, key, token, anonymous=False):
+        self.fn = fn
+        self.priority = priority
+        self.key = key
+        self.token = token
+        self.anonymous = anonymous  # 取消标记由调度器创建（提交时未传入）
+        self.state = "queued"  # queued / running / done / canceled
+        self.result = None
+        self.error = None
+        self._callbacks = []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """任务结束（完成、失败或取消）后调用 callback(task)；已结束则立即调用"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        self.token.cancel()
+
+    def _finish(self, state, result=None, error=None):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.state = state
+            self.result = result
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class TaskScheduler:
+    """共享工作线程池 + 优先级队列
+
+    交互任务总是排在后台和预取任务之前，并保留 reserved_interactive 个线程只给交互任务用，
+    刷新等长时间的后台任务只占用其余线程，交互任务不必等待它们结束即可开始。
+    带 key 且取消标记相同（或都未传入取消标记）的任务在排队期间重复提交会合并为同一个任务；
+    取消标记不同时分别排队，各自的 drain/cancel 只影响自己的任务。
+    """
+
+    def __init__(self, workers=4, reserved_interactive=1):
+        self.workers = max(1, workers)
+        self.reserved_interactive = min(reserved_interactive, self.workers - 1)
+        self._queue = []  # [(优先级, 序号, 任务)]
+        self._pending = {}  # {key: 排队中的任务}
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._running_background = 0
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = [threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, priority=BACKGROUND, key=None, token=None):
+        """提交任务 fn(token)，返回 ScheduledTask；key 和取消标记都相同的排队任务直接复用
+
+        shutdown 之后只接受交互任务，其他任务直接标记为已取消。
+        """
+        with self._cond:
+            if self._shutdown and priority != INTERACTIVE:
+                task = ScheduledTask(fn, priority, key, token or CancelToken(), anonymous=token is None)
+                task._finish("canceled")
+                return task
+            if key is not None:
+                existing = self._pending.get(key)
+                if (existing is not None and not existing.token.is_canceled()
+                        and (existing.token is token or (token is None and existing.anonymous))):
+                    return existing
+            task = ScheduledTask(fn, priority, key, token or CancelToken(), anonymous=token is None)
+            heapq.heappush(self._queue, (priority, next(self._counter), task))
+            self._depth[priority] += 1
+            if key is not None:
+                self._pending[key] = task
+            self._cond.notify()
+            return task
+
+    def queue_depth(self):
+        """各优先级排队中的任务数 {优先级: 数量}"""
+        with self._cond:
+            return dict(self._depth)
+
+    def drain(self, token):
+        """移除所有使用该取消标记的排队任务并标记为已取消，返回移除的数量"""
+        with self._cond:
+            drained = [task for _, _, task in self._queue if task.token is token]
+            if not drained:
+                return 0
+            self._queue = [entry for entry in self._queue if entry[2].token is not token]
+            heapq.heapify(self._queue)
+            for task in drained:
+                self._depth[task.priority] -= 1
+                if task.key is not None and self._pending.get(task.key) is task:
+                    del self._pending[task.key]
+        for task in drained:
+            task._finish("canceled")
+        return len(drained)
+
+    def shutdown(self, wait=True):
+        """停止调度器：排队中的后台和预取任务标记为已取消，交互任务（如保存）仍会执行完再退出"""
+        with self._cond:
+            self._shutdown = True
+            dropped = [task for _, _, task in self._queue if task.priority != INTERACTIVE]
+            self._queue = [entry for entry in self._queue if entry[0] == INTERACTIVE]
+            heapq.heapify(self._queue)
+            for task in dropped:
+                self._depth[task.priority] -= 1
+                if task.key is not None and self._pending.get(task.key) is task:
+                    del self._pending[task.key]
+            self._cond.notify_all()
+        for task in dropped:
+            task._finish("canceled")
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _next_task(self):
+        with self._cond:
+            while True:
+                if self._shutdown and not self._queue:
+                    return None
+                if self._queue:
+                    priority, _, task = self._queue[0]
+                    background_slots = self.workers - self.reserved_interactive
+                    if priority == INTERACTIVE or self._running_background < background_slots:
+                        heapq.heappop(self._queue)
+                        self._depth[priority] -= 1
+                        if task.key is not None and self._pending.get(task.key) is task:
+                            del self._pending[task.key]
+                        if priority != INTERACTIVE:
+                            self._running_background += 1
+                        return task
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            try:
+                if task.token.is_canceled():
+                    task._finish("canceled")
+                    continue
+                task.state = "running"
+                try:
+                    result = task.fn(task.token)
+                except Exception as e:
+                    task._finish("done", error=e)
+                else:
+                    task._finish("canceled" if task.token.is_canceled() else "done", result)
+            finally:
+                if task.priority != INTERACTIVE:
+                    with self._cond:
+                        self._running_background -= 1
+                        self._cond.notify()